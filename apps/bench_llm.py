@@ -0,0 +1,176 @@
+"""
+LLM benchmark built on `create_chat.run_model`
+
+Sweeps models, prompt sizes and concurrency levels and records for every request the time
+to first token, the total latency and the generation speed from Ollama's counters
+(eval_count / eval_duration). Every request is tagged in the resource sampler, so the
+CPU-seconds and peak RSS of the ollama server and of this process are attributed per
+request; the host peak CPU/RAM is also kept.
+The report is a table with one row per (model, prompt size, concurrency), saved as CSV
+and JSON so runs can be compared.
+
+# Required packages:
+pip install ollama==0.4.7 asyncio==3.4.3 tqdm==4.67.1 psutil==7.0.0
+
+# Run against the local ollama
+python ./apps/bench_llm.py --models qwen2.5-coder:1.5b qwen2.5-coder:3b --concurrency 1 2 4
+
+# Two ollama servers behind the shared pool
+python ./apps/bench_llm.py --hosts http://localhost:11434 http://localhost:11435 --routing least_loaded
+
+# Run against the mock server (CI, no models needed)
+python ./apps/bench_llm.py --mock --requests 4
+"""
+import argparse
+import asyncio
+import csv
+import json
+import statistics
+import time
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional
+
+from ollama import AsyncClient
+
+from create_chat import content, run_model
+from mock_ollama import MockOllama
+from model_residency import ModelResidency
+from ollama_pool import OllamaPool
+from resource_sampler import ResourceSampler
+
+MODELS = ["qwen2.5-coder:1.5b", "qwen2.5-coder:3b", "qwen2.5-coder:7b", "qwen2.5-coder:14b", "qwen2.5-coder:32b"]
+
+# Prompt sizes built from the create_chat content
+PROMPTS = {
+  "small": content.strip().split("\n\n")[0] + "\n\nSummarize what Chat is in one sentence.",
+  "medium": content,
+  "large": content + "\n\nExtra context:\n" + content * 3,
+}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+  if not values:
+    return None
+  values = sorted(values)
+  return values[min(int(round(q * (len(values) - 1))), len(values) - 1)]
+
+
+async def run_cell(client: AsyncClient, sampler: ResourceSampler, model: str, prompt_size: str,
+                   concurrency: int, requests: int) -> Dict[str, Any]:
+  """Run `requests` requests with at most `concurrency` at the same time"""
+  prompt = PROMPTS[prompt_size]
+  semaphore = asyncio.Semaphore(concurrency)
+  results: List[Dict[str, Any]] = []
+  errors = 0
+
+  async def one():
+    nonlocal errors
+    async with semaphore:
+      metrics: Dict[str, Any] = {}
+      try:
+        with sampler.request(f"{model}/{prompt_size}/c{concurrency}") as usage:
+          await run_model(model, prompt, client=client, metrics=metrics)
+        metrics['usage'] = usage
+        results.append(metrics)
+      except Exception:
+        errors += 1
+
+  first_sample = sampler.sample_count
+  start = time.perf_counter()
+  await asyncio.gather(*[one() for _ in range(requests)])
+  elapsed = time.perf_counter() - start
+  samples = sampler.rows(last=sampler.sample_count - first_sample)
+
+  ttft = [r["ttft_s"] for r in results]
+  latency = [r["latency_s"] for r in results]
+  speed = [r["tokens_per_s"] for r in results if r.get("tokens_per_s")]
+  prompt_tokens = [r["prompt_eval_count"] for r in results if r.get("prompt_eval_count")]
+  generated = sum(r.get("eval_count") or 0 for r in results)
+  # Should stay 0: a load inside a cell means the model was evicted during the benchmark
+  load_s = sum((r.get("load_duration") or 0) / 1e9 for r in results)
+
+  def ms(value):
+    return round(value * 1000, 1) if value is not None else None
+
+  row = {
+    "model": model,
+    "prompt_size": prompt_size,
+    "prompt_chars": len(prompt),
+    "prompt_tokens": round(statistics.fmean(prompt_tokens)) if prompt_tokens else None,
+    "concurrency": concurrency,
+    "requests": requests,
+    "errors": errors,
+    "load_ms": ms(load_s),
+    "ttft_p50_ms": ms(percentile(ttft, 0.50)),
+    "ttft_p95_ms": ms(percentile(ttft, 0.95)),
+    "latency_p50_ms": ms(percentile(latency, 0.50)),
+    "latency_p95_ms": ms(percentile(latency, 0.95)),
+    "latency_p99_ms": ms(percentile(latency, 0.99)),
+    "tokens_per_s": round(statistics.fmean(speed), 1) if speed else None,
+    "aggregate_tokens_per_s": round(generated / elapsed, 1) if elapsed else None,
+    "requests_per_s": round(len(results) / elapsed, 3) if elapsed else None,
+    "peak_cpu_percent": max((sample["system_cpu_percent"] for sample in samples), default=None),
+    "peak_ram_percent": max((sample["system_ram_percent"] for sample in samples), default=None),
+  }
+  for name in sampler.names:
+    cpu_s = [r["usage"].cpu_s[name] for r in results]
+    row[f"{name}_cpu_s_per_request"] = round(statistics.fmean(cpu_s), 4) if cpu_s else None
+    row[f"{name}_peak_rss_mb"] = round(max(r["usage"].peak_rss[name] for r in results) / 2**20, 1) if results else None
+  return row
+
+
+async def run_benchmark(pool: OllamaPool, models: List[str], prompt_sizes: List[str],
+                        concurrency_levels: List[int], requests: int, sampler: ResourceSampler) -> List[Dict[str, Any]]:
+  client = pool.async_client()
+  residency = ModelResidency(pool)
+  rows = []
+  # Models already loaded first, so the first one is not loaded and evicted for nothing
+  for model in residency.order_by_residency(models, lambda name: name):
+    # Warm-up so the model load time is not part of the first cell
+    warmup: Dict[str, Any] = {}
+    await run_model(model, "hi", client=client, metrics=warmup)
+    warmup_load_ms = round((warmup.get("load_duration") or 0) / 1e6, 1)
+    print(f"{model} loaded in {warmup_load_ms}ms")
+    for size in prompt_sizes:
+      for concurrency in concurrency_levels:
+        row = await run_cell(client, sampler, model, size, concurrency, max(requests, concurrency))
+        row["warmup_load_ms"] = warmup_load_ms
+        rows.append(row)
+        print(f"{model} {size:>6} c={concurrency:<3} ttft p50={row['ttft_p50_ms']}ms "
+              f"latency p95={row['latency_p95_ms']}ms {row['tokens_per_s']} tok/s errors={row['errors']}")
+  return rows
+
+
+def write_report(rows: List[Dict[str, Any]], output: str):
+  """Save the rows as `<output>.json` and `<output>.csv`"""
+  with open(f"{output}.json", "w", encoding="utf-8") as f:
+    json.dump(rows, f, indent=2)
+  if rows:
+    with open(f"{output}.csv", "w", newline="", encoding="utf-8") as f:
+      writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+      writer.writeheader()
+      writer.writerows(rows)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark ollama models")
+  parser.add_argument("--models", nargs="+", default=MODELS)
+  parser.add_argument("--prompt-sizes", nargs="+", choices=list(PROMPTS), default=list(PROMPTS))
+  parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4])
+  parser.add_argument("--requests", type=int, default=8, help="requests per cell (at least the concurrency)")
+  parser.add_argument("--hosts", nargs="+", default=None, help="ollama urls, default OLLAMA_HOSTS / OLLAMA_HOST")
+  parser.add_argument("--routing", choices=["round_robin", "least_loaded"], default=None)
+  parser.add_argument("--mock", type=int, nargs="?", const=1, default=0, metavar="SERVERS",
+                      help="run against local mock ollama servers (1 by default)")
+  parser.add_argument("--output", default="bench_llm_report")
+  parser.add_argument("--sample-interval", type=float, default=0.05, help="seconds between cpu/memory samples")
+  args = parser.parse_args()
+
+  with ResourceSampler(interval_s=args.sample_interval) as resource_sampler, ExitStack() as servers:
+    hosts = [servers.enter_context(MockOllama()) for _ in range(args.mock)] or args.hosts
+    pool = OllamaPool(hosts, routing=args.routing)
+    rows = asyncio.run(run_benchmark(pool, args.models, args.prompt_sizes, args.concurrency, args.requests, resource_sampler))
+  print(f"Ollama pool: {pool.stats()}")
+  write_report(rows, args.output)
+  resource_sampler.export_csv(f"{args.output}_samples.csv")
+  print(f"Report saved in {args.output}.json, {args.output}.csv and {args.output}_samples.csv")
@@ -0,0 +1,165 @@
+"""
+Cost and latency per email of every routing policy of the Spam Email Checker
+
+Runs the same emails through the graph of spam_checker.py once per policy (single, large,
+escalate, escalate+skip) and reports per email: latency, model calls, prompt/eval tokens
+and inference time (prompt_eval_duration + eval_duration), with the escalation rate and the
+drafts skipped. When the emails have labels (`is_spam`, `category`) the accuracy is
+reported too. The LLM cache is disabled, so every policy pays all its calls.
+
+Runs against the mock Ollama server unless --host is given. In the mock the large model
+generates slower (--large-tokens-per-s), the classifier confidence is pseudo random and
+the prefix shared with a recent prompt is not evaluated again, like the prompt cache of
+Ollama (--no-prompt-cache turns it off). The prompt tokens are the evaluated ones.
+
+# Required packages:
+pip install langgraph==0.3.19 langchain-ollama==0.3.0 langchain-core==0.3.48
+
+# Run
+python ./apps/bench_routing.py
+python ./apps/bench_routing.py --source ./labeled.jsonl --host http://localhost:11434
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from typing import Any, Dict, List
+
+from mock_ollama import MockOllama
+
+# Legitimate emails that the pre-filter can't decide, plus one obvious of each kind
+SAMPLE_EMAILS = [
+    {"id": "1", "sender": "anna@example.com", "subject": "Question about the meetup",
+     "body": "Hi Bob, is the meetup next Thursday still on? Could you send me the address?",
+     "is_spam": False, "category": "inquiry"},
+    {"id": "2", "sender": "shop@example.net", "subject": "Your order was delayed again",
+     "body": "Hello, this is the third time my order arrives late, I want to know what is going on.",
+     "is_spam": False, "category": "complaint"},
+    {"id": "3", "sender": "carla@example.org", "subject": "Thanks!",
+     "body": "Thank you for the talk yesterday, it was great to see you.",
+     "is_spam": False, "category": "thank you"},
+    {"id": "4", "sender": "news@example.com", "subject": "Office closed on Monday",
+     "body": "The office will be closed on Monday for maintenance.",
+     "is_spam": False, "category": "information"},
+    {"id": "5", "sender": "dan@example.com", "subject": "Review my PR",
+     "body": "Could you review my pull request before Friday? It changes the build scripts.",
+     "is_spam": False, "category": "request"},
+    {"id": "6", "sender": "prize@winner.xyz", "subject": "You won",
+     "body": "Claim your prize now, send us your details to receive the money.",
+     "is_spam": True, "category": None},
+    {"id": "7", "sender": "security@bank-verify.top", "subject": "Account suspended!!",
+     "body": "URGENT: your account suspended. Verify your account with your password at http://bit.ly/x "
+             "to get your FREE cash prize, click here, limited time!!",
+     "is_spam": True, "category": None},
+    {"id": "8", "sender": "notifications@github.com", "subject": "New comment on your issue",
+     "body": "A new comment was added: https://github.com/org/repo/issues/1",
+     "is_spam": False, "category": "information"},
+]
+
+
+def load_emails(source: str) -> List[Dict[str, Any]]:
+    from spam_batch import iter_emails
+    return list(iter_emails(source))
+
+
+def accuracy(records: List[Dict[str, Any]], emails: List[Dict[str, Any]]) -> Dict[str, Any]:
+    labels = {email["id"]: email for email in emails if "is_spam" in email}
+    spam_ok = category_ok = labeled = 0
+    for record in records:
+        label = labels.get(record["id"])
+        if label is None or record.get("error"):
+            continue
+        labeled += 1
+        spam_ok += record["is_spam"] == label["is_spam"]
+        category_ok += record["is_spam"] == label["is_spam"] and record["email_category"] == label.get("category")
+    if not labeled:
+        return {}
+    return {"spam_accuracy": round(spam_ok / labeled, 3), "category_accuracy": round(category_ok / labeled, 3)}
+
+
+async def run_policy(policy: str, emails: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    from model_residency import get_residency
+    from spam_batch import ThroughputStats, process_email
+    from spam_checker import declare_models
+
+    declare_models(policy)
+    await asyncio.to_thread(get_residency().preload)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = ThroughputStats()
+
+    async def one(email):
+        async with semaphore:
+            return await process_email(email, policy)
+
+    records = await asyncio.gather(*[one(email) for email in emails])
+    for record in records:
+        stats.add(record)
+    summary = stats.summary()
+    total = len(records)
+    tokens = sum(model["prompt_tokens"] + model["eval_tokens"] for model in summary["per_model"].values())
+    return {
+        "policy": policy,
+        "emails": total,
+        "errors": summary["errors"],
+        "latency_mean_s": summary["latency_mean_s"],
+        "latency_p95_s": summary["latency_p95_s"],
+        "calls_per_email": summary["calls_per_email"],
+        "tokens_per_email": round(tokens / total, 1) if total else None,
+        "prompt_tokens_per_email": summary["prompt_tokens_per_email"],
+        "prompt_eval_s_per_email": summary["prompt_eval_s_per_email"],
+        "inference_s_per_email": summary["inference_s_per_email"],
+        "escalation_rate": summary["escalation_rate"],
+        "drafts_skipped": summary["drafts_skipped"],
+        "per_model": summary["per_model"],
+        **accuracy(records, emails),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost and latency per email of each routing policy")
+    parser.add_argument("--source", default=None, help="mbox, Maildir or JSONL (with optional is_spam/category labels)")
+    parser.add_argument("--policies", nargs="+", default=None, help="routing policies, all by default")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--host", default=None, help="real ollama url, the mock server by default")
+    parser.add_argument("--tokens-per-s", type=float, default=500.0, help="mock speed of the tiny model")
+    parser.add_argument("--large-tokens-per-s", type=float, default=150.0, help="mock speed of the large model")
+    parser.add_argument("--no-prompt-cache", action="store_true", help="the mock evaluates every prompt from scratch")
+    parser.add_argument("--output", default=None, help="JSON file for the report")
+    args = parser.parse_args()
+
+    server = None
+    if args.host is None:
+        server = MockOllama(tokens=60, tokens_per_s=args.tokens_per_s, prompt_cache=not args.no_prompt_cache)
+        os.environ["OLLAMA_HOST"] = server.start()
+    else:
+        os.environ["OLLAMA_HOST"] = args.host
+
+    # The pool reads OLLAMA_HOST when spam_checker creates its models
+    import spam_checker
+    if server is not None:
+        server.model_tokens_per_s = {spam_checker.LARGE_MODEL: args.large_tokens_per_s}
+    spam_checker.response_cache = None
+
+    emails = load_emails(args.source) if args.source else SAMPLE_EMAILS
+
+    async def run_all():
+        # One event loop for all the policies, the async clients of the pool are bound to it
+        return [await run_policy(policy, emails, args.concurrency)
+                for policy in args.policies or list(spam_checker.ROUTING_POLICIES)]
+
+    report = asyncio.run(run_all())
+
+    print(f"\n{len(emails)} emails per policy")
+    print(f"{'policy':<14} {'mean_s':>7} {'p95_s':>7} {'calls':>6} {'tokens':>7} {'prompt':>7} {'prompt_s':>9} "
+          f"{'infer_s':>8} {'escal':>6} {'skip':>5} {'acc':>6}")
+    for row in report:
+        print(f"{row['policy']:<14} {row['latency_mean_s']:>7} {row['latency_p95_s']:>7} {row['calls_per_email']:>6} "
+              f"{row['tokens_per_email']:>7} {row['prompt_tokens_per_email']:>7} {row['prompt_eval_s_per_email']:>9} "
+              f"{row['inference_s_per_email']:>8} {str(row['escalation_rate']):>6} "
+              f"{row['drafts_skipped']:>5} {str(row.get('spam_accuracy', '-')):>6}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if server is not None:
+        server.stop()
@@ -8,15 +8,28 @@ pip install ollama==0.4.7 asyncio==3.4.3 tqdm==4.67.1 psutil==7.0.0
 
 # Run app
 python ./apps/create_chat.py
+
+# Print the answer as it is generated (and save it), Ctrl+C keeps the partial answer
+python ./apps/create_chat.py --stream --output ./answer.md
+
+# Save the cpu/memory samples of this process and the ollama server
+python ./apps/create_chat.py --sample-interval 0.05 --samples ./usage.csv
 """
+import argparse
 import asyncio
+import sys
 import time
+from typing import Any, Dict, List, Optional, Sequence, TextIO
 from tqdm import tqdm
-import psutil
 from ollama import AsyncClient
 
+from model_residency import get_residency
+from ollama_pool import get_pool
+from resource_sampler import RequestUsage, ResourceSampler
+
 # NOTE: Remember to download the model inside the container first.
 LLM_MODEL="qwen2.5-coder:1.5b"  # 1.5b 3b 7b 14b 32b
+LLM_KEEP_ALIVE="30m"
 
 # An example of content to be processed
 content="""
@@ -58,40 +71,142 @@ you will create all the required endpoints and use MongoDB as the database.
 - add unit testing to all functionality
 """
 
-async def run_model():
+async def stream_model(model: str = LLM_MODEL, prompt: str = content, client: Optional[AsyncClient] = None,
+                       outputs: Sequence[TextIO] = (), metrics: Optional[Dict[str, Any]] = None) -> str:
+  """
+  Run model with the content and write every token to `outputs` as soon as it arrives
+
+  If the task is cancelled (Ctrl+C) the tokens received so far are already written and
+  flushed, `metrics` is filled with `cancelled=True` and the CancelledError is raised again.
+
+  :param model: str: ollama model
+  :param prompt: str: user message
+  :param client: Optional[AsyncClient]: client to use, the shared pooled client by default
+  :param outputs: Sequence[TextIO]: streams to write the tokens to (stdout, files)
+  :param metrics: Optional[Dict]: filled with time to first token, inter-token latency, token rate and Ollama counters
+  """
+  client = client or get_pool().async_client()
+  residency = get_residency()
+  keep_alive = residency.keep_alive(model) or residency.declare(model, LLM_KEEP_ALIVE)
+  start = time.perf_counter()
+  first_token_at = last_token_at = None
+  gaps: List[float] = []
+  parts: List[str] = []
+  final: Dict[str, Any] = {}
+  cancelled = False
+  try:
+    async for chunk in await client.chat(model=model, stream=True, keep_alive=keep_alive, messages=[
+      {
+        'role': 'user',
+        'content': prompt,
+      },
+    ]):
+      text = chunk['message']['content']
+      if text:
+        now = time.perf_counter()
+        if first_token_at is None:
+          first_token_at = now
+        else:
+          gaps.append(now - last_token_at)
+        last_token_at = now
+        parts.append(text)
+        for output in outputs:
+          output.write(text)
+          output.flush()
+      if chunk.get('done'):
+        final = chunk
+        residency.record(model, final)
+  except (asyncio.CancelledError, KeyboardInterrupt):
+    cancelled = True
+    raise
+  finally:
+    for output in outputs:
+      output.flush()
+    if metrics is not None:
+      end = time.perf_counter()
+      metrics['cancelled'] = cancelled
+      metrics['ttft_s'] = (first_token_at or end) - start
+      metrics['latency_s'] = end - start
+      metrics['chunks'] = len(parts)
+      metrics['chars'] = sum(len(part) for part in parts)
+      if gaps:
+        gaps.sort()
+        metrics['itl_mean_s'] = sum(gaps) / len(gaps)
+        metrics['itl_p50_s'] = gaps[len(gaps) // 2]
+        metrics['itl_p95_s'] = gaps[min(int(len(gaps) * 0.95), len(gaps) - 1)]
+        metrics['itl_max_s'] = gaps[-1]
+      for field in ('prompt_eval_count', 'prompt_eval_duration', 'eval_count', 'eval_duration', 'load_duration', 'total_duration'):
+        metrics[field] = final.get(field)
+      if final.get('eval_count') and final.get('eval_duration'):
+        metrics['tokens_per_s'] = final['eval_count'] / (final['eval_duration'] / 1e9)
+      elif len(parts) > 1:
+        # Cancelled before the final counters: one chunk is one token
+        metrics['tokens_per_s'] = (len(parts) - 1) / (last_token_at - first_token_at)
+  return ''.join(parts)
+
+async def run_model(model: str = LLM_MODEL, prompt: str = content,
+                    client: Optional[AsyncClient] = None, metrics: Optional[Dict[str, Any]] = None):
   """
   Run model with the content
+
+  :param model: str: ollama model
+  :param prompt: str: user message
+  :param client: Optional[AsyncClient]: client to use, the shared pooled client by default
+  :param metrics: Optional[Dict]: filled with time to first token, latency and Ollama counters
   """
-  response = await AsyncClient().chat(model=LLM_MODEL, messages=[
-    {
-      'role': 'user',
-      'content': content,
-    },
-  ])
-  return response['message']['content']
-  
-async def check_cpu_mem_usage():
+  # Streamed so we know when the first token arrives, the result is the same
+  return await stream_model(model, prompt, client=client, metrics=metrics)
+
+def print_stream_metrics(metrics: Dict[str, Any]):
   """
-  CPU & RAM stats from https://stackoverflow.com/questions/276052/how-to-get-current-cpu-and-ram-usage-in-python
+  Summary of the stream_model metrics
   """
-  with tqdm(total=100, desc='cpu%', position=1) as cpubar, tqdm(total=100, desc='ram%', position=0) as rambar:
+  def ms(field):
+    value = metrics.get(field)
+    return f"{value * 1000:.1f}ms" if value is not None else "-"
+  state = "cancelled" if metrics.get('cancelled') else "done"
+  rate = metrics.get('tokens_per_s')
+  print(f"[{state}] ttft={ms('ttft_s')} itl mean={ms('itl_mean_s')} p50={ms('itl_p50_s')} p95={ms('itl_p95_s')} "
+        f"max={ms('itl_max_s')} rate={f'{rate:.1f} tok/s' if rate else '-'} chunks={metrics.get('chunks', 0)} "
+        f"latency={ms('latency_s')}")
+
+async def show_usage(sampler: ResourceSampler, refresh_s: float = 0.5):
+  """
+  tqdm bars with the last sample: host cpu/ram and the cpu of every sampled process
+  """
+  bars = {'system_ram_percent': 'ram%', 'system_cpu_percent': 'cpu%'}
+  bars.update({f'{name}_cpu_percent': f'{name} cpu%' for name in sampler.names})
+  progress = [tqdm(total=100, desc=desc, position=i) for i, desc in enumerate(bars.values())]
+  try:
     while True:
-      rambar.n=psutil.virtual_memory().percent
-      cpubar.n=psutil.cpu_percent()
-      cpubar.refresh()
-      rambar.refresh()
-      await asyncio.sleep(0.5)
+      latest = sampler.latest()
+      if latest:
+        for bar, field in zip(progress, bars):
+          bar.n = round(latest[field], 1)
+          bar.refresh()
+      await asyncio.sleep(refresh_s)
+  finally:
+    for bar in progress:
+      bar.close()
+
+def print_usage(usage: RequestUsage):
+  """
+  CPU-seconds and peak memory attributed to a request, per sampled process
+  """
+  for name, cpu_s in usage.cpu_s.items():
+    print(f"{name}: cpu={cpu_s:.2f}s peak rss={usage.peak_rss[name] / 2**20:.1f}MB")
 
-async def main():
+async def main(sampler: ResourceSampler):
   """
   Run app async
   """
   delta_t = time.time()
-  tasks = [
-    asyncio.create_task(check_cpu_mem_usage()),
-    asyncio.create_task(run_model())
-  ]
-  done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+  with sampler.request('run_model') as usage:
+    tasks = [
+      asyncio.create_task(show_usage(sampler)),
+      asyncio.create_task(run_model())
+    ]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
   for td in done:
     result = td.result()
 
@@ -105,7 +220,54 @@ async def main():
     print("="*50 + "\n    Application Result:\n"+ "="*50)
     print(result)
     print(f"Processing time: {time.time() - delta_t} seconds")
+    print_usage(usage)
+
+async def main_stream(sampler: ResourceSampler, output_file: Optional[str], to_stdout: bool, metrics: Dict[str, Any]):
+  """
+  Run app async printing the tokens as they arrive. Ctrl+C stops it keeping the partial output
+  """
+  outputs: List[TextIO] = [sys.stdout] if to_stdout else []
+  file = open(output_file, 'w', encoding='utf-8') if output_file else None
+  if file:
+    outputs.append(file)
+  try:
+    with sampler.request('stream_model'):
+      await stream_model(outputs=outputs, metrics=metrics)
+  finally:
+    if file:
+      file.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+  parser = argparse.ArgumentParser(description="Run the model with the app prompt")
+  parser.add_argument("--stream", action="store_true", help="print the tokens as they arrive")
+  parser.add_argument("--output", default=None, help="also write the streamed answer to this file")
+  parser.add_argument("--quiet", action="store_true", help="with --output, don't print the tokens")
+  parser.add_argument("--sample-interval", type=float, default=0.1, help="seconds between cpu/memory samples")
+  parser.add_argument("--samples", default=None, help="save the cpu/memory time series to this .csv or .json file")
+  args = parser.parse_args()
+
+  # Load the model first so the load time is not part of the first token
+  get_residency().declare(LLM_MODEL, LLM_KEEP_ALIVE)
+  get_residency().preload()
+  with ResourceSampler(interval_s=args.sample_interval) as resource_sampler:
+    if args.stream or args.output:
+      stream_metrics: Dict[str, Any] = {}
+      try:
+        asyncio.run(main_stream(resource_sampler, args.output, not args.quiet, stream_metrics))
+      except KeyboardInterrupt:
+        pass
+      print()
+      print_stream_metrics(stream_metrics)
+      for request in resource_sampler.requests():
+        print(f"{request['name']}: cpu={request['cpu_s']} peak rss MB={request['peak_rss_mb']}")
+    else:
+      asyncio.run(main(resource_sampler))
+
+  print("Models (load vs inference time):", get_residency().summary())
+  if args.samples:
+    if args.samples.endswith('.json'):
+      resource_sampler.export_json(args.samples)
+    else:
+      resource_sampler.export_csv(args.samples)
+    print(f"Samples saved in {args.samples}")
@@ -0,0 +1,188 @@
+"""
+Content-addressed cache for deterministic LLM calls
+
+Near identical emails (newsletters, notifications) produce the same prompt once the
+volatile parts are removed, so the model answer can be reused. The key is a hash of the
+model name, the temperature, the output format and the normalized prompt. Only calls
+with `temperature=0` are cached, other calls always go to the model.
+
+Entries are stored in SQLite, expire after `ttl_s` seconds and the least recently used
+ones are evicted when the cache grows over `max_entries`.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "llm_cache.sqlite")
+
+# Volatile tokens replaced before hashing the prompt
+_VOLATILE_PATTERNS = [
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b", re.IGNORECASE), "<id>"),
+    (re.compile(r"\b\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2})?(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?)?\b"), "<date>"),
+    (re.compile(r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"), "<date>"),
+    (re.compile(r"\b(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.? \d{1,2}(?:st|nd|rd|th)?,? \d{4}\b", re.IGNORECASE), "<date>"),
+    (re.compile(r"\b\d{1,2}:\d{2}(?::\d{2})?(?: ?[ap]m)?\b", re.IGNORECASE), "<time>"),
+    (re.compile(r"([?&](?:utm_[a-z]+|token|tracking_id|trk|mc_eid|mc_cid)=)[^&\s]+", re.IGNORECASE), r"\1<id>"),
+    # Long tokens mixing letters and digits: tracking ids, message ids, hashes
+    (re.compile(r"\b(?=[A-Za-z0-9_-]*\d)(?=[A-Za-z0-9_-]*[A-Za-z])[A-Za-z0-9_-]{16,}\b"), "<id>"),
+]
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Remove whitespace differences and volatile tokens (dates, tracking ids) from a prompt"""
+    for pattern, replacement in _VOLATILE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class LLMCache:
+    """SQLite backed LRU/TTL cache of LLM responses"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 10_000,
+                 ttl_s: float = 7 * 24 * 3600, evict_every: int = 100):
+        """
+        :param path: str: SQLite file, ":memory:" for a process only cache
+        :param max_entries: int: max number of responses kept (LRU eviction)
+        :param ttl_s: float: seconds before an entry expires
+        :param evict_every: int: run the eviction after this number of writes
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.evict_every = evict_every
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._conn.commit()
+        self._writes = 0
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0, "skipped": 0}
+
+    @staticmethod
+    def make_key(model_name: str, temperature: Optional[float], prompt: str, **extra: Any) -> str:
+        """Hash of the model settings and the normalized prompt"""
+        material = json.dumps(
+            {"model": model_name, "temperature": temperature, "prompt": normalize_prompt(prompt), **extra},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            content, created_at = row
+            if now - created_at > self.ttl_s:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.counters["hits"] += 1
+            return content
+
+    def put(self, key: str, content: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, content, now, now),
+            )
+            self.counters["stores"] += 1
+            self._writes += 1
+            if self._writes % self.evict_every == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        """Drop expired entries and then the least recently used ones over max_entries"""
+        cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_s,))
+        evicted = cursor.rowcount
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if count > self.max_entries:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            evicted += cursor.rowcount
+        self.counters["evictions"] += evicted
+
+    def skip(self):
+        """Count a call that could not be cached (not deterministic)"""
+        with self._lock:
+            self.counters["skipped"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": entries,
+                "hit_ratio": round(self.counters["hits"] / lookups, 3) if lookups else 0.0,
+            }
+
+
+def cached_invoke(model: Any, messages: Sequence[BaseMessage], cache: Optional[LLMCache],
+                  accept: Optional[Callable[[str], bool]] = None, gate: Any = None) -> BaseMessage:
+    """
+    Invoke a chat model through the cache
+
+    :param model: chat model, only cached when its temperature is 0
+    :param messages: Sequence[BaseMessage]: prompt messages
+    :param cache: Optional[LLMCache]: None disables the cache
+    :param accept: Optional[Callable[[str], bool]]: only responses accepted by it are stored
+    :param gate: Optional[ModelGate]: model_residency gate the model calls wait for, the cache hits don't
+    """
+    def call() -> BaseMessage:
+        with gate.hold(model.model) if gate is not None else nullcontext():
+            return model.invoke(messages)
+
+    temperature = getattr(model, "temperature", None)
+    if cache is None or temperature != 0:
+        if cache is not None:
+            cache.skip()
+        return call()
+
+    prompt = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    key = cache.make_key(
+        getattr(model, "model", type(model).__name__), temperature, prompt,
+        format=getattr(model, "format", None), num_predict=getattr(model, "num_predict", None),
+    )
+    content = cache.get(key)
+    if content is not None:
+        return AIMessage(content=content, response_metadata={"cache_hit": True})
+
+    response = call()
+    if accept is None or accept(response.content):
+        cache.put(key, response.content)
+    return response
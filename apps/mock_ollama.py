@@ -0,0 +1,318 @@
+"""
+Local mock of the Ollama HTTP API, to run the apps and the benchmarks without models (CI)
+
+Implements the endpoints used in this repo:
+- POST /api/chat and /api/generate: streamed (NDJSON) or not, with Ollama's counters
+  (prompt_eval_count, eval_count, *_duration in nanoseconds). When `format` is a JSON
+  schema the answer is a JSON object that matches it. When the chat request has `tools`
+  and the last message is from the user, the answer calls every tool once.
+- POST /api/embed: deterministic unit vectors of the character trigrams (texts that share
+  words are close), `EMBEDDING_DIM` dimensions
+- GET /api/ps, GET /api/tags
+
+Generation speed and model load time are simulated with sleeps.
+
+# Run it standalone
+python ./apps/mock_ollama.py --port 11434 --tokens-per-s 200
+
+# Or in-process
+with MockOllama() as host:
+  client = AsyncClient(host=host)
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+DEFAULT_TOKENS = 64
+EMBEDDING_DIM = 256
+
+
+def _now() -> str:
+  return datetime.now(timezone.utc).isoformat()
+
+
+def _value_for_schema(schema: Dict[str, Any], rnd: Optional[random.Random] = None) -> Any:
+  """
+  Smallest value that matches a JSON schema. With `rnd`, enums and the numbers with a
+  minimum and a maximum (e.g. a confidence) are drawn at random
+  """
+  if "enum" in schema:
+    return rnd.choice(schema["enum"]) if rnd is not None else schema["enum"][0]
+  kind = schema.get("type")
+  if kind == "object":
+    return {name: _value_for_schema(prop, rnd) for name, prop in schema.get("properties", {}).items()}
+  if kind == "number" and rnd is not None and "minimum" in schema and "maximum" in schema:
+    return round(rnd.uniform(schema["minimum"], schema["maximum"]), 2)
+  if kind == "array":
+    return []
+  if kind == "boolean":
+    return False
+  if kind in ("number", "integer"):
+    return schema.get("minimum", 0.5 if kind == "number" else 1)
+  return "mock"
+
+
+def _embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+  """Signed hashing of the character trigrams, normalized"""
+  vector = [0.0] * dim
+  padded = f" {' '.join(text.casefold().split())} "
+  for i in range(len(padded) - 2):
+    bucket = zlib.crc32(padded[i:i + 3].encode())
+    vector[bucket % dim] += 1.0 if bucket & 0x80000000 else -1.0
+  norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+  return [value / norm for value in vector]
+
+
+def _tool_call(tool: Dict[str, Any], text: str) -> Dict[str, Any]:
+  """Call of a tool with the user text in every string argument"""
+  function = tool.get("function", {})
+  properties = (function.get("parameters") or {}).get("properties") or {}
+  arguments = {name: text[:80] if prop.get("type", "string") == "string" else _value_for_schema(prop)
+               for name, prop in properties.items()}
+  return {"function": {"name": function.get("name", ""), "arguments": arguments}}
+
+
+class MockOllama:
+  """Threaded mock server. Use as context manager, it returns the host url"""
+
+  def __init__(self, host: str = "127.0.0.1", port: int = 0, tokens_per_s: float = 500.0,
+               load_s: float = 0.0, tokens: int = DEFAULT_TOKENS, max_loaded: int = 0,
+               model_tokens_per_s: Optional[Dict[str, float]] = None, prompt_cache: bool = False,
+               cache_slots: int = 4):
+    """
+    :param port: int: 0 picks a free port
+    :param tokens_per_s: float: simulated generation speed
+    :param load_s: float: simulated load time when a model is not loaded
+    :param tokens: int: generated tokens when the request has no num_predict
+    :param max_loaded: int: models kept loaded at the same time, the least recently used is evicted (0 no limit)
+    :param model_tokens_per_s: Optional[Dict[str, float]]: generation speed of some models (bigger ones are slower)
+    :param prompt_cache: bool: like the KV cache of Ollama, the prefix shared with a recent prompt of the same
+      model is not evaluated again (not counted in prompt_eval_count)
+    :param cache_slots: int: recent prompts kept per model, like OLLAMA_NUM_PARALLEL slots
+    """
+    self.tokens_per_s = tokens_per_s
+    self.model_tokens_per_s = model_tokens_per_s or {}
+    self.load_s = load_s
+    self.tokens = tokens
+    self.max_loaded = max_loaded
+    self.prompt_cache = prompt_cache
+    self.cache_slots = cache_slots
+    self._prompts: Dict[str, List[str]] = {}
+    self.loads = 0
+    self.loaded: Dict[str, float] = {}
+    self.requests = 0
+    self._lock = threading.Lock()
+    self._server = ThreadingHTTPServer((host, port), self._handler())
+    self._server.daemon_threads = True
+    self._thread: Optional[threading.Thread] = None
+
+  @property
+  def url(self) -> str:
+    host, port = self._server.server_address[:2]
+    return f"http://{host}:{port}"
+
+  def start(self) -> str:
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    self._thread.start()
+    return self.url
+
+  def serve_forever(self):
+    self._server.serve_forever()
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def __enter__(self) -> str:
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.stop()
+
+  def _load(self, model: str, keep_alive: Any) -> int:
+    """Simulated model load, returns the load_duration in ns"""
+    with self._lock:
+      self.requests += 1
+      loaded = model in self.loaded
+      self.loaded.pop(model, None)
+      if keep_alive not in (0, "0", "0s"):
+        if self.max_loaded and not loaded and len(self.loaded) >= self.max_loaded:
+          self.loaded.pop(min(self.loaded, key=self.loaded.get))
+        self.loaded[model] = time.time()
+      if not loaded:
+        self.loads += 1
+        self._prompts.pop(model, None)
+    if loaded or not self.load_s:
+      return 0
+    time.sleep(self.load_s)
+    return int(self.load_s * 1e9)
+
+  def _cached_chars(self, model: str, prompt: str) -> int:
+    """Length of the longest prefix shared with a cached prompt, the prompt takes the place of that slot"""
+    if not self.prompt_cache:
+      return 0
+    with self._lock:
+      slots = self._prompts.setdefault(model, [])
+      shared = [len(os.path.commonprefix([cached, prompt])) for cached in slots]
+      best = max(range(len(slots)), key=shared.__getitem__, default=None)
+      # With nothing shared the oldest slot is replaced when they are all in use
+      if best is not None and (shared[best] or len(slots) >= self.cache_slots):
+        slots.pop(best)
+      slots.append(prompt)
+      return shared[best] if best is not None else 0
+
+  def _handler(self):
+    mock = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+      # Send every streamed chunk right away
+      disable_nagle_algorithm = True
+
+      def log_message(self, *args):
+        pass
+
+      def _send_json(self, data: Dict[str, Any], status: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def do_GET(self):
+        if self.path == "/api/ps":
+          models = [{"name": name, "model": name, "size": 0, "expires_at": _now()} for name in mock.loaded]
+          self._send_json({"models": models})
+        elif self.path == "/api/tags":
+          self._send_json({"models": [{"name": name, "model": name} for name in mock.loaded]})
+        else:
+          self._send_json({"error": "not found"}, 404)
+
+      def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path in ("/api/chat", "/api/generate"):
+          self._generate(request, chat=self.path == "/api/chat")
+        elif self.path == "/api/embed":
+          self._embed(request)
+        else:
+          self._send_json({"error": "not found"}, 404)
+
+      def _embed(self, request: Dict[str, Any]):
+        start = time.perf_counter()
+        load_duration = mock._load(request.get("model", ""), request.get("keep_alive"))
+        inputs = request.get("input", "")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+        self._send_json({
+          "model": request.get("model", ""),
+          "embeddings": [_embedding(text) for text in inputs],
+          "total_duration": int((time.perf_counter() - start) * 1e9),
+          "load_duration": load_duration,
+          "prompt_eval_count": sum(max(len(text) // 4, 1) for text in inputs),
+        })
+
+      def _generate(self, request: Dict[str, Any], chat: bool):
+        model = request.get("model", "")
+        load_duration = mock._load(model, request.get("keep_alive"))
+        options = request.get("options") or {}
+        if chat:
+          prompt = "".join(str(message.get("content", "")) for message in request.get("messages", []))
+        else:
+          prompt = request.get("prompt", "")
+        prompt_tokens = max((len(prompt) - mock._cached_chars(model, prompt)) // 4, 1) if prompt else 0
+
+        tool_calls = []
+        messages = request.get("messages") or []
+        if chat and request.get("tools") and messages and messages[-1].get("role") == "user":
+          tool_calls = [_tool_call(tool, str(messages[-1].get("content", ""))) for tool in request["tools"]]
+
+        if not chat and not prompt:
+          pieces = []  # empty generate only loads the model
+        elif tool_calls:
+          pieces = [""]
+        elif isinstance(request.get("format"), dict):
+          # Same model and prompt, same answer
+          pieces = [json.dumps(_value_for_schema(request["format"], random.Random(zlib.crc32(f"{model}\x00{prompt}".encode()))))]
+        elif request.get("format") == "json":
+          pieces = ["{}"]
+        else:
+          pieces = [f"token{i} " for i in range(options.get("num_predict") or mock.tokens)]
+
+        def chunk(text: str, done: bool, **extra) -> Dict[str, Any]:
+          data = {"model": model, "created_at": _now(), "done": done, **extra}
+          if chat:
+            data["message"] = {"role": "assistant", "content": text}
+            if tool_calls and (done != stream):
+              data["message"]["tool_calls"] = tool_calls
+          else:
+            data["response"] = text
+          return data
+
+        stream = request.get("stream", True)
+        tokens_per_s = mock.model_tokens_per_s.get(model, mock.tokens_per_s)
+        delay = 1 / tokens_per_s if tokens_per_s else 0.0
+        start = time.perf_counter()
+        if stream:
+          self.send_response(200)
+          self.send_header("Content-Type", "application/x-ndjson")
+          self.send_header("Transfer-Encoding", "chunked")
+          self.end_headers()
+
+        def write(data: Dict[str, Any]):
+          line = json.dumps(data).encode() + b"\n"
+          self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+          self.wfile.flush()
+
+        for piece in pieces:
+          time.sleep(delay)
+          if stream:
+            try:
+              write(chunk(piece, False))
+            except (BrokenPipeError, ConnectionResetError):
+              return  # client cancelled the request
+        eval_duration = int((time.perf_counter() - start) * 1e9)
+        final = chunk(
+          "" if stream else "".join(pieces), True,
+          done_reason="stop" if pieces else "load",
+          total_duration=load_duration + eval_duration,
+          load_duration=load_duration,
+          prompt_eval_count=prompt_tokens,
+          prompt_eval_duration=prompt_tokens * 10_000,
+          eval_count=len(pieces),
+          eval_duration=eval_duration,
+        )
+        if stream:
+          write(final)
+          self.wfile.write(b"0\r\n\r\n")
+          self.wfile.flush()
+        else:
+          self._send_json(final)
+
+    return Handler
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Mock Ollama server")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=11434)
+  parser.add_argument("--tokens-per-s", type=float, default=500.0)
+  parser.add_argument("--load-s", type=float, default=0.0)
+  parser.add_argument("--tokens", type=int, default=DEFAULT_TOKENS)
+  parser.add_argument("--max-loaded", type=int, default=0)
+  args = parser.parse_args()
+
+  server = MockOllama(args.host, args.port, args.tokens_per_s, args.load_s, args.tokens, args.max_loaded)
+  print(f"Mock Ollama listening on {server.url}")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server._server.server_close()
@@ -0,0 +1,301 @@
+"""
+Model residency: keep the models of the apps loaded in Ollama
+
+- Apps declare the models they use with a keep_alive (`declare` / `chat_model`), the
+  keep_alive is sent with every request so Ollama doesn't unload them after 5 minutes.
+- `preload()` loads the declared models on every host at startup (an empty generate
+  request), so the first real request doesn't pay the load time.
+- `loaded()` asks Ollama which models are in memory (/api/ps).
+- `order_by_residency` sorts queued work grouping it by model, the loaded models first, so
+  the apps don't alternate models and make Ollama swap them.
+- `ModelGate` does the same for calls made by concurrent workers (spam_batch): the calls of
+  one model run together while the calls of the other models wait for their turn.
+- Every answer is recorded: load time (load_duration) is reported apart from the
+  inference time (prompt_eval_duration + eval_duration).
+
+# Required packages:
+pip install ollama==0.4.7 langchain-ollama==0.3.0
+
+# Preload models and show what's loaded
+python ./apps/model_residency.py preload llama3.2:1b qwen2.5-coder:7b-instruct --keep-alive 30m
+python ./apps/model_residency.py status
+"""
+import argparse
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, TypeVar, Union
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from ollama_pool import OllamaPool, get_pool
+
+DEFAULT_KEEP_ALIVE = "30m"
+# A request with a load_duration above this loaded the model (a cold request)
+COLD_LOAD_S = 0.5
+PS_TTL_S = 2.0
+# Calls a model runs in a row while others wait, see ModelGate
+GATE_MAX_BATCH = 8
+
+KeepAlive = Union[str, int, float]
+T = TypeVar("T")
+
+
+class ModelStats:
+    __slots__ = ("requests", "cold", "load_s", "prompt_eval_s", "eval_s", "preload_s")
+
+    def __init__(self):
+        self.requests = 0
+        self.cold = 0
+        self.load_s = 0.0
+        self.prompt_eval_s = 0.0
+        self.eval_s = 0.0
+        self.preload_s = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        inference_s = self.prompt_eval_s + self.eval_s
+        return {
+            "requests": self.requests,
+            "cold_requests": self.cold,
+            "preload_s": round(self.preload_s, 3),
+            "load_s": round(self.load_s, 3),
+            "inference_s": round(inference_s, 3),
+            "load_ratio": round(self.load_s / (self.load_s + inference_s), 3) if self.load_s + inference_s else 0.0,
+        }
+
+
+class _ResidencyCallback(BaseCallbackHandler):
+    """Records the Ollama counters of every ChatOllama answer"""
+
+    def __init__(self, residency: "ModelResidency"):
+        self.residency = residency
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any):
+        for generations in response.generations:
+            for generation in generations:
+                info = dict(generation.generation_info or {})
+                message = getattr(generation, "message", None)
+                if message is not None:
+                    info = {**message.response_metadata, **info}
+                if info.get("model"):
+                    self.residency.record(info["model"], info)
+
+
+class ModelResidency:
+    def __init__(self, pool: Optional[OllamaPool] = None):
+        self.pool = pool or get_pool()
+        self.models: Dict[str, KeepAlive] = {}
+        self.stats: Dict[str, ModelStats] = {}
+        self.callback = _ResidencyCallback(self)
+        self._ps: Dict[str, List[str]] = {}
+        self._ps_at = 0.0
+        self._lock = threading.Lock()
+
+    def declare(self, model: str, keep_alive: KeepAlive = DEFAULT_KEEP_ALIVE) -> KeepAlive:
+        """Model used by an app, returns the keep_alive to send with its requests"""
+        with self._lock:
+            self.models[model] = keep_alive
+            self.stats.setdefault(model, ModelStats())
+        return keep_alive
+
+    def keep_alive(self, model: str) -> Optional[KeepAlive]:
+        return self.models.get(model)
+
+    def chat_model(self, model: str, keep_alive: KeepAlive = DEFAULT_KEEP_ALIVE, **kwargs):
+        """`ChatOllama` from the shared pool, declared here and with its load/inference time recorded"""
+        self.declare(model, keep_alive)
+        callbacks = list(kwargs.pop("callbacks", None) or []) + [self.callback]
+        return self.pool.chat_model(model=model, keep_alive=keep_alive, callbacks=callbacks, **kwargs)
+
+    def _host_pools(self) -> List[OllamaPool]:
+        return [OllamaPool([str(host.url)], retries=0, timeout=self.pool.timeout) for host in self.pool.transport.hosts]
+
+    def preload(self, models: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """
+        Load the models (default all declared) on every host, one at a time so they don't
+        compete for memory. Returns the seconds spent per model
+        """
+        models = list(models) if models is not None else list(self.models)
+        spent: Dict[str, float] = {}
+        for pool in self._host_pools():
+            client = pool.client()
+            for model in models:
+                start = time.perf_counter()
+                client.generate(model=model, prompt="", keep_alive=self.models.get(model, DEFAULT_KEEP_ALIVE))
+                elapsed = time.perf_counter() - start
+                spent[model] = spent.get(model, 0.0) + elapsed
+                with self._lock:
+                    self.stats.setdefault(model, ModelStats()).preload_s += elapsed
+            pool.transport.close()
+        self._ps_at = 0.0
+        return spent
+
+    def unload(self, model: str):
+        for pool in self._host_pools():
+            pool.client().generate(model=model, prompt="", keep_alive=0)
+            pool.transport.close()
+        self._ps_at = 0.0
+
+    def loaded(self, refresh: bool = False) -> Dict[str, List[str]]:
+        """Models in memory per host, from /api/ps (cached for PS_TTL_S seconds)"""
+        if refresh or time.monotonic() - self._ps_at > PS_TTL_S:
+            loaded = {}
+            for pool in self._host_pools():
+                try:
+                    loaded[pool.base_url] = [model.model or model.name for model in pool.client().ps().models]
+                except Exception:
+                    loaded[pool.base_url] = []
+                pool.transport.close()
+            self._ps, self._ps_at = loaded, time.monotonic()
+        return self._ps
+
+    def is_loaded(self, model: str) -> bool:
+        return any(model in models for models in self.loaded().values())
+
+    def record(self, model: str, response: Any):
+        """Add the Ollama counters (nanoseconds) of one answer"""
+        def seconds(field):
+            value = response.get(field) if hasattr(response, "get") else getattr(response, field, None)
+            return (value or 0) / 1e9
+        load_s = seconds("load_duration")
+        with self._lock:
+            stats = self.stats.setdefault(model, ModelStats())
+            stats.requests += 1
+            stats.load_s += load_s
+            stats.cold += load_s >= COLD_LOAD_S
+            stats.prompt_eval_s += seconds("prompt_eval_duration")
+            stats.eval_s += seconds("eval_duration")
+
+    def order_by_residency(self, items: Sequence[T], model_of: Callable[[T], str],
+                           loaded: Optional[Set[str]] = None) -> List[T]:
+        """
+        Group the work by model (stable inside each group), models already loaded first,
+        then in order of first appearance
+
+        :param loaded: Optional[Set[str]]: models in memory, instead of asking /api/ps (`loaded()`)
+        """
+        groups: Dict[str, List[T]] = {}
+        for item in items:
+            groups.setdefault(model_of(item), []).append(item)
+        is_loaded = (lambda model: model in loaded) if loaded is not None else self.is_loaded
+        order = sorted(groups, key=lambda model: not is_loaded(model))
+        return [item for model in order for item in groups[model]]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {model: stats.to_dict() for model, stats in self.stats.items()}
+
+
+class ModelGate:
+    """
+    Lets the calls of one model run (at the same time between them) while the calls of the
+    other models wait. When the running calls finish, the waiting model chosen by
+    `order_by_residency` (a loaded one first) takes the gate. A model keeps it for at most
+    `max_batch` calls while other models wait, so none of them starves.
+    When both models are in memory (/api/ps) there is no swap to avoid and the call runs.
+    The /api/ps snapshot is taken before the lock, no request to Ollama runs while holding it.
+    """
+
+    def __init__(self, residency: ModelResidency, max_batch: int = GATE_MAX_BATCH):
+        """
+        :param residency: ModelResidency: tells which models are loaded
+        :param max_batch: int: calls of a model in a row when other models are waiting
+        """
+        self.residency = residency
+        self.max_batch = max_batch
+        self.waits = 0
+        self._cond = threading.Condition()
+        self._active: Optional[str] = None
+        self._running = 0
+        self._served = 0
+        self._waiting: Dict[str, int] = {}
+        self._loaded: Set[str] = set()
+
+    def _snapshot(self) -> Set[str]:
+        """Models in memory on any host, outside the lock (`loaded()` may ask /api/ps)"""
+        return {model for models in self.residency.loaded().values() for model in models}
+
+    def _can_enter(self, model: str) -> bool:
+        if self._active is None:
+            return True
+        if model != self._active:
+            return model in self._loaded and self._active in self._loaded
+        others_waiting = any(waiting != model for waiting in self._waiting)
+        return self._served < self.max_batch or not others_waiting
+
+    def _next_model(self) -> Optional[str]:
+        """Model that takes the gate when the running calls finish, another one than the active if any"""
+        waiting = [model for model in self._waiting if model != self._active] or list(self._waiting)
+        if not waiting:
+            return None
+        return self.residency.order_by_residency(waiting, lambda model: model, loaded=self._loaded)[0]
+
+    @contextmanager
+    def hold(self, model: str):
+        """Wait for the turn of `model` and keep the gate while the call runs"""
+        loaded = self._snapshot()
+        with self._cond:
+            self._loaded = loaded
+            self._waiting[model] = self._waiting.get(model, 0) + 1
+            try:
+                if not self._can_enter(model):
+                    self.waits += 1
+                while not self._can_enter(model):
+                    self._cond.wait()
+            finally:
+                self._waiting[model] -= 1
+                if not self._waiting[model]:
+                    del self._waiting[model]
+            if self._active is None:
+                self._active, self._served = model, 0
+            self._running += 1
+            self._served += 1
+        try:
+            yield
+        finally:
+            loaded = self._snapshot()
+            with self._cond:
+                self._loaded = loaded
+                self._running -= 1
+                if not self._running:
+                    self._active, self._served = self._next_model(), 0
+                self._cond.notify_all()
+
+    def summary(self) -> Dict[str, Any]:
+        return {"max_batch": self.max_batch, "waits": self.waits}
+
+
+_residency: Optional[ModelResidency] = None
+_residency_lock = threading.Lock()
+
+
+def get_residency() -> ModelResidency:
+    """Process wide residency manager over the shared pool"""
+    global _residency
+    if _residency is None:
+        with _residency_lock:
+            if _residency is None:
+                _residency = ModelResidency()
+    return _residency
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Preload ollama models and show the loaded ones")
+    parser.add_argument("command", choices=["preload", "unload", "status"])
+    parser.add_argument("models", nargs="*")
+    parser.add_argument("--keep-alive", default=DEFAULT_KEEP_ALIVE, help="e.g. 30m, 2h, -1 (forever)")
+    args = parser.parse_args()
+
+    residency = get_residency()
+    keep_alive = int(args.keep_alive) if args.keep_alive.lstrip("-").isdigit() else args.keep_alive
+    if args.command == "preload":
+        for name in args.models:
+            residency.declare(name, keep_alive)
+        for name, seconds in residency.preload().items():
+            print(f"{name}: loaded in {seconds:.2f}s")
+    elif args.command == "unload":
+        for name in args.models:
+            residency.unload(name)
+    for host, names in residency.loaded(refresh=True).items():
+        print(f"{host}: {', '.join(names) or '(no models loaded)'}")
@@ -0,0 +1,337 @@
+"""
+Shared Ollama client layer for all the apps
+
+One pool of keep-alive HTTP connections per Ollama host, shared by every `ollama.Client`,
+`ollama.AsyncClient` and `ChatOllama` created from it. Requests are routed across the
+configured hosts:
+- round_robin: next host in order
+- least_loaded: host with fewer requests in flight (streams count until they are closed)
+
+Connection errors and 503 (Ollama queue full) are retried on the next host with a small
+backoff, and a host that refused the connection is skipped for a few seconds.
+
+Requests of a session (`chat_model(session="classify_email")`, sent in the
+X-Ollama-Session header) prefer one host, so the prompts that share a prefix land on the
+same server and reuse its prompt (KV) cache. The pin is a preference: when the host of the
+session already has OLLAMA_PIN_MAX_IN_FLIGHT requests in flight (or is down) the request
+goes to the least loaded other host, so a busy session still spreads over all the hosts
+(and warms their caches too) instead of queueing on one.
+
+Configuration (environment):
+- OLLAMA_HOSTS: comma separated urls, e.g. "http://localhost:11434,http://localhost:11435"
+- OLLAMA_HOST: single url, used when OLLAMA_HOSTS is not set (default http://localhost:11434)
+- OLLAMA_ROUTING: round_robin (default) or least_loaded
+- OLLAMA_PIN_MAX_IN_FLIGHT: requests in flight on the host of a session before the next
+  ones of the session go to other hosts (default 2)
+
+# Required packages:
+pip install ollama==0.4.7 langchain-ollama==0.3.0
+
+# Usage
+from ollama_pool import get_pool
+chat = get_pool().chat_model(model="llama3.2:1b", temperature=0)
+response = await get_pool().async_client().chat(model="llama3.2:1b", messages=[...])
+"""
+import asyncio
+import itertools
+import os
+import threading
+import time
+import weakref
+import zlib
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+from ollama import AsyncClient, Client
+
+DEFAULT_HOST = "http://localhost:11434"
+ROUTING_POLICIES = ("round_robin", "least_loaded")
+# Generation can take minutes, but the read timeout applies between streamed chunks
+DEFAULT_TIMEOUT = httpx.Timeout(connect=5.0, read=300.0, write=30.0, pool=30.0)
+RETRY_STATUS = {503}
+SESSION_HEADER = "x-ollama-session"
+DEFAULT_PIN_MAX_IN_FLIGHT = 2
+
+
+def hosts_from_env() -> List[str]:
+    hosts = os.getenv("OLLAMA_HOSTS") or os.getenv("OLLAMA_HOST") or DEFAULT_HOST
+    return [_normalize_host(host) for host in hosts.split(",") if host.strip()]
+
+
+def _normalize_host(host: str) -> str:
+    host = host.strip().rstrip("/")
+    if "://" not in host:
+        host = f"http://{host}"
+    url = httpx.URL(host)
+    return f"{url.scheme}://{url.host}:{url.port or (443 if url.scheme == 'https' else 11434)}"
+
+
+class _Host:
+    __slots__ = ("url", "in_flight", "requests", "errors", "down_until", "_transport", "_async_transports")
+
+    def __init__(self, url: str):
+        self.url = httpx.URL(url)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.down_until = 0.0
+        self._transport: Optional[httpx.HTTPTransport] = None
+        # Async connections belong to the event loop that opened them: one pool per loop
+        self._async_transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport]" = \
+            weakref.WeakKeyDictionary()
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """Response body that releases the host slot when it's closed"""
+
+    def __init__(self, stream: httpx.SyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncTrackedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class RoutingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    httpx transport (sync and async) that sends every request to one of the hosts,
+    reusing a keep-alive connection pool per host
+    """
+
+    def __init__(self, hosts: Sequence[str], routing: str = "round_robin", retries: int = 2,
+                 limits: Optional[httpx.Limits] = None, backoff_s: float = 0.2, cooldown_s: float = 5.0,
+                 pin_max_in_flight: int = DEFAULT_PIN_MAX_IN_FLIGHT):
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"routing must be one of {ROUTING_POLICIES}, got {routing!r}")
+        if not hosts:
+            raise ValueError("at least one ollama host is required")
+        self.hosts = [_Host(_normalize_host(host)) for host in hosts]
+        self.routing = routing
+        self.retries = retries
+        self.limits = limits or httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
+        self.backoff_s = backoff_s
+        self.cooldown_s = cooldown_s
+        self.retried = 0
+        self.pin_max_in_flight = pin_max_in_flight
+        self.pinned = 0
+        self.spilled = 0
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def _pick(self, exclude: Sequence[_Host] = (), session: Optional[str] = None) -> _Host:
+        with self._lock:
+            now = time.monotonic()
+            candidates = [host for host in self.hosts if host not in exclude and host.down_until <= now]
+            if not candidates:
+                # Every host failed recently: try them anyway
+                candidates = [host for host in self.hosts if host not in exclude] or self.hosts
+            turn = next(self._order)
+            pinned = self.hosts[zlib.crc32(session.encode()) % len(self.hosts)] if session else None
+            if pinned in candidates and pinned.in_flight < self.pin_max_in_flight:
+                self.pinned += 1
+                candidates = [pinned]
+            elif self.routing == "least_loaded" or pinned is not None:
+                # A session whose host is busy or down goes to the least loaded of the others
+                if pinned is not None:
+                    self.spilled += 1
+                    candidates = [host for host in candidates if host is not pinned] or candidates
+                least = min(host.in_flight for host in candidates)
+                candidates = [host for host in candidates if host.in_flight == least]
+            host = candidates[turn % len(candidates)]
+            host.in_flight += 1
+            host.requests += 1
+            return host
+
+    def _release(self, host: _Host):
+        with self._lock:
+            host.in_flight -= 1
+
+    def _failed(self, host: _Host, refused: bool):
+        with self._lock:
+            host.in_flight -= 1
+            host.errors += 1
+            self.retried += 1
+            if refused:
+                host.down_until = time.monotonic() + self.cooldown_s
+
+    @staticmethod
+    def _route(request: httpx.Request, host: _Host):
+        request.url = request.url.copy_with(scheme=host.url.scheme, host=host.url.host, port=host.url.port)
+        request.headers["Host"] = request.url.netloc.decode("ascii")
+
+    def _transport(self, host: _Host) -> httpx.HTTPTransport:
+        if host._transport is None:
+            host._transport = httpx.HTTPTransport(limits=self.limits)
+        return host._transport
+
+    def _async_transport(self, host: _Host) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        transport = host._async_transports.get(loop)
+        if transport is None:
+            transport = host._async_transports[loop] = httpx.AsyncHTTPTransport(limits=self.limits)
+        return transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        tried: List[_Host] = []
+        session = request.headers.get(SESSION_HEADER)
+        for attempt in range(self.retries + 1):
+            host = self._pick(tried, session)
+            tried.append(host)
+            self._route(request, host)
+            try:
+                response = self._transport(host).handle_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                self._failed(host, refused=True)
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code in RETRY_STATUS and attempt < self.retries:
+                    response.close()
+                    self._failed(host, refused=False)
+                else:
+                    return httpx.Response(response.status_code, headers=response.headers,
+                                          stream=_TrackedStream(response.stream, lambda: self._release(host)),
+                                          extensions=response.extensions)
+            time.sleep(self.backoff_s * 2 ** attempt)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        tried: List[_Host] = []
+        session = request.headers.get(SESSION_HEADER)
+        for attempt in range(self.retries + 1):
+            host = self._pick(tried, session)
+            tried.append(host)
+            self._route(request, host)
+            try:
+                response = await self._async_transport(host).handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                self._failed(host, refused=True)
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code in RETRY_STATUS and attempt < self.retries:
+                    await response.aclose()
+                    self._failed(host, refused=False)
+                else:
+                    return httpx.Response(response.status_code, headers=response.headers,
+                                          stream=_AsyncTrackedStream(response.stream, lambda: self._release(host)),
+                                          extensions=response.extensions)
+            await asyncio.sleep(self.backoff_s * 2 ** attempt)
+
+    def close(self):
+        for host in self.hosts:
+            if host._transport is not None:
+                host._transport.close()
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        for host in self.hosts:
+            transport = host._async_transports.pop(loop, None)
+            if transport is not None:
+                await transport.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "routing": self.routing,
+                "retried": self.retried,
+                "pinned": self.pinned,
+                "spilled": self.spilled,
+                "hosts": {
+                    str(host.url): {"requests": host.requests, "in_flight": host.in_flight, "errors": host.errors}
+                    for host in self.hosts
+                },
+            }
+
+
+class OllamaPool:
+    def __init__(self, hosts: Optional[Sequence[str]] = None, routing: Optional[str] = None, retries: int = 2,
+                 timeout: httpx.Timeout = DEFAULT_TIMEOUT, limits: Optional[httpx.Limits] = None,
+                 pin_max_in_flight: Optional[int] = None):
+        """
+        :param hosts: Optional[Sequence[str]]: ollama urls, default OLLAMA_HOSTS / OLLAMA_HOST
+        :param routing: Optional[str]: round_robin or least_loaded, default OLLAMA_ROUTING or round_robin
+        :param retries: int: extra attempts on connection errors and 503
+        :param timeout: httpx.Timeout: connect/read/write/pool timeouts
+        :param limits: Optional[httpx.Limits]: connections kept per host
+        :param pin_max_in_flight: Optional[int]: requests in flight on the host of a session before it spills
+            to other hosts, default OLLAMA_PIN_MAX_IN_FLIGHT or 2
+        """
+        hosts = list(hosts) if hosts else hosts_from_env()
+        routing = routing or os.getenv("OLLAMA_ROUTING") or "round_robin"
+        if pin_max_in_flight is None:
+            pin_max_in_flight = int(os.getenv("OLLAMA_PIN_MAX_IN_FLIGHT") or DEFAULT_PIN_MAX_IN_FLIGHT)
+        self.transport = RoutingTransport(hosts, routing=routing, retries=retries, limits=limits,
+                                          pin_max_in_flight=pin_max_in_flight)
+        self.timeout = timeout
+        self._client: Optional[Client] = None
+        self._async_client: Optional[AsyncClient] = None
+
+    @property
+    def base_url(self) -> str:
+        """First host, the real host of each request is chosen by the transport"""
+        return str(self.transport.hosts[0].url).rstrip("/")
+
+    def client_kwargs(self, session: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Arguments for `ollama.Client`, `ollama.AsyncClient` or `ChatOllama(client_kwargs=...)`
+
+        :param session: Optional[str]: the requests of the client prefer one host (see the module docstring)
+        """
+        kwargs = {"transport": self.transport, "timeout": self.timeout}
+        if session:
+            kwargs["headers"] = {SESSION_HEADER: session}
+        return kwargs
+
+    def client(self) -> Client:
+        if self._client is None:
+            self._client = Client(host=self.base_url, **self.client_kwargs())
+        return self._client
+
+    def async_client(self) -> AsyncClient:
+        if self._async_client is None:
+            self._async_client = AsyncClient(host=self.base_url, **self.client_kwargs())
+        return self._async_client
+
+    def chat_model(self, session: Optional[str] = None, **kwargs):
+        """`ChatOllama` that sends its requests through this pool, preferring one host with a `session`"""
+        from langchain_ollama import ChatOllama
+        return ChatOllama(base_url=self.base_url, client_kwargs=self.client_kwargs(session), **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.transport.stats()
+
+
+_pool: Optional[OllamaPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> OllamaPool:
+    """Process wide pool built from the environment"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = OllamaPool()
+    return _pool
@@ -0,0 +1,146 @@
+"""
+Opt-in cache of the agent's final answers to first-turn questions
+
+A question that opens a conversation has no history, so its answer only depends on the
+model, the tools and the question: "Tell me about 'Lady Ada Lovelace'" asked again in a new
+session reuses the answer instead of running the agent loop (model call, tool call, model
+call). Follow-up questions depend on the conversation and are never cached.
+
+- key: model, tool names, version of the data behind the tools (guest index) and the
+  normalized question (llm_cache.LLMCache.make_key)
+- entries in SQLite, shared by the sessions, LRU eviction over `max_entries` and TTL
+- only answers of turns without tool errors are stored (`cacheable`), an answer built
+  from a failed search must not be served to the next sessions. app.py also keeps out the
+  answers that used time dependent tools (weather, web search)
+- single-flight: the same question asked by concurrent conversations runs the agent once,
+  the others wait for its answer. When that run is cancelled they run it again
+"""
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from langchain_core.tools import BaseTool
+from tool_guard import LeaderCancelled
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_cache import LLMCache
+
+DEFAULT_ANSWER_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "answer_cache.sqlite")
+ANSWER_CACHE_MAX_ENTRIES = 1_000
+ANSWER_CACHE_TTL_S = 24 * 3600
+
+
+class AnswerCache:
+    def __init__(self, model: str, tools: Sequence[BaseTool], path: str = DEFAULT_ANSWER_CACHE_PATH,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl_s: float = ANSWER_CACHE_TTL_S,
+                 version: Optional[Callable[[], Any]] = None):
+        """
+        :param model: str: model of the agent, part of the key
+        :param tools: Sequence[BaseTool]: tools of the agent, their names are part of the key
+        :param path: str: SQLite file, ":memory:" for a process only cache
+        :param max_entries: int: answers kept, the least recently used are dropped
+        :param ttl_s: float: seconds an answer is reused
+        :param version: Optional[Callable[[], Any]]: version of the data behind the tools, part of the key
+        """
+        self.model = model
+        self.toolset = sorted(tool.name for tool in tools)
+        self.version = version
+        self.skipped = 0
+        self.store = LLMCache(path, max_entries=max_entries, ttl_s=ttl_s, evict_every=20)
+        self.coalesced = 0
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def key(self, question: str) -> str:
+        version = self.version() if self.version is not None else None
+        return LLMCache.make_key(self.model, None, question, tools=self.toolset, data_version=version)
+
+    def _lookup(self, key: str) -> Tuple[Optional[str], Optional[Future], bool]:
+        """Cached answer, or the future of the same question in flight, or (None, new future, True) for the leader"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
+            answer = self.store.get(key)
+            if answer is not None:
+                return answer, None, False
+            future = self._in_flight[key] = Future()
+            return None, future, True
+
+    def _finish(self, key: str, future: Future, answer: Optional[str], error: Optional[BaseException],
+                cacheable: Optional[Callable[[str], bool]] = None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if error is None and answer:
+                if cacheable is None or cacheable(answer):
+                    self.store.put(key, answer)
+                else:
+                    self.skipped += 1
+        if error is not None and not isinstance(error, Exception):
+            # The cancellation belongs to the leader, the waiting conversations run the question again
+            error = LeaderCancelled(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(answer)
+
+    def ask(self, question: str, run: Callable[[], str],
+            cacheable: Optional[Callable[[str], bool]] = None) -> Tuple[str, str]:
+        """
+        :param run: Callable[[], str]: runs the agent and returns the final answer, only called on a miss
+        :param cacheable: Optional[Callable[[str], bool]]: False when the answer of this run must not be stored
+        :return: (answer, "hit" | "coalesced" | "miss")
+        """
+        while True:
+            key = self.key(question)
+            answer, future, leader = self._lookup(key)
+            if answer is not None:
+                return answer, "hit"
+            if leader:
+                break
+            try:
+                return future.result(), "coalesced"
+            except LeaderCancelled:
+                continue
+        try:
+            answer = run()
+        except BaseException as e:
+            self._finish(key, future, None, e)
+            raise
+        self._finish(key, future, answer, None, cacheable)
+        return answer, "miss"
+
+    async def aask(self, question: str, run: Callable[[], Awaitable[str]],
+                   cacheable: Optional[Callable[[str], bool]] = None) -> Tuple[str, str]:
+        while True:
+            key = self.key(question)
+            answer, future, leader = self._lookup(key)
+            if answer is not None:
+                return answer, "hit"
+            if leader:
+                break
+            try:
+                # shield: a cancelled follower must not cancel the future shared with the others
+                return await asyncio.shield(asyncio.wrap_future(future)), "coalesced"
+            except LeaderCancelled:
+                continue
+        try:
+            answer = await run()
+        except BaseException as e:
+            self._finish(key, future, None, e)
+            raise
+        self._finish(key, future, answer, None, cacheable)
+        return answer, "miss"
+
+    def clear(self):
+        self.store.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        stats = self.store.stats()
+        lookups = stats["hits"] + stats["misses"] + self.coalesced
+        return {**stats, "coalesced": self.coalesced, "not_stored": self.skipped,
+                "hit_ratio": round((stats["hits"] + self.coalesced) / lookups, 3) if lookups else 0.0}
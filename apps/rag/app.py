@@ -8,19 +8,182 @@ for this example you need to start the container and then load the model one tim
 ```sh
 docker exec -it ollama ollama run qwen2.5-coder:7b-instruct
 ```
+
+# Required packages (aiosqlite 0.21 is the version the async checkpointer was written for,
+# 0.22+ also works: checkpoints.AsyncCompactSqliteSaver creates the tables without is_alive):
+pip install langgraph==0.3.19 langchain-ollama==0.3.0 langchain-core==0.3.48 langchain-community==0.3.20
+pip install langgraph-checkpoint-sqlite==2.0.11 aiosqlite==0.21.0 numpy scipy datasets huggingface_hub duckduckgo-search
 """
+import argparse
 import asyncio
-from assistant import create_assistant_with_tools
-from langchain_core.messages import HumanMessage
-from retriever import guest_info_tool
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set
+from answer_cache import AnswerCache
+from assistant import ASSISTANT_MODEL, create_assistant_with_tools, default_memory
+from checkpoints import DEFAULT_CHECKPOINT_PATH, aresume, open_async_checkpointer, thread_config
+from model_residency import get_residency
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
+from retriever import get_guest_index, guest_data_version, guest_info_tool
+# NOTE: the remote tools are rate limited and cached in tool_guard, no delays needed between questions
 from tools import search_tool, weather_info_tool, hub_stats_tool
+from tool_guard import tool_metrics
+from tool_executor import latency_log
+from tracing import get_tracer
+
+# Questions that run at the same time in the graph. The model server must accept them in
+# parallel too (OLLAMA_NUM_PARALLEL), otherwise they wait in its queue
+QUESTIONS_CONCURRENCY = 4
+# Tools whose results don't change between sessions (the guest index is in the key). Answers that
+# used other tools are not stored in the answer cache: the weather is random, the search changes over time
+CACHEABLE_TOOLS = {guest_info_tool.name, hub_stats_tool.name}
+
+def last_turn(messages: Sequence[AnyMessage]) -> Sequence[AnyMessage]:
+    """Messages after the last question"""
+    last_question = max((i for i, message in enumerate(messages) if isinstance(message, HumanMessage)), default=-1)
+    return messages[last_question + 1:]
+
+def tool_errors(messages: Sequence[AnyMessage]) -> int:
+    """Failed tool calls of the last turn"""
+    return sum(isinstance(message, ToolMessage) and message.status == "error" for message in last_turn(messages))
+
+def tools_called(messages: Sequence[AnyMessage]) -> Set[str]:
+    """Names of the tools the model called in the last turn"""
+    return {call["name"] for message in last_turn(messages) if isinstance(message, AIMessage) for call in message.tool_calls}
 
 def log_question_answer(question, answer):
     print("- Question:",question,"\n   🎩 Alfred's Response:\n       ", answer, "\n")
 
-async def main():
+def answered_questions(messages: Sequence[AnyMessage], questions: Sequence[str]) -> int:
+    """
+    Questions of the conversation already answered in the thread. The memory policy can
+    remove old turns from the state, so every question before the last one found counts too
+    """
+    asked = {message.content for message in messages if isinstance(message, HumanMessage)}
+    return max((turn + 1 for turn, q in enumerate(questions) if q in asked), default=0)
+
+def answer_of(messages: Sequence[AnyMessage], question: str) -> str:
+    """Last answer of the model to the question, from the saved state"""
+    answer, in_turn = "", False
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            in_turn = message.content == question
+        elif in_turn and isinstance(message, AIMessage) and not message.tool_calls:
+            answer = message.content
+    return answer
+
+async def run_conversation(alfred, questions: Sequence[str], semaphore: asyncio.Semaphore,
+                           thread_id: str, answers: Optional[AnswerCache] = None) -> List[Dict[str, Any]]:
+    """
+    Ask the questions in order in one thread, the checkpointer of the graph keeps the
+    messages of the previous ones (memory), so only the new question is sent.
+    When the thread already exists (restarted worker), the interrupted question resumes from
+    its last node and the answered questions are read from the store, without model calls.
+    The semaphore is held per question, other conversations run between them.
+    With `answers`, the first question of a new thread can be answered from the answer cache,
+    the question and answer are written to the thread so the next questions have them
+    """
+    config = thread_config(thread_id)
+    async with semaphore:
+        await aresume(alfred, thread_id)
+    messages = (await alfred.aget_state(config)).values.get("messages", [])
+    done = answered_questions(messages, questions)
+    results = []
+    for q in questions[:done]:
+        answer = answer_of(messages, q)
+        log_question_answer(q, answer)
+        results.append({"conversation": thread_id, "question": q, "answer": answer, "latency_s": 0.0,
+                        "replayed": True, "cache": None})
+    first_turn = not messages
+    for q in questions[done:]:
+        timing = {}
+
+        async def ask() -> str:
+            with get_tracer().span("question", "ask") as span:
+                queued = time.perf_counter()
+                async with semaphore:
+                    start = time.perf_counter()
+                    # Time waiting for a free question slot
+                    span.set(queue_wait_s=start - queued)
+                    response = await alfred.ainvoke({"messages": [HumanMessage(content=q)]}, config)
+                    timing["latency_s"] = time.perf_counter() - start
+            timing["tool_errors"] = tool_errors(response["messages"])
+            timing["tools"] = tools_called(response["messages"])
+            return response["messages"][-1].content
+
+        start = time.perf_counter()
+        status = None
+        if answers is not None and first_turn:
+            # An answer built from failed or time dependent tools is not stored for the next sessions
+            answer, status = await answers.aask(q, ask, cacheable=lambda _: not timing.get("tool_errors")
+                                                and timing.get("tools", set()) <= CACHEABLE_TOOLS)
+            if status != "miss":
+                await alfred.aupdate_state(config, {"messages": [HumanMessage(content=q), AIMessage(content=answer)]},
+                                           as_node="assistant")
+        else:
+            answer = await ask()
+        latency = timing.get("latency_s", time.perf_counter() - start)
+        first_turn = False
+        log_question_answer(q, answer)
+        results.append({"conversation": thread_id, "question": q, "answer": answer, "latency_s": latency,
+                        "replayed": False, "cache": status})
+    return results
+
+async def run_questions(alfred, conversations: Sequence[Sequence[str]],
+                        concurrency: int = QUESTIONS_CONCURRENCY, session: str = "gala",
+                        answers: Optional[AnswerCache] = None) -> Dict[str, Any]:
+    """
+    Run independent conversations concurrently (at most `concurrency` questions in the graph)
+
+    :param conversations: Sequence[Sequence[str]]: a conversation is a list of questions that depend on the previous ones
+    :param session: str: prefix of the thread ids, the same session resumes the saved conversations
+    :param answers: Optional[AnswerCache]: cache of the first-turn answers, None runs the agent every time
+    :return: per-question results and latency/throughput summary
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    per_conversation = await asyncio.gather(*[
+        run_conversation(alfred, questions, semaphore, f"{session}-c{i}", answers) for i, questions in enumerate(conversations)
+    ])
+    elapsed = time.perf_counter() - start
+    results = [result for results in per_conversation for result in results]
+    latencies = sorted(result["latency_s"] for result in results if not result["replayed"])
+    return {
+        "results": results,
+        "summary": {
+            "questions": len(results),
+            # Answers read from the checkpoints of a previous run
+            "replayed": sum(result["replayed"] for result in results),
+            # Answers from the answer cache (same first question in another session or conversation)
+            "cached": sum(result["cache"] in ("hit", "coalesced") for result in results),
+            "concurrency": concurrency,
+            "elapsed_s": round(elapsed, 3),
+            # What the questions would cost one after the other
+            "sum_latency_s": round(sum(latencies), 3),
+            "latency_p50_s": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "latency_max_s": round(latencies[-1], 3) if latencies else None,
+            "questions_per_min": round(len(results) * 60 / elapsed, 2) if elapsed else None,
+        },
+    }
+
+async def main(concurrency: int = QUESTIONS_CONCURRENCY, summarize: bool = False, session: str = "gala",
+               checkpoint_path: str = DEFAULT_CHECKPOINT_PATH, answer_cache: bool = False):
     print("🎩 Alfred's A Gala Agent is ready\n=================================\n\n")
-    alfred = create_assistant_with_tools([guest_info_tool, search_tool, weather_info_tool, hub_stats_tool])
+    print(f"Session {session} (run again with --session {session} to resume it)\n")
+    async with open_async_checkpointer(checkpoint_path) as checkpointer:
+        await ask_alfred(concurrency, summarize, session, checkpointer, answer_cache)
+        print("Checkpoints:", await checkpointer.astats())
+
+async def ask_alfred(concurrency: int, summarize: bool, session: str, checkpointer, answer_cache: bool):
+    tools = [guest_info_tool, search_tool, weather_info_tool, hub_stats_tool]
+    alfred = create_assistant_with_tools(tools, memory=default_memory(summarize), checkpointer=checkpointer)
+    # The guest data version is in the key: answers about guests are dropped when the guests change
+    answers = AnswerCache(ASSISTANT_MODEL, tools, version=guest_data_version) if answer_cache else None
+    if answers is not None:
+        # The version is read from the loaded index, load it now and not in the first key
+        await asyncio.to_thread(get_guest_index)
+    # Load the model now, the first question shouldn't wait for it
+    await asyncio.to_thread(get_residency().preload)
 
     questions = [
         "Tell me about 'Lady Ada Lovelace'", 
@@ -28,29 +191,36 @@ async def main():
         "One of our guests is from Qwen. What can you tell me about their most popular model?",
         "I need to speak with 'Dr. Nikola Tesla' about recent advancements in wireless energy. Can you help me prepare for this conversation?"
     ]
-    for q in questions:
-        response = alfred.invoke({"messages": q})
-        #print("- Question:",q,"\n   🎩 Alfred's Response:\n       ", response['messages'][-1].content, "\n")
-        log_question_answer(q, response['messages'][-1].content)
-        # NOTE: added delays to avoid rate limit issues with DuckDuckGo
-        await asyncio.sleep(1)
-    
 
     #  Advanced Features: Conversation Memory
-    print("\nAdvanced Features: Conversation Memory:\n")
-    # First interaction
-    q = "Tell me about 'Lady Ada Lovelace'. What's her background and how is she related to me?"
-    response = alfred.invoke({"messages": [HumanMessage(content=q)]})
-    log_question_answer(q, response['messages'][-1].content)
-    await asyncio.sleep(1)
+    # The second question references the first one, so they run in order
+    memory_questions = [
+        "Tell me about 'Lady Ada Lovelace'. What's her background and how is she related to me?",
+        "What projects is she currently working on?",
+    ]
 
-    # Second interaction (referencing the first)
-    q="What projects is she currently working on?"
-    response = alfred.invoke({"messages": response["messages"] + [HumanMessage(content=q)]})
-    log_question_answer(q, response['messages'][-1].content)
-    await asyncio.sleep(1)
+    report = await run_questions(alfred, [[q] for q in questions] + [memory_questions], concurrency, session, answers)
+    for result in report["results"]:
+        timing = "replayed" if result["replayed"] else f"{result['latency_s']:.2f}s"
+        if result["cache"] in ("hit", "coalesced"):
+            timing += " cached"
+        print(f"[{result['conversation']}] {timing} {result['question']}")
+    print("Questions:", report["summary"])
+    print("Models (load vs inference time):", get_residency().summary())
+    print("Tools (cache, coalescing, rate limit):", tool_metrics())
+    if answers is not None:
+        print("Answer cache:", answers.metrics())
+    print("Latency per step (LLM vs tools):", latency_log.summary())
+    if get_tracer().enabled:
+        print("Tracing (TRACING=1):", json.dumps(get_tracer().report()["spans"], indent=2))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Alfred, the gala agent")
+    parser.add_argument("--concurrency", type=int, default=QUESTIONS_CONCURRENCY, help="questions running at the same time")
+    parser.add_argument("--summarize", action="store_true", help="summarize the old turns with a small model")
+    parser.add_argument("--session", default=f"gala-{int(time.time())}", help="thread id prefix, reuse it to resume a run")
+    parser.add_argument("--checkpoints", default=DEFAULT_CHECKPOINT_PATH, help="SQLite file of the conversation state")
+    parser.add_argument("--answer-cache", action="store_true", help="reuse the answers of first questions asked before")
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.summarize, args.session, args.checkpoints, args.answer_cache))
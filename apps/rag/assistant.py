@@ -1,38 +1,119 @@
-from typing import Callable, Sequence, TypedDict, Annotated
-from langchain_ollama import ChatOllama
+import os
+import sys
+import time
+from typing import Callable, NotRequired, Optional, Sequence, TypedDict, Annotated
 from langgraph.graph.message import add_messages
-from langchain_core.messages import AnyMessage
+from langchain_core.messages import AnyMessage, RemoveMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import START, StateGraph
-from langgraph.prebuilt import ToolNode
 from langgraph.prebuilt import tools_condition
+from memory import MemoryPolicy, count_tokens
+from tool_executor import ParallelToolExecutor, latency_log
+
+# Shared ollama client layer lives in apps/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_residency import get_residency
+from tracing import get_tracer, set_llm_attrs
+
+ASSISTANT_MODEL = "qwen2.5-coder:7b-instruct"
+ASSISTANT_KEEP_ALIVE = "30m"
+
+# Seconds each tool can take before the turn continues without it
+TOOL_TIMEOUTS = {
+    "guest_info_retriever": 5.0,
+    "get_weather_info": 5.0,
+    "get_hub_stats": 15.0,
+    "duckduckgo_search": 20.0,
+}
+# Blocking tools that run in the thread pool of the tool executor
+BLOCKING_TOOLS = ("guest_info_retriever", "get_hub_stats")
+TOOL_WORKERS = 4
+
+# Memory sent to the model: estimated token budget, and the small model of the rolling summary
+MEMORY_MAX_TOKENS = 4000
+MEMORY_OLD_TOOL_CHARS = 500
+SUMMARY_MODEL = "llama3.2:1b"
+SUMMARY_MAX_TOKENS = 256
 
 
 # Generate the AgentState and Agent graph
 class AgentState(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
+    # Rolling summary of the turns removed from messages by the memory policy
+    summary: NotRequired[str]
 
 
-def create_assistant_with_tools(tools: Sequence[Callable]):
+def default_memory(summarize: bool = False) -> MemoryPolicy:
     """
-    Create an Agent with tools using 'qwen2.5-coder:7b-instruct'
-    Agent can iterate between tools and message to return more information
+    Token budgeted memory, with the rolling summary of SUMMARY_MODEL when `summarize`
+    """
+    summarizer = None
+    if summarize:
+        summarizer = get_residency().chat_model(model=SUMMARY_MODEL, keep_alive=ASSISTANT_KEEP_ALIVE,
+                                                temperature=0, num_predict=SUMMARY_MAX_TOKENS)
+    return MemoryPolicy(max_tokens=MEMORY_MAX_TOKENS, old_tool_chars=MEMORY_OLD_TOOL_CHARS, summarizer=summarizer)
+
+
+def create_assistant_with_tools(tools: Sequence[Callable], memory: Optional[MemoryPolicy] = None,
+                                checkpointer: Optional[BaseCheckpointSaver] = None):
+    """
+    Create an Agent with tools using ASSISTANT_MODEL ('qwen2.5-coder:7b-instruct')
+    Agent can iterate between tools and message to return more information.
+    The tool calls of one turn run in parallel (tool_executor), the latency of each turn
+    is recorded in tool_executor.latency_log, with the prompt tokens of every model call.
+    With TRACING=1 the nodes, model calls and tool calls are spans of tracing.get_tracer()
 
     :param tools: Sequence[Callable]: Array of function tools
+    :param memory: Optional[MemoryPolicy]: what part of the history is sent to the model, default_memory() by default
+    :param checkpointer: Optional[BaseCheckpointSaver]: store of the state per thread_id (checkpoints.open_checkpointer),
+        the state of a thread is loaded from it and an interrupted run resumes from the last node
     """
-    chat = ChatOllama(model="qwen2.5-coder:7b-instruct", verbose=True, temperature=1)
+    memory = memory or default_memory()
+    chat = get_residency().chat_model(model=ASSISTANT_MODEL, keep_alive=ASSISTANT_KEEP_ALIVE, verbose=True, temperature=1)
     chat_with_tools = chat.bind_tools(tools)
 
-    def assistant(state: AgentState):
-        return {
-            "messages": [chat_with_tools.invoke(state["messages"])],
-        }
-    
+    def update(state: AgentState, config: RunnableConfig, start: float, view, removed, summary, message):
+        latency_log.record_assistant(
+            time.perf_counter() - start, config, tool_calls=len(message.tool_calls),
+            prompt_tokens=(message.usage_metadata or {}).get("input_tokens"), estimated_tokens=count_tokens(view),
+            history_messages=len(state["messages"]), sent_messages=len(view)
+        )
+        result = {"messages": [RemoveMessage(id=old.id) for old in removed] + [message]}
+        if summary != state.get("summary"):
+            result["summary"] = summary
+        return result
+
+    tracer = get_tracer()
+
+    def assistant(state: AgentState, config: RunnableConfig):
+        with tracer.span("node", "assistant"):
+            start = time.perf_counter()
+            view, removed, summary = memory.prepare(state["messages"], state.get("summary"))
+            with tracer.span("llm", ASSISTANT_MODEL) as span:
+                called = time.perf_counter()
+                message = chat_with_tools.invoke(view)
+                set_llm_attrs(span, called, view, message)
+            return update(state, config, start, view, removed, summary, message)
+
+    async def aassistant(state: AgentState, config: RunnableConfig):
+        with tracer.span("node", "assistant"):
+            start = time.perf_counter()
+            view, removed, summary = await memory.aprepare(state["messages"], state.get("summary"))
+            with tracer.span("llm", ASSISTANT_MODEL) as span:
+                called = time.perf_counter()
+                message = await chat_with_tools.ainvoke(view)
+                set_llm_attrs(span, called, view, message)
+            return update(state, config, start, view, removed, summary, message)
+
+    executor = ParallelToolExecutor(tools, timeouts=TOOL_TIMEOUTS, blocking=BLOCKING_TOOLS, max_workers=TOOL_WORKERS)
+
     ## The graph
     builder = StateGraph(AgentState)
 
     # Define nodes: these do the work
-    builder.add_node("assistant", assistant)
-    builder.add_node("tools", ToolNode(tools))
+    builder.add_node("assistant", RunnableLambda(assistant, afunc=aassistant, name="assistant"))
+    builder.add_node("tools", executor.as_node())
 
     # Define edges: these determine how the control flow moves
     builder.add_edge(START, "assistant")
@@ -43,4 +124,4 @@ def create_assistant_with_tools(tools: Sequence[Callable]):
         tools_condition,
     )
     builder.add_edge("tools", "assistant")
-    return builder.compile()
\ No newline at end of file
+    return builder.compile(checkpointer=checkpointer)
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""
+Prompt tokens per turn over a long conversation, with and without the memory policy
+
+Every turn asks about a guest, the (fake) guest tool answers with three long records, like
+guest_info_retriever does. Runs against the mock Ollama server unless --host is given, the
+prompt tokens are the prompt_eval_count reported by the server.
+
+```sh
+python bench_memory.py --turns 30
+python bench_memory.py --turns 30 --host http://localhost:11434
+```
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+from langchain.tools import Tool
+from langchain_core.messages import HumanMessage
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_ollama import MockOllama
+
+GUEST_RECORD = ("Name: {name}\nRelation: old friend from university days\n"
+                "Description: " + "A pioneer of computing who wrote about analytical engines and algorithms. " * 6 +
+                "\nEmail: {email}")
+
+
+def fake_guest_info(query: str) -> str:
+    names = [f"{query} {i}" for i in range(3)]
+    return "\n\n".join(GUEST_RECORD.format(name=name, email=f"guest{i}@example.com") for i, name in enumerate(names))
+
+
+def run_session(policy_name: str, turns: int) -> List[Optional[int]]:
+    from assistant import create_assistant_with_tools, default_memory
+    from memory import MemoryPolicy
+    from tool_executor import latency_log
+
+    policies = {
+        "unbounded": MemoryPolicy(max_tokens=10**9, old_tool_chars=10**9),
+        "budget": default_memory(summarize=False),
+        "budget+summary": default_memory(summarize=True),
+    }
+    tools = [Tool(name="guest_info_retriever", func=fake_guest_info, description="Guest records by name")]
+    alfred = create_assistant_with_tools(tools, memory=policies[policy_name])
+    latency_log.clear()
+    state: Dict = {"messages": []}
+    for turn in range(turns):
+        state = alfred.invoke({**state, "messages": state["messages"] + [HumanMessage(content=f"Tell me about guest {turn}")]})
+    return [entry.get("prompt_tokens") for entry in latency_log.entries if entry["step"] == "assistant"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prompt tokens per turn with each memory policy")
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--host", default=None, help="real ollama url, the mock server by default")
+    parser.add_argument("--policies", nargs="+", default=["unbounded", "budget", "budget+summary"])
+    args = parser.parse_args()
+
+    server = None
+    if args.host is None:
+        server = MockOllama(tokens=40, tokens_per_s=0)
+        os.environ["OLLAMA_HOST"] = server.start()
+    else:
+        os.environ["OLLAMA_HOST"] = args.host
+
+    print(f"Prompt tokens of every model call ({args.turns} turns, 2 calls per turn)")
+    for name in args.policies:
+        start = time.perf_counter()
+        tokens = [value or 0 for value in run_session(name, args.turns)]
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<15} first={tokens[0]:>6} last={tokens[-1]:>6} max={max(tokens):>6} "
+              f"total={sum(tokens):>8} ({elapsed:.1f}s)")
+    if server is not None:
+        server.stop()
@@ -0,0 +1,316 @@
+"""
+Benchmarks of the guest retriever
+
+Cold start: time from a new python process until the first query is answered, with the
+previous retriever (`BM25Retriever.from_documents(load_documents())`) and with the
+persistent index (`GuestIndex`). Each measure runs in its own process.
+
+```sh
+# Real dataset (downloads it the first time)
+python bench_retriever.py cold-start
+# Synthetic guests, no network needed
+python bench_retriever.py cold-start --synthetic 100000
+```
+
+Query latency: `BM25Retriever.invoke` against `GuestIndex.invoke` and `GuestIndex.batch` at
+several corpus sizes of synthetic guests.
+
+```sh
+python bench_retriever.py query --sizes 1000 10000 100000 --queries 50
+```
+
+Dense retrieval: recall@k and latency of BM25, dense and hybrid (dense_index.py). The queries
+use other forms of the description words of the guests ("mathematics" for "mathematician"),
+a guest is relevant when its description has all the words. `--embedder hashing` runs
+offline, `mock` goes through /api/embed of the mock server, `ollama` uses a real embedding model.
+
+```sh
+python bench_retriever.py dense --sizes 1000 10000 --queries 100 --embedder hashing
+python bench_retriever.py dense --sizes 1000 --embedder ollama --embed-model nomic-embed-text
+```
+
+Memory: peak RSS of a process that builds the retriever from synthetic guests and answers a
+query, before (a `Document` per guest and `BM25Retriever`) and after (guests streamed into
+`GuestIndex` and its columnar guest store), and of a process that opens the built index and
+answers BM25 queries or a name lookup. Each case runs in its own process, a case that runs
+out of memory is reported.
+
+```sh
+python bench_retriever.py memory --sizes 100000 1000000
+```
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Iterator, List, Optional, Set, Tuple
+
+from langchain.docstore.document import Document
+from guest_store import Guest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+QUERY = "Lady Ada Lovelace"
+
+_FIRST_NAMES = ["Ada", "Nikola", "Marie", "Alan", "Grace", "Charles", "Emmy", "Richard", "Rosalind", "Carl"]
+_LAST_NAMES = ["Lovelace", "Tesla", "Curie", "Turing", "Hopper", "Babbage", "Noether", "Feynman", "Franklin", "Sagan"]
+_RELATIONS = ["best friend", "old colleague", "business partner", "neighbor", "cousin", "former classmate"]
+_WORDS = ("mathematician engineer scientist inventor physicist chemist writer pioneer computing energy "
+          "wireless radiation algorithm analytical engine compiler navy prize research theory").split()
+# Other form of each description word, BM25 doesn't match them
+_VARIANTS = dict(zip(_WORDS, ("mathematics engineering science invention physics chemistry writing pioneering "
+                              "computers energetic wirelessly radioactive algorithms analysis engines compilers "
+                              "naval prizes researcher theories").split()))
+
+
+def iter_synthetic_guests(n: int, seed: int = 42) -> Iterator[Guest]:
+    """Guests streamed one at a time, like `iter_guests()`"""
+    rnd = random.Random(seed)
+    for i in range(n):
+        yield Guest(
+            name=f"{rnd.choice(_FIRST_NAMES)} {rnd.choice(_LAST_NAMES)} {i}",
+            relation=rnd.choice(_RELATIONS),
+            description=" ".join(rnd.choices(_WORDS, k=rnd.randint(8, 30))),
+            email=f"guest{i}@example.com",
+        )
+
+
+def synthetic_guests(n: int, seed: int = 42) -> List[Document]:
+    """Documents with the same layout as `load_documents()`"""
+    return [guest.document() for guest in iter_synthetic_guests(n, seed)]
+
+
+_COLD_START_SNIPPETS = {
+    "bm25_retriever": """
+from langchain_community.retrievers import BM25Retriever
+from retriever import load_documents
+BM25Retriever.from_documents(load_documents()).invoke({query!r})
+""",
+    "guest_index": """
+from retriever import get_guest_index
+get_guest_index().invoke({query!r})
+""",
+    "bm25_retriever_synthetic": """
+from langchain_community.retrievers import BM25Retriever
+from bench_retriever import synthetic_guests
+BM25Retriever.from_documents(synthetic_guests({n})).invoke({query!r})
+""",
+    "guest_index_synthetic": """
+from guest_index import GuestIndex
+GuestIndex({directory!r}).invoke({query!r})
+""",
+}
+
+
+def _run_cold(snippet: str) -> float:
+    """Run a snippet in a new process and return the seconds until the first query finished"""
+    code = "import time\n_t = time.perf_counter()\n" + snippet + "\nprint(time.perf_counter() - _t)\n"
+    output = subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def bench_cold_start(synthetic: int = 0, repeat: int = 3):
+    if synthetic:
+        from guest_index import GuestIndex
+        directory = tempfile.mkdtemp(prefix="guest_index_")
+        GuestIndex.build(iter_synthetic_guests(synthetic), directory)
+        cases = {
+            "before (BM25Retriever)": _COLD_START_SNIPPETS["bm25_retriever_synthetic"].format(n=synthetic, query=QUERY),
+            "after (GuestIndex)": _COLD_START_SNIPPETS["guest_index_synthetic"].format(directory=directory, query=QUERY),
+        }
+    else:
+        # Build the index once so the "after" case measures the warm on-disk index
+        _run_cold(_COLD_START_SNIPPETS["guest_index"].format(query=QUERY))
+        cases = {
+            "before (BM25Retriever)": _COLD_START_SNIPPETS["bm25_retriever"].format(query=QUERY),
+            "after (GuestIndex)": _COLD_START_SNIPPETS["guest_index"].format(query=QUERY),
+        }
+
+    print(f"Cold start until first query ({synthetic or 'dataset'} guests, best of {repeat})")
+    for name, snippet in cases.items():
+        best = min(_run_cold(snippet) for _ in range(repeat))
+        print(f"  {name:<24} {best * 1000:10.1f} ms")
+
+
+def synthetic_queries(n: int, seed: int = 7) -> List[str]:
+    rnd = random.Random(seed)
+    return [
+        f"{rnd.choice(_FIRST_NAMES)} {rnd.choice(_LAST_NAMES)}" if i % 2 == 0 else " ".join(rnd.choices(_WORDS, k=3))
+        for i in range(n)
+    ]
+
+
+def bench_query(sizes: List[int], num_queries: int = 50):
+    from langchain_community.retrievers import BM25Retriever
+    from guest_index import GuestIndex
+
+    queries = synthetic_queries(num_queries)
+    print(f"Query latency, mean of {num_queries} queries (ms/query)")
+    print(f"  {'guests':>10} {'BM25Retriever':>14} {'GuestIndex':>12} {'batch':>10} {'speedup':>8}")
+    for size in sizes:
+        retriever = BM25Retriever.from_documents(synthetic_guests(size))
+        index = GuestIndex.build(iter_synthetic_guests(size), tempfile.mkdtemp(prefix="guest_index_"))
+
+        def mean_ms(fn):
+            t = time.perf_counter()
+            fn()
+            return (time.perf_counter() - t) * 1000 / num_queries
+
+        # Warm-up: the name index is built on the first query, not counted per query
+        index.invoke(queries[0])
+        before = mean_ms(lambda: [retriever.invoke(q) for q in queries])
+        after = mean_ms(lambda: [index.invoke(q) for q in queries])
+        batch = mean_ms(lambda: index.batch(queries))
+        print(f"  {size:>10} {before:>14.2f} {after:>12.3f} {batch:>10.3f} {before / after:>7.0f}x")
+
+
+def labeled_queries(guests: List[Guest], n: int, words: int = 3, seed: int = 11) -> List[Tuple[str, Set[int]]]:
+    """
+    Queries made of `words` description words of a guest, half of them in their other form,
+    with the guests whose description has all the words
+    """
+    rnd = random.Random(seed)
+    descriptions = [set(guest.description.split()) for guest in guests]
+    queries = []
+    for i in range(n):
+        chosen = rnd.sample(sorted(descriptions[rnd.randrange(len(guests))]), words)
+        text = " ".join(_VARIANTS[word] if i % 2 else word for word in chosen)
+        queries.append((f"the {text} guest", {doc_id for doc_id, words_ in enumerate(descriptions) if words_.issuperset(chosen)}))
+    return queries
+
+
+def _embedder(kind: str, model: str):
+    from dense_index import HashingEmbedder, OllamaEmbedder
+    if kind == "hashing":
+        return HashingEmbedder()
+    if kind == "mock":
+        return OllamaEmbedder("mock-embed", document_prefix="", query_prefix="")
+    return OllamaEmbedder(model)
+
+
+def bench_dense(sizes: List[int], num_queries: int = 100, kind: str = "hashing", model: str = "nomic-embed-text", k: int = 4):
+    from dense_index import RETRIEVAL_MODES, DenseIndex, HybridRetriever
+    from guest_index import GuestIndex
+
+    server = None
+    if kind == "mock":
+        sys.path.append(os.path.dirname(HERE))
+        from mock_ollama import MockOllama
+        server = MockOllama()
+        os.environ["OLLAMA_HOST"] = server.start()
+
+    print(f"Recall@{k} and latency of {num_queries} queries ({kind} embedder)")
+    print(f"  {'guests':>10} {'mode':>16} {'recall':>8} {'ms/query':>10}")
+    for size in sizes:
+        guests = list(iter_synthetic_guests(size))
+        queries = labeled_queries(guests, num_queries)
+        index = GuestIndex.build(guests, tempfile.mkdtemp(prefix="guest_index_"))
+        del guests
+        embedder = _embedder(kind, model)
+        dense = DenseIndex(index, embedder)
+        start = time.perf_counter()
+        dense.search(queries[0][0], 1)
+        build_s = time.perf_counter() - start
+        print(f"  {size:>10} {'(embed guests)':>16} {'':>8} {build_s * 1000:>10.1f}  "
+              f"{os.path.getsize(dense.path) / 2**20:.1f} MiB {dense.vectors.dtype}")
+
+        def run(name: str, retriever: HybridRetriever):
+            start = time.perf_counter()
+            results = [retriever.search(query, k) for query, _ in queries]
+            elapsed = (time.perf_counter() - start) * 1000 / len(queries)
+            recall = sum(len({doc_id for doc_id, _ in found} & relevant) / min(k, len(relevant))
+                         for found, (_, relevant) in zip(results, queries)) / len(queries)
+            print(f"  {size:>10} {name:>16} {recall:>8.3f} {elapsed:>10.3f}")
+
+        for mode in RETRIEVAL_MODES:
+            embedder.clear_cache()
+            run(mode, HybridRetriever(index, dense, mode=mode))
+        # Same queries again: the query embeddings come from the cache
+        run("hybrid (cached)", HybridRetriever(index, dense, mode="hybrid"))
+    if server is not None:
+        server.stop()
+
+
+_MEMORY_SNIPPETS = {
+    "before (Documents + BM25Retriever)": """
+from langchain_community.retrievers import BM25Retriever
+from bench_retriever import synthetic_guests
+BM25Retriever.from_documents(synthetic_guests({n})).invoke({query!r})
+""",
+    "after (streamed GuestIndex, BM25 query)": """
+from guest_index import GuestIndex
+from bench_retriever import iter_synthetic_guests
+GuestIndex.build(iter_synthetic_guests({n}), {directory!r}).batch([{query!r}])
+""",
+    "after (streamed GuestIndex)": """
+from guest_index import GuestIndex
+from bench_retriever import iter_synthetic_guests
+GuestIndex.build(iter_synthetic_guests({n}), {directory!r}).invoke({query!r})
+""",
+    "after, open index + BM25 queries": """
+from guest_index import GuestIndex
+GuestIndex({directory!r}).batch(["mathematician engine", "wireless energy inventor"])
+""",
+    # The name fast path builds the trigram index of all the names on its first query
+    "after, open index + name lookup": """
+from guest_index import GuestIndex
+GuestIndex({directory!r}).invoke({query!r})
+""",
+}
+
+
+def _peak_rss_mib(snippet: str) -> Tuple[Optional[float], Optional[float], str]:
+    """Run a snippet in a new process: (peak RSS MiB, seconds, error)"""
+    code = snippet + "\nimport resource, time\nprint(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, time.process_time())\n"
+    process = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True)
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit code {process.returncode}"
+        if process.returncode < 0:
+            error = f"killed by signal {-process.returncode} (out of memory?)"
+        return None, None, error
+    peak, seconds = process.stdout.split()[-2:]
+    return float(peak), float(seconds), ""
+
+
+def bench_memory(sizes: List[int], skip_before: bool = False):
+    print("Peak RSS until the first query is answered (MiB, CPU seconds)")
+    print(f"  {'guests':>10} {'case':<40} {'peak MiB':>10} {'cpu s':>8} {'index MiB':>10}")
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix="guest_index_")
+        for name, snippet in _MEMORY_SNIPPETS.items():
+            if skip_before and name.startswith("before"):
+                continue
+            peak, seconds, error = _peak_rss_mib(snippet.format(n=size, directory=directory, query=QUERY))
+            if error:
+                print(f"  {size:>10} {name:<40} failed: {error}")
+                continue
+            on_disk = "-"
+            if not name.startswith("before"):
+                on_disk = f"{sum(entry.stat().st_size for entry in os.scandir(directory)) / 2**20:.0f}"
+            print(f"  {size:>10} {name:<40} {peak:>10.0f} {seconds:>8.1f} {on_disk:>10}")
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Guest retriever benchmarks")
+    parser.add_argument("bench", choices=["cold-start", "query", "dense", "memory"])
+    parser.add_argument("--synthetic", type=int, default=0, help="number of synthetic guests, 0 uses the dataset")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--embedder", choices=["hashing", "mock", "ollama"], default="hashing")
+    parser.add_argument("--embed-model", default="nomic-embed-text")
+    parser.add_argument("--skip-before", action="store_true", help="memory: only the streamed index")
+    args = parser.parse_args()
+
+    if args.bench == "cold-start":
+        bench_cold_start(args.synthetic, args.repeat)
+    elif args.bench == "query":
+        bench_query(args.sizes, args.queries)
+    elif args.bench == "dense":
+        bench_dense(args.sizes, args.queries, args.embedder, args.embed_model)
+    elif args.bench == "memory":
+        bench_memory(args.sizes, args.skip_before)
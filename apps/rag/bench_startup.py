@@ -0,0 +1,128 @@
+"""
+Startup benchmark of the agent: import time of the modules and time to first response
+
+- import time: `python -X importtime -c "import <module>"` in a fresh interpreter, the
+  cumulative time of the module, its heaviest direct imports and whether it pulled in
+  the packages that only some tools need (LAZY_PACKAGES)
+- time to first response: `app.py` is started against the mock Ollama server (or --host)
+  and timed until it prints the first answer. The target is TTFR_TARGET_S.
+
+```sh
+python bench_startup.py
+python bench_startup.py --modules tools retriever app --top 8
+python bench_startup.py --host http://localhost:11434
+```
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_ollama import MockOllama
+
+RAG_DIR = os.path.dirname(os.path.abspath(__file__))
+# Time from starting app.py to its first answer (imports, graph, model preload, first question)
+TTFR_TARGET_S = 5.0
+# Packages that only some tools need, they should not be imported at startup
+LAZY_PACKAGES = ("numpy", "scipy", "datasets", "huggingface_hub", "langchain_community", "duckduckgo_search")
+
+
+def parse_importtime(stderr: str) -> List[Tuple[int, float, float, str]]:
+    """(depth, self_s, cumulative_s, module) of every line of -X importtime, in the order of the output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((depth, int(self_us) / 1e6, int(cumulative_us) / 1e6, name.strip()))
+    return rows
+
+
+def import_time(module: str, top: int = 5) -> Dict[str, Any]:
+    command = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=RAG_DIR, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        return {"module": module, "error": process.stderr.strip().splitlines()[-1]}
+    rows = parse_importtime(process.stderr)
+    # The module is the last line, its own imports are listed before it one level deeper
+    direct = []
+    for row in reversed(rows[:-1]):
+        if row[0] == 0:
+            break
+        if row[0] == 1:
+            direct.append(row)
+    imported = {name.split(".")[0] for _, _, _, name in rows}
+    return {
+        "module": module,
+        "import_s": round(rows[-1][2], 3),
+        "process_s": round(wall, 3),
+        "modules": len(rows),
+        "heaviest": [(name, round(cumulative, 3)) for _, _, cumulative, name in
+                     sorted(direct, key=lambda row: row[2], reverse=True)[:top]],
+        "lazy_packages_imported": sorted(imported.intersection(LAZY_PACKAGES)),
+    }
+
+
+def time_to_first_response(host: str, timeout_s: float = 120.0) -> Dict[str, Any]:
+    """Start app.py and wait for its first answer"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "OLLAMA_HOST": host, "PYTHONUNBUFFERED": "1"}
+        command = [sys.executable, "app.py", "--session", "startup", "--checkpoints", os.path.join(tmp, "checkpoints.sqlite")]
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=RAG_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        ready_s: Optional[float] = None
+        first_s: Optional[float] = None
+        try:
+            for line in process.stdout:
+                elapsed = time.perf_counter() - start
+                if ready_s is None and "is ready" in line:
+                    ready_s = elapsed
+                if line.startswith("- Question:"):
+                    first_s = elapsed
+                    break
+                if elapsed > timeout_s:
+                    break
+        finally:
+            process.terminate()
+            process.wait()
+    return {"ready_s": round(ready_s, 3) if ready_s is not None else None,
+            "first_response_s": round(first_s, 3) if first_s is not None else None,
+            "target_s": TTFR_TARGET_S, "ok": first_s is not None and first_s <= TTFR_TARGET_S}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time and time to first response of the agent")
+    parser.add_argument("--modules", nargs="+", default=["tools", "retriever", "app"])
+    parser.add_argument("--top", type=int, default=5, help="heaviest direct imports shown")
+    parser.add_argument("--host", default=None, help="real ollama url, the mock server by default")
+    parser.add_argument("--skip-app", action="store_true", help="only the import times")
+    args = parser.parse_args()
+
+    baseline = import_time("sys")
+    print(f"Interpreter startup: {baseline['process_s']}s")
+    for module in args.modules:
+        result = import_time(module, args.top)
+        if "error" in result:
+            print(f"  {module:<12} failed: {result['error']}")
+            continue
+        print(f"  {module:<12} import={result['import_s']:>6}s process={result['process_s']:>6}s "
+              f"modules={result['modules']:>5} lazy packages imported={result['lazy_packages_imported']}")
+        for name, seconds in result["heaviest"]:
+            print(f"      {name:<40} {seconds:>6}s")
+
+    if not args.skip_app:
+        server = None
+        host = args.host
+        if host is None:
+            server = MockOllama(tokens=20, tokens_per_s=0)
+            host = server.start()
+        print("Time to first response of app.py:", time_to_first_response(host))
+        if server is not None:
+            server.stop()
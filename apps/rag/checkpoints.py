@@ -0,0 +1,320 @@
+"""
+Persistent agent sessions: SQLite checkpointer of the graph state, keyed by thread id
+
+LangGraph saves a checkpoint after every node (super-step), so a session survives a
+crash or a restart of the worker:
+- the state of a thread (messages, summary) is loaded from the store, the app only sends
+  the new question
+- a run that failed in the middle resumes from the last finished node with
+  `graph.invoke(None, thread_config(thread_id))`: the finished nodes (and their model
+  calls) are not run again
+- a finished thread is read from the store without calling the model
+
+Every checkpoint holds the full channel values, and the messages are the largest part
+(tool outputs, Ollama metadata), so the payloads above `compress_min_bytes` are
+zlib compressed and only the last `keep_last` checkpoints of every thread are kept.
+Threads not updated in `max_age_s` are deleted. Pruning runs every `prune_every` writes.
+
+# Required packages (aiosqlite 0.21 is the version AsyncSqliteSaver 2.0.x was written for,
+# with 0.22+ the checkpoint tables are created by AsyncCompactSqliteSaver.setup, see there):
+pip install langgraph-checkpoint-sqlite==2.0.11 aiosqlite==0.21.0
+
+# Usage
+with open_checkpointer() as saver:
+    alfred = create_assistant_with_tools(tools, checkpointer=saver)
+    alfred.invoke({"messages": [HumanMessage(content="Hi")]}, thread_config("gala-1"))
+
+async with open_async_checkpointer() as saver:
+    ...
+"""
+import os
+import sqlite3
+import time
+import zlib
+from contextlib import asynccontextmanager, closing, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import aiosqlite
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "checkpoints.sqlite")
+DEFAULT_KEEP_LAST = 4
+DEFAULT_MAX_AGE_S = 7 * 24 * 3600
+DEFAULT_PRUNE_EVERY = 200
+COMPRESS_SUFFIX = "+zlib"
+
+# Tables of AsyncSqliteSaver.setup (langgraph-checkpoint-sqlite 2.0.x), for the aiosqlite versions it can't set up
+CHECKPOINT_TABLES_SQL = """
+PRAGMA journal_mode=WAL;
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+CREATE_THREADS_SQL = """
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+"""
+TOUCH_THREAD_SQL = "INSERT OR REPLACE INTO threads (thread_id, updated_at) VALUES (?, ?)"
+# Checkpoint ids are time ordered (uuid6), the same order get_tuple uses for the latest one
+PRUNE_CHECKPOINTS_SQL = """
+DELETE FROM checkpoints WHERE rowid IN (
+    SELECT rowid FROM (
+        SELECT rowid, ROW_NUMBER() OVER (
+            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+        ) AS position FROM checkpoints
+    ) WHERE position > ?
+)
+"""
+PRUNE_WRITES_SQL = """
+DELETE FROM writes WHERE NOT EXISTS (
+    SELECT 1 FROM checkpoints AS c WHERE c.thread_id = writes.thread_id
+    AND c.checkpoint_ns = writes.checkpoint_ns AND c.checkpoint_id = writes.checkpoint_id
+)
+"""
+EXPIRED_THREADS_SQL = "SELECT thread_id FROM threads WHERE updated_at < ?"
+STATS_SQL = """
+SELECT (SELECT COUNT(*) FROM threads), (SELECT COUNT(*) FROM checkpoints),
+       (SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints),
+       (SELECT COUNT(*) FROM writes), (SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes)
+"""
+
+
+def thread_config(thread_id: str) -> RunnableConfig:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+class CompactSerializer(JsonPlusSerializer):
+    """msgpack serializer of LangGraph, with zlib on the large payloads"""
+
+    def __init__(self, compress_min_bytes: int = 512, level: int = 6):
+        super().__init__()
+        self.compress_min_bytes = compress_min_bytes
+        self.level = level
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = super().dumps_typed(obj)
+        if len(data) < self.compress_min_bytes:
+            return type_, data
+        return type_ + COMPRESS_SUFFIX, zlib.compress(data, self.level)
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith(COMPRESS_SUFFIX):
+            return super().loads_typed((type_[:-len(COMPRESS_SUFFIX)], zlib.decompress(payload)))
+        return super().loads_typed(data)
+
+
+def _stats(row) -> Dict[str, int]:
+    threads, checkpoints, checkpoint_bytes, writes, write_bytes = row
+    return {"threads": threads, "checkpoints": checkpoints, "checkpoint_bytes": checkpoint_bytes,
+            "writes": writes, "write_bytes": write_bytes}
+
+
+class CompactSqliteSaver(SqliteSaver):
+    """SqliteSaver with compressed payloads and pruning of the old checkpoints"""
+
+    def __init__(self, conn: sqlite3.Connection, keep_last: int = DEFAULT_KEEP_LAST,
+                 max_age_s: Optional[float] = DEFAULT_MAX_AGE_S, prune_every: int = DEFAULT_PRUNE_EVERY):
+        """
+        :param conn: sqlite3.Connection: connection opened with check_same_thread=False
+        :param keep_last: int: checkpoints kept per thread, the last one is enough to resume
+        :param max_age_s: Optional[float]: threads not updated in this time are deleted, None keeps them
+        :param prune_every: int: checkpoint writes between two prunes
+        """
+        if keep_last < 1:
+            raise ValueError("keep_last must be at least 1, the last checkpoint is the state of the thread")
+        super().__init__(conn, serde=CompactSerializer())
+        self.keep_last = keep_last
+        self.max_age_s = max_age_s
+        self.prune_every = prune_every
+        self._puts = 0
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(CREATE_THREADS_SQL)
+
+    def put(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        with self.cursor() as cur:
+            cur.execute(TOUCH_THREAD_SQL, (str(config["configurable"]["thread_id"]), time.time()))
+        self._puts += 1
+        if self.prune_every and self._puts % self.prune_every == 0:
+            self.prune()
+        return saved
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM threads WHERE thread_id = ?", (str(thread_id),))
+
+    def prune(self, keep_last: Optional[int] = None, max_age_s: Optional[float] = None) -> Dict[str, int]:
+        """
+        Delete the expired threads and the checkpoints (and their writes) before the last `keep_last`
+
+        :return: deleted threads, checkpoints and writes
+        """
+        max_age_s = self.max_age_s if max_age_s is None else max_age_s
+        deleted = {"threads": 0, "checkpoints": 0, "writes": 0}
+        if max_age_s is not None:
+            with self.cursor(transaction=False) as cur:
+                expired = [row[0] for row in cur.execute(EXPIRED_THREADS_SQL, (time.time() - max_age_s,))]
+            for thread_id in expired:
+                self.delete_thread(thread_id)
+            deleted["threads"] = len(expired)
+        with self.cursor() as cur:
+            deleted["checkpoints"] = cur.execute(PRUNE_CHECKPOINTS_SQL, (keep_last or self.keep_last,)).rowcount
+            deleted["writes"] = cur.execute(PRUNE_WRITES_SQL).rowcount
+        return deleted
+
+    def stats(self) -> Dict[str, int]:
+        with self.cursor(transaction=False) as cur:
+            return _stats(cur.execute(STATS_SQL).fetchone())
+
+
+class AsyncCompactSqliteSaver(AsyncSqliteSaver):
+    """Async version of CompactSqliteSaver, for `graph.ainvoke`"""
+
+    def __init__(self, conn: aiosqlite.Connection, keep_last: int = DEFAULT_KEEP_LAST,
+                 max_age_s: Optional[float] = DEFAULT_MAX_AGE_S, prune_every: int = DEFAULT_PRUNE_EVERY):
+        if keep_last < 1:
+            raise ValueError("keep_last must be at least 1, the last checkpoint is the state of the thread")
+        super().__init__(conn, serde=CompactSerializer())
+        self.keep_last = keep_last
+        self.max_age_s = max_age_s
+        self.prune_every = prune_every
+        self._puts = 0
+        self._threads_ready = False
+
+    async def setup(self) -> None:
+        if hasattr(self.conn, "is_alive"):
+            await super().setup()
+        else:
+            await self._setup_checkpoint_tables()
+        if self._threads_ready:
+            return
+        async with self.lock:
+            if not self._threads_ready:
+                await self.conn.executescript(CREATE_THREADS_SQL)
+                await self.conn.commit()
+                self._threads_ready = True
+
+    async def _setup_checkpoint_tables(self):
+        """
+        AsyncSqliteSaver.setup without `conn.is_alive()`: since aiosqlite 0.22 the connection
+        is no longer a Thread and has no is_alive, the base setup raises AttributeError.
+        The connections of open_async_checkpointer are already started (`async with`)
+        """
+        async with self.lock:
+            if self.is_setup:
+                return
+            await self.conn.executescript(CHECKPOINT_TABLES_SQL)
+            await self.conn.commit()
+            self.is_setup = True
+
+    async def aput(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        saved = await super().aput(config, checkpoint, metadata, new_versions)
+        await self.setup()
+        async with self.lock:
+            await self.conn.execute(TOUCH_THREAD_SQL, (str(config["configurable"]["thread_id"]), time.time()))
+            await self.conn.commit()
+        self._puts += 1
+        if self.prune_every and self._puts % self.prune_every == 0:
+            await self.aprune()
+        return saved
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await super().adelete_thread(thread_id)
+        async with self.lock:
+            await self.conn.execute("DELETE FROM threads WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+    async def aprune(self, keep_last: Optional[int] = None, max_age_s: Optional[float] = None) -> Dict[str, int]:
+        await self.setup()
+        max_age_s = self.max_age_s if max_age_s is None else max_age_s
+        deleted = {"threads": 0, "checkpoints": 0, "writes": 0}
+        if max_age_s is not None:
+            async with self.lock:
+                async with self.conn.execute(EXPIRED_THREADS_SQL, (time.time() - max_age_s,)) as cur:
+                    expired = [row[0] for row in await cur.fetchall()]
+            for thread_id in expired:
+                await self.adelete_thread(thread_id)
+            deleted["threads"] = len(expired)
+        async with self.lock:
+            async with self.conn.execute(PRUNE_CHECKPOINTS_SQL, (keep_last or self.keep_last,)) as cur:
+                deleted["checkpoints"] = cur.rowcount
+            async with self.conn.execute(PRUNE_WRITES_SQL) as cur:
+                deleted["writes"] = cur.rowcount
+            await self.conn.commit()
+        return deleted
+
+    async def astats(self) -> Dict[str, int]:
+        await self.setup()
+        async with self.lock, self.conn.execute(STATS_SQL) as cur:
+            return _stats(await cur.fetchone())
+
+
+def _prepare_path(path: str):
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+
+@contextmanager
+def open_checkpointer(path: str = DEFAULT_CHECKPOINT_PATH, **options) -> Iterator[CompactSqliteSaver]:
+    """
+    :param path: str: SQLite file, ":memory:" for a process only store
+    :param options: keep_last, max_age_s, prune_every of CompactSqliteSaver
+    """
+    _prepare_path(path)
+    with closing(sqlite3.connect(path, check_same_thread=False)) as conn:
+        yield CompactSqliteSaver(conn, **options)
+
+
+@asynccontextmanager
+async def open_async_checkpointer(path: str = DEFAULT_CHECKPOINT_PATH, **options) -> AsyncIterator[AsyncCompactSqliteSaver]:
+    _prepare_path(path)
+    async with aiosqlite.connect(path) as conn:
+        yield AsyncCompactSqliteSaver(conn, **options)
+
+
+def resume(graph, thread_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Finish the interrupted run of a thread from its last checkpoint
+
+    :return: the final state, None when the thread has nothing pending
+    """
+    config = thread_config(thread_id)
+    if not graph.get_state(config).next:
+        return None
+    return graph.invoke(None, config)
+
+
+async def aresume(graph, thread_id: str) -> Optional[Dict[str, Any]]:
+    config = thread_config(thread_id)
+    if not (await graph.aget_state(config)).next:
+        return None
+    return await graph.ainvoke(None, config)
@@ -0,0 +1,354 @@
+"""
+Dense (embedding) retrieval of the guests, and hybrid fusion with BM25
+
+BM25 only matches the words of the query: "the mathematician who worked on the analytical
+engine" misses a guest described as a "pioneer of computing". The dense index embeds every
+guest document and answers with the closest vectors (cosine similarity):
+
+- vectors are L2 normalized and saved in the GuestIndex folder (dense_<embedder>_<dtype>.npy),
+  a new process memory-maps them. float32 is scored by BLAS straight from the map, float16
+  halves the memory but every query converts the rows (~40x slower scoring)
+- top k is a brute-force matrix-vector product over chunks of rows and an argpartition,
+  a few ms for 100k guests, so no ANN index is needed at the size of a guest list
+- guests added or updated in the GuestIndex are embedded on the next query, deleted ones
+  are masked with its live mask. compact() writes a new folder, so the vectors are built again
+- query embeddings are cached (LRU) by normalized query
+
+`HybridRetriever` keeps the name fast path of GuestIndex and fuses the BM25 and dense
+rankings with Reciprocal Rank Fusion. When the embedding model can't be reached it answers
+with BM25 only, and tries the model again after `DENSE_RETRY_S`.
+
+Embedders:
+- OllamaEmbedder: /api/embed of an Ollama embedding model (`ollama pull nomic-embed-text`)
+- HashingEmbedder: signed hashing of the character trigrams, offline stand-in (CI, benchmarks)
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from guest_index import TOP_K, GuestIndex, top_k
+from tool_guard import normalize_query
+
+# Shared ollama client layer lives in apps/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ollama_pool import get_pool
+
+EMBED_MODEL = "nomic-embed-text"
+EMBED_KEEP_ALIVE = "30m"
+# nomic-embed-text is trained with a task prefix on each text
+EMBED_DOCUMENT_PREFIX = "search_document: "
+EMBED_QUERY_PREFIX = "search_query: "
+EMBED_BATCH = 64
+HASHING_DIM = 256
+QUERY_CACHE_SIZE = 1024
+# Rows scored at a time, bounds the float32 copy of a float16 matrix
+SEARCH_CHUNK_ROWS = 65_536
+RETRIEVAL_MODES = ("bm25", "dense", "hybrid")
+# Candidates taken from each ranking before the fusion, and the RRF constant
+FUSION_CANDIDATES = 20
+RRF_K = 60
+DENSE_RETRY_S = 60.0
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class Embedder:
+    """Normalized float32 embeddings, with a LRU cache of the query embeddings"""
+
+    name = "embedder"
+
+    def __init__(self, cache_size: int = QUERY_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _embed(self, texts: Sequence[str], query: bool) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed_documents(self, texts: Sequence[str]) -> np.ndarray:
+        return _normalize(self._embed(texts, query=False))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return vector
+            self.cache_misses += 1
+        vector = _normalize(self._embed([text], query=True))[0]
+        with self._lock:
+            self._cache[key] = vector
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vector
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def cache_metrics(self) -> Dict[str, Any]:
+        total = self.cache_hits + self.cache_misses
+        return {"hits": self.cache_hits, "misses": self.cache_misses, "entries": len(self._cache),
+                "hit_ratio": round(self.cache_hits / total, 3) if total else 0.0}
+
+
+class OllamaEmbedder(Embedder):
+    def __init__(self, model: str = EMBED_MODEL, keep_alive: str = EMBED_KEEP_ALIVE, batch_size: int = EMBED_BATCH,
+                 document_prefix: str = EMBED_DOCUMENT_PREFIX, query_prefix: str = EMBED_QUERY_PREFIX,
+                 client: Any = None, cache_size: int = QUERY_CACHE_SIZE):
+        """
+        :param model: str: ollama embedding model
+        :param batch_size: int: documents per /api/embed request
+        :param document_prefix: str: task prefix of the documents, "" for models without one
+        :param query_prefix: str: task prefix of the queries
+        :param client: Any: ollama.Client, the shared pool by default
+        """
+        super().__init__(cache_size)
+        self.model = model
+        self.keep_alive = keep_alive
+        self.batch_size = batch_size
+        self.document_prefix = document_prefix
+        self.query_prefix = query_prefix
+        self.client = client or get_pool().client()
+        self.name = f"ollama-{model}"
+
+    def _embed(self, texts: Sequence[str], query: bool) -> np.ndarray:
+        prefix = self.query_prefix if query else self.document_prefix
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [prefix + text for text in texts[start:start + self.batch_size]]
+            vectors.extend(self.client.embed(model=self.model, input=batch, keep_alive=self.keep_alive)["embeddings"])
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class HashingEmbedder(Embedder):
+    """Offline embedder: texts that share words (or parts of words) are close, no semantics"""
+
+    def __init__(self, dim: int = HASHING_DIM, cache_size: int = QUERY_CACHE_SIZE):
+        super().__init__(cache_size)
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _embed(self, texts: Sequence[str], query: bool) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            padded = f" {' '.join(text.casefold().split())} "
+            buckets = np.fromiter((zlib.crc32(padded[i:i + 3].encode()) for i in range(len(padded) - 2)),
+                                  dtype=np.uint32, count=max(len(padded) - 2, 0))
+            signs = np.where(buckets & 0x80000000, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[row], buckets % self.dim, signs)
+        return vectors
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[Tuple[int, float]]], k: int = TOP_K,
+                           rrf_k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse (doc id, score) rankings: every list adds 1 / (rrf_k + rank) to its documents"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
+
+
+class DenseIndex:
+    """Embeddings of the documents of a GuestIndex, by doc id"""
+
+    def __init__(self, guest_index: GuestIndex, embedder: Embedder, dtype: str = "float32"):
+        """
+        :param guest_index: GuestIndex: documents to embed, the vectors are saved in its folder
+        :param embedder: Embedder: model of the documents and the queries
+        :param dtype: str: float32, or float16 for half the memory and slower queries
+        """
+        self.guest_index = guest_index
+        self.embedder = embedder
+        self.dtype = np.dtype(dtype)
+        self.embedded = 0
+        self.vectors: Optional[np.ndarray] = None
+        self._delta: Optional[np.ndarray] = None
+        # meta of the GuestIndex the vectors belong to, a new object after compact()
+        self._meta: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        name = re.sub(r"[^\w.-]", "_", self.embedder.name)
+        return os.path.join(self.guest_index.directory, f"dense_{name}_{self.dtype.name}.npy")
+
+    def _saved_meta(self) -> Dict[str, Any]:
+        return {"embedder": self.embedder.name, "dtype": self.dtype.name, "num_docs": self.guest_index.num_base,
+                "fingerprint": self.guest_index.fingerprint}
+
+    def _load_or_build(self) -> np.ndarray:
+        meta_path = self.path[:-len(".npy")] + ".json"
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                if json.load(f) == self._saved_meta():
+                    return np.load(self.path, mmap_mode="r")
+        except (OSError, ValueError):
+            pass
+        vectors = self._build()
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(self._saved_meta(), f)
+        return vectors
+
+    def _build(self) -> np.ndarray:
+        """Embed the base documents in batches straight into the memory-mapped file"""
+        index = self.guest_index
+        batch_size = getattr(self.embedder, "batch_size", EMBED_BATCH)
+        tmp_path = self.path + ".tmp"
+        matrix = None
+        for start in range(0, index.num_base, batch_size):
+            texts = [index.page_content(doc_id) for doc_id in range(start, min(start + batch_size, index.num_base))]
+            vectors = self.embedder.embed_documents(texts)
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype,
+                                                   shape=(index.num_base, vectors.shape[1]))
+            matrix[start:start + len(texts)] = vectors
+            self.embedded += len(texts)
+        if matrix is None:
+            return np.zeros((0, 0), dtype=self.dtype)
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, self.path)
+        return np.load(self.path, mmap_mode="r")
+
+    def _sync(self) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray], Dict[str, Any]]:
+        """
+        Load (or build) the vectors of the base documents and embed the new delta documents.
+        The guest index is read under its lock (compact() closes the store and renumbers the
+        documents), the delta documents are embedded after it. Returns the base vectors, the
+        delta vectors, the live mask and the meta of the index they belong to
+        """
+        index = self.guest_index
+        with index.lock:
+            if self._meta is not index.meta:
+                self.vectors = self._load_or_build()
+                self._delta = None
+                self._meta = index.meta
+            done = index.num_base + (0 if self._delta is None else len(self._delta))
+            texts = [index.page_content(doc_id) for doc_id in range(done, index.num_slots)]
+            live = index.live_mask()
+        if texts:
+            vectors = self.embedder.embed_documents(texts)
+            self.embedded += len(vectors)
+            self._delta = vectors if self._delta is None else np.concatenate([self._delta, vectors])
+        return self.vectors, self._delta, live, self._meta
+
+    def search(self, query: str, k: int = TOP_K) -> Optional[List[Tuple[int, float]]]:
+        """
+        (doc id, cosine similarity) of the k closest documents, None when the guest index was
+        compacted during the search (the ids changed, the caller falls back to BM25)
+        """
+        query_vector = self.embedder.embed_query(query)
+        with self._lock:
+            vectors, delta, live, meta = self._sync()
+        num_base = len(vectors)
+        scores = np.empty(num_base + (0 if delta is None else len(delta)), dtype=np.float32)
+        for start in range(0, num_base, SEARCH_CHUNK_ROWS):
+            chunk = vectors[start:start + SEARCH_CHUNK_ROWS]
+            scores[start:start + len(chunk)] = chunk.astype(np.float32, copy=False) @ query_vector
+        if delta is not None:
+            scores[num_base:] = delta @ query_vector
+        if live is not None:
+            if len(live) != len(scores):
+                return None
+            scores[~live] = -np.inf
+        if self.guest_index.meta is not meta:
+            return None
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top_k(scores, k) if scores[doc_id] != -np.inf]
+
+
+class HybridRetriever:
+    """Guest lookups: name fast path, then BM25, dense or both fused (RRF)"""
+
+    def __init__(self, guest_index: GuestIndex, dense: Optional[DenseIndex] = None, mode: str = "hybrid",
+                 candidates: int = FUSION_CANDIDATES, rrf_k: int = RRF_K):
+        """
+        :param guest_index: GuestIndex: BM25 index and documents
+        :param dense: Optional[DenseIndex]: embeddings, None is BM25 only
+        :param mode: str: bm25, dense or hybrid
+        :param candidates: int: documents of each ranking in the fusion
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"mode must be one of {RETRIEVAL_MODES}, got {mode!r}")
+        self.guest_index = guest_index
+        self.dense = dense
+        self.mode = mode if dense is not None else "bm25"
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.stats = {"name": 0, "bm25": 0, "dense": 0, "hybrid": 0, "fallback": 0}
+        self.last_error: Optional[str] = None
+        self._dense_down_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self.guest_index.version
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _dense_search(self, query: str, k: int) -> Optional[List[Tuple[int, float]]]:
+        """None when the embedding model failed (not pulled, server down) or the index was compacted meanwhile"""
+        if time.monotonic() < self._dense_down_until:
+            return None
+        try:
+            return self.dense.search(query, k)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._dense_down_until = time.monotonic() + DENSE_RETRY_S
+            return None
+
+    def search(self, query: str, k: int = TOP_K) -> Optional[List[Tuple[int, float]]]:
+        """(doc id, score) of the top k documents, None when the dense part is down"""
+        if self.mode == "bm25":
+            return self.guest_index.search(query, k)
+        dense = self._dense_search(query, k if self.mode == "dense" else self.candidates)
+        if dense is None:
+            return None
+        if self.mode == "dense":
+            return dense
+        return reciprocal_rank_fusion([self.guest_index.search(query, self.candidates), dense], k, self.rrf_k)
+
+    def invoke(self, query: str, k: int = TOP_K) -> List[Document]:
+        """Top k documents, same contract as GuestIndex.invoke"""
+        docs = self.guest_index.lookup_name(query)
+        if docs is not None:
+            self._count("name")
+            return docs[:k]
+        if self.mode == "bm25":
+            self._count("bm25")
+            return self.guest_index.batch([query], k)[0]
+        results = self.search(query, k)
+        if results is None:
+            self._count("fallback")
+            return self.guest_index.batch([query], k)[0]
+        self._count(self.mode)
+        return [self.guest_index.document(doc_id) for doc_id, _ in results]
+
+    def summary(self) -> Dict[str, Any]:
+        summary: Dict[str, Any] = {"mode": self.mode, **self.stats}
+        if self.dense is not None:
+            summary["embedded_docs"] = self.dense.embedded
+            summary["query_cache"] = self.dense.embedder.cache_metrics()
+        if self.last_error:
+            summary["last_error"] = self.last_error
+        return summary
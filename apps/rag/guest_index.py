@@ -0,0 +1,557 @@
+"""
+Persistent BM25 index of the guests
+
+The index is saved in a folder so a new process only needs to memory-map it instead of
+downloading the dataset and tokenizing the whole corpus again:
+
+- meta.json: dataset fingerprint, number of documents, BM25 parameters
+- vocab.json: term -> term id
+- postings_indptr.npy, postings_docs.npy, postings_tf.npy: postings of each term (CSC layout)
+- doc_lens.npy, idf.npy: document lengths and idf of each term
+- guests.bin, guest_offsets.npy, relation_ids.npy, relations.json: the guests, in the
+  columnar store of guest_store.py
+
+The index is built from a stream of `Guest` records (see `iter_guests` in retriever.py): each
+guest is tokenized and appended to the store as it arrives, and the postings are collected in
+typed arrays, so the dataset, a `Document` per guest or a dict per posting are never all in
+memory. `Document`s (and their `page_content`) are only built for the results of a query.
+
+Scoring is BM25Okapi (same parameters as `BM25Retriever`) with field weights: the words of
+each field of a guest count `FIELD_WEIGHTS[field]` times in the term frequency and the
+document length, so a Name match outranks a Description match. The
+postings are a sparse term-document matrix: a query is a sparse dot product over the
+columns of its terms and the top k are selected with `argpartition`.
+
+Queries that are a guest name ("Lady Ada Lovelace", "Dr. Nikola Tesla") are answered from
+the name index before BM25 runs (see name_index.py).
+
+Guests can be added, updated and deleted (by name) while the index is in use. The files on
+disk are never modified in place: deleted documents are masked, new ones go to an in-memory
+delta segment and the df/document length statistics are updated per change. `compact()`
+writes a new index with the live documents only.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+from langchain.docstore.document import Document
+from guest_store import Guest, GuestStore, GuestStoreWriter
+from name_index import QUOTED_RE, NameIndex
+
+INDEX_FORMAT_VERSION = 5
+
+# Weight of the words of each field of a guest
+FIELD_WEIGHTS = {"name": 3.0, "relation": 1.5, "description": 1.0, "email": 0.5}
+DEFAULT_FIELD_WEIGHT = 1.0
+
+# Same defaults as rank_bm25.BM25Okapi / BM25Retriever
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+TOP_K = 4
+# Queries scored together by `batch`, bounds the dense (queries x docs) score matrix
+BATCH_CHUNK = 64
+# Compact automatically when this fraction of the documents is deleted
+COMPACT_RATIO = 0.25
+COMPACT_MIN_DELETED = 1_000
+# Name fast path: shortest query answered by a unique prefix and min similarity of a fuzzy match
+NAME_PREFIX_MIN_LENGTH = 4
+NAME_FUZZY_THRESHOLD = 0.8
+# Fuzzy matching only runs on quoted text and name-shaped queries (at most this many words)
+NAME_FUZZY_MAX_TOKENS = 4
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words, without punctuation ("Tesla." and "tesla" are the same term)"""
+    return _WORD_RE.findall(text.casefold())
+
+
+def guest_terms(guest: Guest) -> Tuple[Dict[str, float], float]:
+    """Weighted term frequencies and weighted length of a guest"""
+    counts: Dict[str, float] = {}
+    length = 0.0
+    for field, value in guest.fields():
+        weight = FIELD_WEIGHTS.get(field, DEFAULT_FIELD_WEIGHT)
+        for token in tokenize(value or ""):
+            counts[token] = counts.get(token, 0.0) + weight
+            length += weight
+    return counts, length
+
+
+def _write_index(guests: Iterable[Guest], directory: str, fingerprint: Optional[str]):
+    """Tokenize the guests as they are streamed and write the index files in `directory` (replacing any previous one)"""
+    vocab: Dict[str, int] = {}
+    # Postings as (doc, term, tf) triplets in typed arrays: 12 bytes per posting instead of a dict entry
+    rows = array("i")
+    cols = array("i")
+    tfs = array("f")
+    doc_lens = array("f")
+
+    tmp_directory = directory.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+
+    with GuestStoreWriter(tmp_directory) as store:
+        for doc_id, guest in enumerate(guests):
+            counts, length = guest_terms(guest)
+            doc_lens.append(length)
+            for token, tf in counts.items():
+                cols.append(vocab.setdefault(token, len(vocab)))
+                tfs.append(tf)
+            rows.extend(array("i", [doc_id]) * len(counts))
+            store.append(guest)
+
+    num_docs = len(doc_lens)
+    # The guests come in doc id order, so the postings of each term stay sorted by doc id.
+    # scipy picks the same dtype for indptr and indices, int64 only past 2**31 postings
+    matrix = sparse.coo_matrix(
+        (np.frombuffer(tfs, dtype=np.float32), (np.frombuffer(rows, dtype=np.int32), np.frombuffer(cols, dtype=np.int32))),
+        shape=(num_docs, len(vocab)),
+    ).tocsc()
+    del rows, cols, tfs
+    indptr, postings_docs, postings_tf = matrix.indptr, matrix.indices, matrix.data
+
+    np.save(os.path.join(tmp_directory, "postings_indptr.npy"), indptr)
+    np.save(os.path.join(tmp_directory, "postings_docs.npy"), postings_docs)
+    np.save(os.path.join(tmp_directory, "postings_tf.npy"), postings_tf)
+    np.save(os.path.join(tmp_directory, "doc_lens.npy"), np.frombuffer(doc_lens, dtype=np.float32))
+    np.save(os.path.join(tmp_directory, "idf.npy"), _bm25_idf(np.diff(indptr), num_docs))
+
+    with open(os.path.join(tmp_directory, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(os.path.join(tmp_directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": INDEX_FORMAT_VERSION,
+            "fingerprint": fingerprint,
+            "num_docs": num_docs,
+            "num_terms": len(vocab),
+            "avgdl": sum(doc_lens) / num_docs if num_docs else 1.0,
+            "k1": K1,
+            "b": B,
+            "epsilon": EPSILON,
+            "field_weights": FIELD_WEIGHTS,
+        }, f)
+
+    # Swap the folders so a reader never sees a half written index
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def _bm25_idf(df: np.ndarray, num_docs: int) -> np.ndarray:
+    """idf of BM25Okapi: negative idfs are replaced by epsilon * average idf"""
+    df = np.asarray(df, dtype=np.float64)
+    idf = np.log(num_docs - df + 0.5) - np.log(df + 0.5)
+    present = df > 0  # terms whose documents were all deleted don't count for the average
+    average_idf = float(idf[present].mean()) if present.any() else 0.0
+    idf[idf < 0] = EPSILON * average_idf
+    return idf.astype(np.float32)
+
+
+class GuestIndex:
+    """BM25 index loaded from memory-mapped arrays, with incremental add/update/delete by name"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # Increased on every change, lets the callers invalidate what they derived from the index
+        self.version = 0
+        self._lock = threading.RLock()
+        self.lookup_stats = {"exact": 0, "prefix": 0, "fuzzy": 0, "bm25": 0}
+        self._load()
+
+    def _load(self):
+        directory = self.directory
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            self.vocab: Dict[str, int] = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        self.indptr = load("postings_indptr")
+        self.postings_docs = load("postings_docs")
+        self.postings_tf = load("postings_tf")
+        self.doc_lens = load("doc_lens")
+        self.idf = load("idf")
+        self.store = GuestStore(directory)
+
+        self.k1 = self.meta["k1"]
+        self.b = self.meta["b"]
+        self.num_base = self.meta["num_docs"]
+        # Denominator part of each document, computed once per process (and after changes)
+        self.doc_norm = (self.k1 * (1 - self.b + self.b * self.doc_lens / self.meta["avgdl"])).astype(np.float32)
+        # docs x terms tf matrix on top of the memory-mapped postings (no copy)
+        self.matrix = sparse.csc_matrix(
+            (self.postings_tf, self.postings_docs, self.indptr),
+            shape=(self.num_base, self.meta["num_terms"]),
+            copy=False,
+        )
+
+        # Incremental state, created on the first change
+        self._mutable = False
+        self._names: Optional[Dict[str, int]] = None
+        self._base_live: Optional[np.ndarray] = None
+        self._df: Optional[np.ndarray] = None
+        self._total_len = 0
+        self._num_live = self.num_base
+        self._deleted = 0
+        self._delta_guests: List[Guest] = []
+        self._delta_counts: List[Dict[int, int]] = []
+        self._delta_lens: List[int] = []
+        self._delta_live: List[bool] = []
+        self._delta_matrix: Optional[sparse.csc_matrix] = None
+        self._live: Optional[np.ndarray] = None
+        self._stale = False
+        self._name_index: Optional[NameIndex] = None
+
+    @property
+    def lock(self) -> threading.RLock:
+        """Held by the changes and compact(), readers of several fields (dense_index) take it for a consistent view"""
+        return self._lock
+
+    @property
+    def fingerprint(self) -> Optional[str]:
+        return self.meta.get("fingerprint")
+
+    def __len__(self) -> int:
+        """Number of live documents"""
+        return self._num_live
+
+    @property
+    def num_slots(self) -> int:
+        """Document ids in use: base documents and delta segment, deleted ones included"""
+        return self.num_base + len(self._delta_guests)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            return (meta.get("version") == INDEX_FORMAT_VERSION and meta.get("field_weights") == FIELD_WEIGHTS
+                    and GuestStore.exists(directory))
+        except (OSError, ValueError):
+            return False
+
+    @classmethod
+    def build(cls, guests: Iterable[Guest], directory: str, fingerprint: Optional[str] = None) -> "GuestIndex":
+        """
+        Tokenize the guests and save the index in `directory` (replacing any previous one)
+
+        :param guests: Iterable[Guest]: guests to index, consumed once (a generator streams them)
+        :param directory: str: index folder
+        :param fingerprint: Optional[str]: fingerprint of the dataset used to build the documents
+        """
+        _write_index(guests, directory, fingerprint)
+        return cls(directory)
+
+    def guest(self, doc_id: int) -> Guest:
+        """Read the guest from the memory-mapped store (or the delta segment)"""
+        if doc_id >= self.num_base:
+            return self._delta_guests[doc_id - self.num_base]
+        return self.store[doc_id]
+
+    def page_content(self, doc_id: int) -> str:
+        return self.guest(doc_id).page_content
+
+    def document(self, doc_id: int) -> Document:
+        """Document of a guest, built on demand (only for the documents returned)"""
+        return self.guest(doc_id).document()
+
+    #---------------------------------------------------------------------------------
+    #                                                           Changes
+
+    def _ensure_mutable(self):
+        """Copy the statistics that change with the documents (O(terms + docs), only once)"""
+        if self._mutable:
+            return
+        self._names = {name: doc_id for doc_id, name in enumerate(self.store.names())}
+        self._base_live = np.ones(self.num_base, dtype=bool)
+        self._df = np.diff(self.indptr).astype(np.int64)
+        self._total_len = float(np.sum(self.doc_lens, dtype=np.float64))
+        self.vocab = dict(self.vocab)
+        self._mutable = True
+
+    def _term_counts(self, guest: Guest, grow: bool) -> Tuple[Dict[int, float], float]:
+        """Weighted term frequencies by term id and weighted length of a guest"""
+        counts: Dict[int, float] = {}
+        terms, length = guest_terms(guest)
+        for token, tf in terms.items():
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                if not grow:
+                    continue
+                term_id = self.vocab[token] = len(self.vocab)
+            counts[term_id] = tf
+        if grow and len(self.vocab) > len(self._df):
+            self._df = np.concatenate([self._df, np.zeros(max(len(self.vocab) - len(self._df), 1024), dtype=np.int64)])
+        return counts, length
+
+    def _remove(self, doc_id: int):
+        guest = self.guest(doc_id)
+        counts, length = self._term_counts(guest, grow=False)
+        self._df[list(counts)] -= 1
+        self._total_len -= length
+        self._num_live -= 1
+        self._deleted += 1
+        if doc_id < self.num_base:
+            self._base_live[doc_id] = False
+        else:
+            self._delta_live[doc_id - self.num_base] = False
+        del self._names[guest.name]
+        if self._name_index is not None:
+            self._name_index.remove(doc_id)
+
+    def _insert(self, guest: Guest):
+        counts, length = self._term_counts(guest, grow=True)
+        self._df[list(counts)] += 1
+        self._total_len += length
+        self._num_live += 1
+        self._names[guest.name] = self.num_slots
+        if self._name_index is not None:
+            self._name_index.add(self.num_slots, guest.name)
+        self._delta_guests.append(guest)
+        self._delta_counts.append(counts)
+        self._delta_lens.append(length)
+        self._delta_live.append(True)
+
+    def _changed(self):
+        self._stale = True
+        self._delta_matrix = None
+        self.version += 1
+        if self._deleted >= COMPACT_MIN_DELETED and self._deleted > COMPACT_RATIO * self.num_slots:
+            self.compact()
+
+    def add(self, guest: Guest):
+        """Add a guest. `guest.name` must be new"""
+        with self._lock:
+            self._ensure_mutable()
+            if guest.name in self._names:
+                raise ValueError(f"Guest already exists: {guest.name}")
+            self._insert(guest)
+            self._changed()
+
+    def update(self, guest: Guest):
+        """Replace the guest with the same `guest.name`"""
+        with self._lock:
+            self._ensure_mutable()
+            doc_id = self._names.get(guest.name)
+            if doc_id is None:
+                raise KeyError(guest.name)
+            self._remove(doc_id)
+            self._insert(guest)
+            self._changed()
+
+    def delete(self, name: str):
+        """Delete a guest by name"""
+        with self._lock:
+            self._ensure_mutable()
+            doc_id = self._names.get(name)
+            if doc_id is None:
+                raise KeyError(name)
+            self._remove(doc_id)
+            self._changed()
+
+    def compact(self):
+        """Write a new index with the live documents only and load it (drops deletes and the delta segment)"""
+        with self._lock:
+            if not self._mutable:
+                return
+            live = self._live_mask()
+            guests = (self.guest(doc_id) for doc_id in np.flatnonzero(live))
+            tmp_directory = self.directory.rstrip(os.sep) + ".compact"
+            _write_index(guests, tmp_directory, self.fingerprint)
+            self.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.replace(tmp_directory, self.directory)
+            self._load()
+            self.version += 1
+
+    #---------------------------------------------------------------------------------
+    #                                                           Scoring
+
+    def _live_mask(self) -> np.ndarray:
+        return np.concatenate([self._base_live, np.asarray(self._delta_live, dtype=bool)])
+
+    def _refresh(self):
+        """Recompute idf, the document norms and the live mask after changes (vectorized, O(terms + docs))"""
+        if not self._stale:
+            return
+        self.idf = _bm25_idf(self._df[:len(self.vocab)], self._num_live)
+        avgdl = self._total_len / self._num_live if self._num_live else 1.0
+        lens = np.concatenate([self.doc_lens, np.asarray(self._delta_lens, dtype=np.float32)])
+        self.doc_norm = (self.k1 * (1 - self.b + self.b * lens / avgdl)).astype(np.float32)
+        self._live = self._live_mask()
+        self._stale = False
+
+    def _delta(self) -> sparse.csc_matrix:
+        """docs x terms tf matrix of the delta segment, rebuilt after changes"""
+        if self._delta_matrix is None:
+            rows = [row for row, counts in enumerate(self._delta_counts) for _ in counts]
+            cols = [term_id for counts in self._delta_counts for term_id in counts]
+            data = [tf for counts in self._delta_counts for tf in counts.values()]
+            self._delta_matrix = sparse.csc_matrix(
+                (np.asarray(data, dtype=np.float32), (rows, cols)),
+                shape=(len(self._delta_counts), len(self.vocab)),
+            )
+        return self._delta_matrix
+
+    def _query_terms(self, query: str) -> Dict[int, int]:
+        """term id -> number of times in the query (BM25Okapi counts repeated terms)"""
+        counts: Dict[int, int] = {}
+        for token in tokenize(query):
+            term_id = self.vocab.get(token)
+            if term_id is not None:
+                counts[term_id] = counts.get(term_id, 0) + 1
+        return counts
+
+    def _saturated(self, columns: sparse.csc_matrix, doc_norm: np.ndarray) -> sparse.csc_matrix:
+        """BM25 tf saturation of the selected columns: tf*(k1+1) / (tf + norm(doc))"""
+        tf = columns.data.astype(np.float32)
+        columns.data = tf * (self.k1 + 1) / (tf + doc_norm[columns.indices])
+        return columns
+
+    def get_batch_scores(self, queries: Sequence[str]) -> np.ndarray:
+        """
+        BM25 scores as a (queries x docs) matrix, the columns of shared terms are only computed once.
+        Deleted documents score -inf
+        """
+        with self._lock:
+            self._refresh()
+            query_terms = [self._query_terms(query) for query in queries]
+            union = sorted({term_id for terms in query_terms for term_id in terms})
+            scores = np.zeros((self.num_slots, len(queries)), dtype=np.float32)
+            if union:
+                position = {term_id: i for i, term_id in enumerate(union)}
+                weights = np.zeros((len(union), len(queries)), dtype=np.float32)
+                for q, terms in enumerate(query_terms):
+                    for term_id, count in terms.items():
+                        weights[position[term_id], q] = self.idf[term_id] * count
+
+                union = np.asarray(union)
+                in_base = union < self.matrix.shape[1]
+                if self.num_base and in_base.any():
+                    columns = self._saturated(self.matrix[:, union[in_base]], self.doc_norm[:self.num_base])
+                    scores[:self.num_base] = columns @ weights[in_base]
+                if self._delta_guests:
+                    columns = self._saturated(self._delta()[:, union], self.doc_norm[self.num_base:])
+                    scores[self.num_base:] = columns @ weights
+            # Row per query so the top k selection reads contiguous memory
+            scores = np.ascontiguousarray(scores.T)
+            if self._live is not None:
+                scores[:, ~self._live] = -np.inf
+            return scores
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query"""
+        return self.get_batch_scores([query])[0]
+
+    def search(self, query: str, k: int = TOP_K) -> List[Tuple[int, float]]:
+        """(doc id, score) of the top k documents that match a query term, without the name fast path"""
+        scores = self.get_scores(query)
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top_k(scores, k) if scores[doc_id] > 0]
+
+    def live_mask(self) -> Optional[np.ndarray]:
+        """Live document ids after changes, None when the index was never changed (all live)"""
+        with self._lock:
+            if not self._mutable:
+                return None
+            self._refresh()
+            return self._live
+
+    def _top_documents(self, scores: np.ndarray, top: np.ndarray) -> List[Document]:
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.document(int(doc_id)) for doc_id in top if scores[doc_id] != -np.inf]
+
+    #---------------------------------------------------------------------------------
+    #                                                           Name fast path
+
+    def _names_index(self) -> NameIndex:
+        """Name index of the live documents, built on first use"""
+        if self._name_index is None:
+            name_index = NameIndex()
+            if self._mutable:
+                names = self._names.items()
+            else:
+                names = ((name, doc_id) for doc_id, name in enumerate(self.store.names()))
+            for name, doc_id in names:
+                if name:
+                    name_index.add(doc_id, name)
+            self._name_index = name_index
+        return self._name_index
+
+    def lookup_name(self, query: str) -> Optional[List[Document]]:
+        """
+        Documents of the guest named in the query (whole query or quoted text), None if it's not a name.
+        Tries an exact match, then a unique prefix, then a close fuzzy match
+        """
+        with self._lock:
+            name_index = self._names_index()
+            candidates = QUOTED_RE.findall(query) + [query]
+            for candidate in candidates:
+                doc_ids = name_index.exact(candidate)
+                if doc_ids:
+                    self.lookup_stats["exact"] += 1
+                    return [self.document(doc_id) for doc_id in doc_ids]
+            for candidate in candidates:
+                if len(candidate.strip()) < NAME_PREFIX_MIN_LENGTH:
+                    continue
+                doc_ids = name_index.prefix(candidate, limit=2)
+                if len(doc_ids) == 1:
+                    self.lookup_stats["prefix"] += 1
+                    return [self.document(doc_ids[0])]
+            name_shaped = candidates if len(query.split()) <= NAME_FUZZY_MAX_TOKENS else candidates[:-1]
+            for candidate in name_shaped:
+                matches = name_index.fuzzy(candidate, threshold=NAME_FUZZY_THRESHOLD, limit=1)
+                if matches:
+                    self.lookup_stats["fuzzy"] += 1
+                    return [self.document(matches[0][0])]
+            return None
+
+    def fast_path_summary(self) -> Dict[str, Any]:
+        total = sum(self.lookup_stats.values())
+        fast = total - self.lookup_stats["bm25"]
+        return {**self.lookup_stats, "queries": total, "fast_path_ratio": round(fast / total, 3) if total else 0.0}
+
+    def invoke(self, query: str, k: int = TOP_K) -> List[Document]:
+        """Top k documents for the query, same contract as BM25Retriever.invoke. Names skip BM25"""
+        docs = self.lookup_name(query)
+        if docs is not None:
+            return docs[:k]
+        with self._lock:
+            self.lookup_stats["bm25"] += 1
+        return self.batch([query], k)[0]
+
+    def batch(self, queries: Sequence[str], k: int = TOP_K) -> List[List[Document]]:
+        """Top k documents of many queries, scored `BATCH_CHUNK` queries at a time"""
+        results = []
+        with self._lock:
+            for start in range(0, len(queries), BATCH_CHUNK):
+                scores = self.get_batch_scores(queries[start:start + BATCH_CHUNK])
+                if k < scores.shape[1]:
+                    # One partial sort for all the queries of the chunk
+                    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                else:
+                    top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+                for q in range(scores.shape[0]):
+                    results.append(self._top_documents(scores[q], top[q]))
+        return results
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,159 @@
+"""
+Compact columnar store of the guests
+
+A `Document` per guest keeps a pydantic object, a metadata dict and a `page_content` string
+that repeats the field labels, about 1 KB per guest in a list of 1M. The store keeps columns
+instead, written while the guests are streamed and memory-mapped when read:
+
+- guests.bin: name, description and email of every guest, UTF-8, one after the other
+- guest_offsets.npy: start of each of those fields in guests.bin (3 per guest, plus the end)
+- relation_ids.npy + relations.json: the relation of each guest as the id of an interned
+  string, there are a few distinct relations ("best friend", "old colleague", ...)
+
+`Guest` is a `__slots__` record of the 4 fields. Its `page_content` and `Document` are only
+built for the guests a query returns.
+"""
+import json
+import mmap
+import os
+import sys
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+
+# Fields stored in guests.bin, the relation is stored as an id
+TEXT_FIELDS = ("name", "description", "email")
+
+
+class Guest:
+    """One guest, without the per-instance dict of a regular object"""
+
+    __slots__ = ("name", "relation", "description", "email")
+
+    def __init__(self, name: str, relation: str, description: str, email: str):
+        self.name = name
+        self.relation = relation
+        self.description = description
+        self.email = email
+
+    @classmethod
+    def from_dict(cls, guest: Dict[str, Any]) -> "Guest":
+        """Guest from a dataset row (dict with name, relation, description and email)"""
+        return cls(guest["name"], guest["relation"], guest["description"], guest["email"])
+
+    def fields(self):
+        """(field, value) pairs, in the order of `page_content`"""
+        return (("name", self.name), ("relation", self.relation),
+                ("description", self.description), ("email", self.email))
+
+    @property
+    def page_content(self) -> str:
+        return "\n".join([
+            f"Name: {self.name}",
+            f"Relation: {self.relation}",
+            f"Description: {self.description}",
+            f"Email: {self.email}"
+        ])
+
+    def document(self) -> "Document":
+        from langchain.docstore.document import Document
+        return Document(page_content=self.page_content, metadata={"name": self.name})
+
+    def __repr__(self) -> str:
+        return f"Guest(name={self.name!r}, relation={self.relation!r})"
+
+
+class GuestStoreWriter:
+    """Appends guests to the store files of `directory`, only the offsets and the relation ids stay in memory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._file = open(os.path.join(directory, "guests.bin"), "wb")
+        self._offsets = array("q", [0])
+        self._relation_ids = array("I")
+        self._relations: Dict[str, int] = {}
+
+    def append(self, guest: Guest):
+        for field in TEXT_FIELDS:
+            value = getattr(guest, field) or ""
+            self._offsets.append(self._offsets[-1] + self._file.write(value.encode("utf-8")))
+        relation = guest.relation or ""
+        relation_id = self._relations.get(relation)
+        if relation_id is None:
+            relation_id = self._relations[sys.intern(relation)] = len(self._relations)
+        self._relation_ids.append(relation_id)
+
+    def close(self):
+        self._file.close()
+        np.save(os.path.join(self.directory, "guest_offsets.npy"), np.frombuffer(self._offsets, dtype=np.int64))
+        np.save(os.path.join(self.directory, "relation_ids.npy"), np.frombuffer(self._relation_ids, dtype=np.uint32))
+        with open(os.path.join(self.directory, "relations.json"), "w", encoding="utf-8") as f:
+            json.dump(list(self._relations), f, ensure_ascii=False)
+
+    def __enter__(self) -> "GuestStoreWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GuestStore:
+    """Guests read from the memory-mapped store files of `directory`"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.offsets = np.load(os.path.join(directory, "guest_offsets.npy"), mmap_mode="r")
+        self.relation_ids = np.load(os.path.join(directory, "relation_ids.npy"), mmap_mode="r")
+        with open(os.path.join(directory, "relations.json"), encoding="utf-8") as f:
+            self.relations: List[str] = [sys.intern(relation) for relation in json.load(f)]
+        self._file = open(os.path.join(directory, "guests.bin"), "rb")
+        # mmap can't map an empty file
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return all(os.path.exists(os.path.join(directory, name))
+                   for name in ("guests.bin", "guest_offsets.npy", "relation_ids.npy", "relations.json"))
+
+    def __len__(self) -> int:
+        return len(self.relation_ids)
+
+    def _text(self, position: int) -> str:
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        return self._buffer[start:end].decode("utf-8")
+
+    def name(self, doc_id: int) -> str:
+        return self._text(doc_id * len(TEXT_FIELDS))
+
+    def names(self) -> Iterator[str]:
+        for doc_id in range(len(self)):
+            yield self.name(doc_id)
+
+    def __getitem__(self, doc_id: int) -> Guest:
+        if not 0 <= doc_id < len(self):
+            raise IndexError(doc_id)
+        position = doc_id * len(TEXT_FIELDS)
+        return Guest(
+            name=self._text(position),
+            relation=self.relations[int(self.relation_ids[doc_id])],
+            description=self._text(position + 1),
+            email=self._text(position + 2),
+        )
+
+    def __iter__(self) -> Iterator[Guest]:
+        for doc_id in range(len(self)):
+            yield self[doc_id]
+
+    def nbytes(self) -> Dict[str, int]:
+        """Size of each column on disk"""
+        return {"text": int(self.offsets[-1]), "offsets": self.offsets.nbytes, "relation_ids": self.relation_ids.nbytes,
+                "relations": sum(len(relation.encode("utf-8")) for relation in self.relations)}
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._file.close()
@@ -0,0 +1,136 @@
+"""
+Memory policy of the agent: what part of the conversation is sent to the model
+
+The state keeps growing with every turn (add_messages), and the tool outputs (guest
+records, search dumps) are the largest messages. Before every model call the policy
+builds a bounded view of the messages:
+- the current turn (last human message and the tool calls/results after it) is kept as is
+- tool outputs of the previous turns are truncated to `old_tool_chars`
+- when the view is still above `max_tokens`, the oldest turns are dropped (whole turns, so
+  every tool call keeps its result)
+- with a `summarizer` (a small chat model) the dropped turns are folded into a rolling
+  summary that is sent as a system message, and they are removed from the state
+
+Tokens are estimated (~4 characters per token), Ollama reports the real prompt_eval_count.
+"""
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage, ToolMessage
+
+CHARS_PER_TOKEN = 4
+# Role and template tokens around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_PROMPT = """Update the summary of this conversation between a user and Alfred, the gala assistant.
+Keep names, facts and open requests, drop greetings and tool details. Answer with the summary only.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _content(message: AnyMessage) -> str:
+    return message.content if isinstance(message.content, str) else json.dumps(message.content)
+
+
+def message_tokens(message: AnyMessage) -> int:
+    tokens = estimate_tokens(_content(message)) + MESSAGE_OVERHEAD_TOKENS
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += estimate_tokens(call["name"] + json.dumps(call["args"]))
+    return tokens
+
+
+def count_tokens(messages: Sequence[AnyMessage]) -> int:
+    return sum(message_tokens(message) for message in messages)
+
+
+def split_turns(messages: Sequence[AnyMessage]) -> List[List[AnyMessage]]:
+    """A turn starts at every human message"""
+    turns: List[List[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class MemoryPolicy:
+    def __init__(self, max_tokens: int = 4000, old_tool_chars: int = 500, summarizer: Any = None):
+        """
+        :param max_tokens: int: estimated tokens of the messages sent to the model
+        :param old_tool_chars: int: tool outputs of previous turns are cut to this length
+        :param summarizer: Any: chat model for the rolling summary, None drops the old turns
+        """
+        self.max_tokens = max_tokens
+        self.old_tool_chars = old_tool_chars
+        self.summarizer = summarizer
+
+    def _truncate(self, message: AnyMessage) -> AnyMessage:
+        content = _content(message)
+        if not isinstance(message, ToolMessage) or len(content) <= self.old_tool_chars:
+            return message
+        cut = len(content) - self.old_tool_chars
+        return message.model_copy(update={"content": f"{content[:self.old_tool_chars]}... [{cut} chars truncated]"})
+
+    def _plan(self, messages: Sequence[AnyMessage], summary: Optional[str]
+              ) -> Tuple[List[List[AnyMessage]], List[List[AnyMessage]], List[AnyMessage]]:
+        """(dropped turns, kept old turns truncated, current turn)"""
+        turns = split_turns(messages)
+        if not turns:
+            return [], [], []
+        current = turns[-1]
+        old = [[self._truncate(message) for message in turn] for turn in turns[:-1]]
+        originals = turns[:-1]
+        budget = self.max_tokens - count_tokens(current) - (estimate_tokens(summary) + MESSAGE_OVERHEAD_TOKENS if summary else 0)
+        used = sum(count_tokens(turn) for turn in old)
+        dropped = []
+        while old and used > budget:
+            used -= count_tokens(old.pop(0))
+            dropped.append(originals.pop(0))
+        return dropped, old, current
+
+    @staticmethod
+    def _view(summary: Optional[str], old: List[List[AnyMessage]], current: List[AnyMessage]) -> List[AnyMessage]:
+        view: List[AnyMessage] = []
+        if summary:
+            view.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
+        for turn in old:
+            view.extend(turn)
+        view.extend(current)
+        return view
+
+    def _summary_prompt(self, summary: Optional[str], dropped: List[List[AnyMessage]]) -> str:
+        lines = []
+        for turn in dropped:
+            for message in turn:
+                text = _content(self._truncate(message)).strip()
+                if text:
+                    lines.append(f"{message.type}: {text}")
+        return SUMMARY_PROMPT.format(summary=summary or "(empty)", messages="\n".join(lines))
+
+    def prepare(self, messages: Sequence[AnyMessage], summary: Optional[str] = None
+                ) -> Tuple[List[AnyMessage], List[AnyMessage], Optional[str]]:
+        """
+        :return: (messages to send to the model, messages to remove from the state, summary)
+        """
+        dropped, old, current = self._plan(messages, summary)
+        removed: List[AnyMessage] = []
+        if dropped and self.summarizer is not None:
+            summary = self.summarizer.invoke(self._summary_prompt(summary, dropped)).content.strip()
+            removed = [message for turn in dropped for message in turn]
+        return self._view(summary, old, current), removed, summary
+
+    async def aprepare(self, messages: Sequence[AnyMessage], summary: Optional[str] = None
+                       ) -> Tuple[List[AnyMessage], List[AnyMessage], Optional[str]]:
+        dropped, old, current = self._plan(messages, summary)
+        removed: List[AnyMessage] = []
+        if dropped and self.summarizer is not None:
+            summary = (await self.summarizer.ainvoke(self._summary_prompt(summary, dropped))).content.strip()
+            removed = [message for turn in dropped for message in turn]
+        return self._view(summary, old, current), removed, summary
@@ -0,0 +1,107 @@
+"""
+Name index of the guests, for the lookups that don't need BM25
+
+- exact: normalized name -> documents, a dict lookup
+- prefix: sorted normalized names, binary search
+- fuzzy: character trigrams -> documents, Dice similarity of the trigram sets. Only the
+  names that can reach the threshold are scored: a name needs at least `min_shared` of the
+  query trigrams, so it has one of the `len(query) - min_shared + 1` rarest of them
+  (candidates come from those postings only) and its trigram count is in a bounded range
+"""
+import bisect
+import math
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+# Text between quotes: "Tell me about 'Lady Ada Lovelace'"
+QUOTED_RE = re.compile(r"[\"'“”‘’]([^\"“”‘’]{2,}?)[\"'“”‘’](?!\w)")
+
+
+def normalize_name(name: str) -> str:
+    """Case and punctuation insensitive name: "Dr. Nikola Tesla" -> "dr nikola tesla" """
+    return " ".join(_PUNCTUATION.sub(" ", name.casefold()).split())
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    def __init__(self):
+        self._exact: Dict[str, List[int]] = {}
+        self._trigrams: Dict[str, Set[int]] = {}
+        self._names: Dict[int, str] = {}
+        # Number of trigrams of each name, for the length filter of `fuzzy`
+        self._gram_counts: Dict[int, int] = {}
+        self._sorted: Optional[List[Tuple[str, int]]] = None
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, doc_id: int, name: str):
+        key = normalize_name(name)
+        self._names[doc_id] = key
+        self._exact.setdefault(key, []).append(doc_id)
+        grams = trigrams(key)
+        self._gram_counts[doc_id] = len(grams)
+        for gram in grams:
+            self._trigrams.setdefault(gram, set()).add(doc_id)
+        self._sorted = None
+
+    def remove(self, doc_id: int):
+        key = self._names.pop(doc_id, None)
+        if key is None:
+            return
+        del self._gram_counts[doc_id]
+        ids = self._exact[key]
+        ids.remove(doc_id)
+        if not ids:
+            del self._exact[key]
+        for gram in trigrams(key):
+            self._trigrams[gram].discard(doc_id)
+        self._sorted = None
+
+    def exact(self, name: str) -> List[int]:
+        return self._exact.get(normalize_name(name), [])
+
+    def prefix(self, name: str, limit: int = 2) -> List[int]:
+        """Documents whose name starts with `name` (at most `limit`)"""
+        key = normalize_name(name)
+        if not key:
+            return []
+        if self._sorted is None:
+            self._sorted = sorted((key, doc_id) for doc_id, key in self._names.items())
+        start = bisect.bisect_left(self._sorted, (key, -1))
+        found = []
+        for candidate, doc_id in self._sorted[start:start + limit]:
+            if not candidate.startswith(key):
+                break
+            found.append(doc_id)
+        return found
+
+    def fuzzy(self, name: str, threshold: float = 0.75, limit: int = 3) -> List[Tuple[int, float]]:
+        """Documents with a similar name (typos, missing titles) as (doc id, similarity)"""
+        grams = trigrams(normalize_name(name))
+        if not grams:
+            return []
+        # Dice 2c / (a + b) >= t with c <= b: c >= t*a / (2 - t) and t*a / (2 - t) <= b <= a*(2 - t) / t
+        size = len(grams)
+        min_shared = max(math.ceil(threshold * size / (2 - threshold) - 1e-9), 1)
+        max_count = size * (2 - threshold) / threshold + 1e-9
+        postings = sorted((self._trigrams.get(gram, set()) for gram in grams), key=len)
+        candidates: Set[int] = set()
+        for docs in postings[:size - min_shared + 1]:
+            candidates.update(docs)
+        scored = []
+        for doc_id in candidates:
+            count = self._gram_counts[doc_id]
+            if count < min_shared or count > max_count:
+                continue
+            shared = sum(doc_id in docs for docs in postings)
+            similarity = 2 * shared / (size + count)
+            if similarity >= threshold:
+                scored.append((doc_id, similarity))
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit]
@@ -1,51 +1,161 @@
-import datasets
-from langchain.docstore.document import Document
-from langchain_community.retrievers import BM25Retriever
-from langchain.tools import Tool
-from langchain_core.messages import HumanMessage
-from assistant import create_assistant_with_tools
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional
+from tool_guard import tool_metrics
+from tool_registry import registry
+
+# numpy, scipy and langchain documents are imported with the guest index, on the first lookup
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+    from dense_index import HybridRetriever
+    from guest_index import GuestIndex
+    from guest_store import Guest
+
+DATASET_NAME = "agents-course/unit3-invitees"
+INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "guest_index")
+# bm25, dense or hybrid (BM25 and embeddings fused), see dense_index.py
+GUEST_RETRIEVAL = os.getenv("GUEST_RETRIEVAL", "hybrid")
+# Ollama embedding model, "hashing" uses the offline HashingEmbedder
+GUEST_EMBED_MODEL = os.getenv("GUEST_EMBED_MODEL", "nomic-embed-text")
+GUEST_CACHE_TTL_S = 24 * 3600
+GUEST_CACHE_MAX_ENTRIES = 2048
+# Rows of the dataset converted at a time when the guest index is built
+GUEST_CHUNK_SIZE = 10_000
+
+def guest_document(guest: Dict[str, Any]) -> "Document":
+    """
+    Document of a guest (dict with name, relation, description and email)
+    """
+    from guest_store import Guest
+    return Guest.from_dict(guest).document()
 
 def load_documents():
     """
-    Load invitees list and prepare documents
+    Load invitees list and prepare documents (all in memory, the guest index uses `iter_guests`)
+    """
+    return [guest.document() for guest in iter_guests()]
+
+def iter_guests(chunk_size: int = GUEST_CHUNK_SIZE) -> Iterator["Guest"]:
+    """
+    Stream the invitees list as `Guest` records, `chunk_size` rows at a time.
+    Only one chunk of the dataset is in memory, as columns
     """
-    # Load the dataset
-    guest_dataset = datasets.load_dataset("agents-course/unit3-invitees", split="train")
+    import datasets
+    from guest_store import Guest
+
+    guest_dataset = datasets.load_dataset(DATASET_NAME, split="train", streaming=True)
+    for chunk in guest_dataset.iter(batch_size=chunk_size):
+        for row in zip(chunk["name"], chunk["relation"], chunk["description"], chunk["email"]):
+            yield Guest(*row)
 
-    # Convert dataset entries into Document objects
-    docs = [
-        Document(
-            page_content="\n".join([
-                f"Name: {guest['name']}",
-                f"Relation: {guest['relation']}",
-                f"Description: {guest['description']}",
-                f"Email: {guest['email']}"
-            ]),
-            metadata={"name": guest["name"]}
-        )
-        for guest in guest_dataset
-    ]
-    return docs
 
+def dataset_fingerprint() -> Optional[str]:
+    """
+    Revision of the dataset on the Hub, None when it can't be checked (offline)
+    """
+    if os.environ.get("HF_HUB_OFFLINE") == "1":
+        return None
+    try:
+        from huggingface_hub import HfApi
+        return HfApi().dataset_info(DATASET_NAME).sha
+    except Exception:
+        return None
 
-bm25_retriever = BM25Retriever.from_documents(load_documents())
+
+_guest_index: Optional["GuestIndex"] = None
+_guest_index_lock = threading.Lock()
+
+def get_guest_index() -> "GuestIndex":
+    """
+    Load the BM25 index on first use. It's only rebuilt when the dataset fingerprint changes
+    """
+    global _guest_index
+    if _guest_index is None:
+        with _guest_index_lock:
+            if _guest_index is None:
+                from guest_index import GuestIndex
+                fingerprint = dataset_fingerprint()
+                if GuestIndex.exists(INDEX_DIR):
+                    index = GuestIndex(INDEX_DIR)
+                    if fingerprint is None or fingerprint == index.fingerprint:
+                        _guest_index = index
+                        return _guest_index
+                    index.close()
+                _guest_index = GuestIndex.build(iter_guests(), INDEX_DIR, fingerprint)
+    return _guest_index
+
+def guest_data_version() -> str:
+    """
+    Version of the guest data for the caches that outlive the process (answer cache): dataset
+    fingerprint, documents and write time of the index on disk, and the changes made to it since
+    in this process. Loads (or builds) the index, so the version is the same on the first run
+    """
+    index = get_guest_index()
+    try:
+        written = os.path.getmtime(os.path.join(index.directory, "meta.json"))
+    except OSError:
+        # Being replaced by a compaction, which changes the version anyway
+        written = None
+    return f"{index.fingerprint}:{index.meta['num_docs']}:{written}:{index.version}"
+
+_guest_retriever: Optional["HybridRetriever"] = None
+
+def get_guest_retriever() -> "HybridRetriever":
+    """
+    Retriever of the guest tool on top of the guest index, with GUEST_RETRIEVAL and GUEST_EMBED_MODEL.
+    The documents are embedded on the first query that needs them
+    """
+    global _guest_retriever
+    if _guest_retriever is None:
+        index = get_guest_index()
+        with _guest_index_lock:
+            if _guest_retriever is None:
+                from dense_index import DenseIndex, HashingEmbedder, HybridRetriever, OllamaEmbedder
+                dense = None
+                if GUEST_RETRIEVAL != "bm25":
+                    embedder = HashingEmbedder() if GUEST_EMBED_MODEL == "hashing" else OllamaEmbedder(GUEST_EMBED_MODEL)
+                    dense = DenseIndex(index, embedder)
+                _guest_retriever = HybridRetriever(index, dense, mode=GUEST_RETRIEVAL)
+    return _guest_retriever
+
+# Changes are visible to the running agents right away (same index instance).
+# They're kept in memory until `compact_guests()` writes them to disk.
+def add_guest(guest: Dict[str, Any]):
+    from guest_store import Guest
+    get_guest_index().add(Guest.from_dict(guest))
+
+def update_guest(guest: Dict[str, Any]):
+    from guest_store import Guest
+    get_guest_index().update(Guest.from_dict(guest))
+
+def delete_guest(name: str):
+    get_guest_index().delete(name)
+
+def compact_guests():
+    get_guest_index().compact()
 
 def guest_info_retriever(query: str) -> str:
-    """Retrieves detailed information about gala guests based on their name or relation."""
+    """Retrieves detailed information about gala guests based on their name, relation or description."""
 
-    results = bm25_retriever.invoke(query)
+    results = get_guest_retriever().invoke(query)
     if results:
         return "\n\n".join([doc.page_content for doc in results[:3]])
     else:
         return "No matching guest information found."
 
-guest_info_tool = Tool(
-    name="guest_info_retriever",
-    func=guest_info_retriever,
-    description="Retrieves detailed information about gala guests based on their name or relation."
+# Results cached per normalized query, dropped when the guest index changes (add/update/delete/compact).
+# The index is loaded (or built) on the first call
+guest_info_tool = registry.declare(
+    "guest_info_retriever",
+    "Retrieves detailed information about gala guests based on their name, relation or description.",
+    lambda: guest_info_retriever,
+    ttl_s=GUEST_CACHE_TTL_S, max_entries=GUEST_CACHE_MAX_ENTRIES, version=lambda: get_guest_retriever().version
 )
 
 if __name__ == "__main__":
+    from langchain_core.messages import HumanMessage
+    from assistant import create_assistant_with_tools
+
     alfred = create_assistant_with_tools([guest_info_tool])
 
     # Questions about people and need to have the tools
@@ -53,4 +163,7 @@ if __name__ == "__main__":
     response = alfred.invoke({"messages": messages})
 
     print("🎩 Alfred's Response:")
-    print(response['messages'][-1].content)
\ No newline at end of file
+    print(response['messages'][-1].content)
+    print("Guest lookups:", get_guest_index().fast_path_summary())
+    print("Guest retrieval:", get_guest_retriever().summary())
+    print("Tools:", tool_metrics())
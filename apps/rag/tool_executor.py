@@ -0,0 +1,255 @@
+"""
+Tool node that runs all the tool calls of one assistant turn at the same time
+
+- Tools with a native coroutine are awaited, the blocking ones run in a bounded thread pool
+  (`blocking` forces a tool into the pool even if it has a coroutine).
+- Every call has a timeout (per tool, or the default). A call that times out, fails or is
+  cancelled by something else than the turn itself returns an error ToolMessage and the
+  others still return their result, so the model gets the partial results of the turn. The thread of a timed out call can't be stopped: it ends in
+  the background and its result is dropped.
+- Latency of every turn goes to a LatencyLog: wall time of the tools step, time of each
+  call, and the assistant (LLM) time and prompt tokens when the assistant node records it.
+- With TRACING=1 the step is a "tools" node span and every call a "tool" span, with the
+  time it waited for a thread of the pool and the size of its input and output.
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.tools import BaseTool
+
+# Shared tracing layer lives in apps/
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tracing import get_tracer, payload_bytes
+
+DEFAULT_TOOL_TIMEOUT_S = 20.0
+DEFAULT_MAX_WORKERS = 4
+
+
+def _thread_id(config: Optional[RunnableConfig]) -> Optional[str]:
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+
+class LatencyLog:
+    """Per-turn latency entries: assistant steps and tool steps"""
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self.entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, entry: Dict[str, Any]):
+        with self._lock:
+            self.entries.append(entry)
+            if len(self.entries) > self.max_entries:
+                del self.entries[:len(self.entries) - self.max_entries]
+
+    def record_assistant(self, seconds: float, config: Optional[RunnableConfig] = None, **extra):
+        self.add({"step": "assistant", "thread_id": _thread_id(config), "wall_s": seconds, **extra})
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = list(self.entries)
+        assistant = [entry["wall_s"] for entry in entries if entry["step"] == "assistant"]
+        prompt_tokens = [entry["prompt_tokens"] for entry in entries if entry.get("prompt_tokens")]
+        tool_steps = [entry for entry in entries if entry["step"] == "tools"]
+        per_tool: Dict[str, List[float]] = {}
+        statuses: Dict[str, int] = {}
+        for entry in tool_steps:
+            for call in entry["calls"]:
+                per_tool.setdefault(call["name"], []).append(call["latency_s"])
+                statuses[call["status"]] = statuses.get(call["status"], 0) + 1
+        tools_wall = sum(entry["wall_s"] for entry in tool_steps)
+        tools_serial = sum(sum(call["latency_s"] for call in entry["calls"]) for entry in tool_steps)
+        return {
+            "assistant_steps": len(assistant),
+            "assistant_s": round(sum(assistant), 3),
+            "prompt_tokens_mean": round(statistics.fmean(prompt_tokens)) if prompt_tokens else None,
+            "prompt_tokens_max": max(prompt_tokens, default=None),
+            "tool_steps": len(tool_steps),
+            "tool_calls": sum(len(entry["calls"]) for entry in tool_steps),
+            "tools_wall_s": round(tools_wall, 3),
+            # Time the same calls would have taken one after the other
+            "tools_serial_s": round(tools_serial, 3),
+            "parallel_saved_s": round(tools_serial - tools_wall, 3),
+            "statuses": statuses,
+            "per_tool": {
+                name: {"calls": len(values), "mean_s": round(statistics.fmean(values), 3), "max_s": round(max(values), 3)}
+                for name, values in per_tool.items()
+            },
+        }
+
+
+latency_log = LatencyLog()
+
+
+class ParallelToolExecutor:
+    def __init__(self, tools: Sequence[BaseTool], timeouts: Optional[Dict[str, float]] = None,
+                 default_timeout_s: float = DEFAULT_TOOL_TIMEOUT_S, max_workers: int = DEFAULT_MAX_WORKERS,
+                 blocking: Iterable[str] = (), log: Optional[LatencyLog] = None):
+        """
+        :param tools: Sequence[BaseTool]: tools the model can call
+        :param timeouts: Optional[Dict[str, float]]: seconds per tool name
+        :param default_timeout_s: float: timeout of the tools not in `timeouts`
+        :param max_workers: int: threads for the blocking tools
+        :param blocking: Iterable[str]: tools that always run in the thread pool
+        :param log: Optional[LatencyLog]: where the turns are recorded, the module `latency_log` by default
+        """
+        self.tools = {tool.name: tool for tool in tools}
+        self.timeouts = timeouts or {}
+        self.default_timeout_s = default_timeout_s
+        self.blocking = set(blocking) | {name for name, tool in self.tools.items() if not getattr(tool, "coroutine", None)}
+        self.log = log if log is not None else latency_log
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def timeout_for(self, name: str) -> float:
+        return self.timeouts.get(name, self.default_timeout_s)
+
+    @staticmethod
+    def _tool_calls(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        message = state["messages"][-1]
+        return list(message.tool_calls) if isinstance(message, AIMessage) else []
+
+    @staticmethod
+    def _error(call: Dict[str, Any], content: str) -> ToolMessage:
+        return ToolMessage(content=content, name=call["name"], tool_call_id=call["id"], status="error")
+
+    def _run(self, call: Dict[str, Any]) -> ToolMessage:
+        """Blocking call of one tool"""
+        try:
+            return self.tools[call["name"]].invoke({**call, "type": "tool_call"})
+        except Exception as e:
+            return self._error(call, f"Error: {type(e).__name__}: {e}. Please fix your mistakes.")
+
+    async def _arun(self, call: Dict[str, Any]) -> ToolMessage:
+        try:
+            return await self.tools[call["name"]].ainvoke({**call, "type": "tool_call"})
+        except Exception as e:
+            return self._error(call, f"Error: {type(e).__name__}: {e}. Please fix your mistakes.")
+
+    def _unknown(self, call: Dict[str, Any]) -> Optional[ToolMessage]:
+        if call["name"] in self.tools:
+            return None
+        return self._error(call, f"Error: {call['name']} is not a valid tool, try one of [{', '.join(self.tools)}].")
+
+    def _failed(self, call: Dict[str, Any], error: BaseException) -> ToolMessage:
+        return self._error(call, f"Error: {call['name']} failed ({type(error).__name__}: {error}), "
+                                 f"continue with the other results.")
+
+    def _timed_out(self, call: Dict[str, Any]) -> ToolMessage:
+        return self._error(call, f"Error: {call['name']} did not answer in {self.timeout_for(call['name'])}s, "
+                                 f"continue with the other results.")
+
+    def _record(self, config: Optional[RunnableConfig], wall_s: float, calls: List[Dict[str, Any]]):
+        self.log.add({"step": "tools", "thread_id": _thread_id(config), "wall_s": wall_s, "calls": calls})
+
+    @staticmethod
+    def _trace(calls: List[Dict[str, Any]], messages: List[ToolMessage], timings: List[Dict[str, Any]]):
+        tracer = get_tracer()
+        if not tracer.enabled:
+            return
+        for call, message, timing in zip(calls, messages, timings):
+            tracer.record("tool", call["name"], timing["latency_s"], error=timing["status"] != "success",
+                          parent="node:tools", queue_wait_s=timing.get("queue_wait_s"),
+                          bytes_in=len(json.dumps(call.get("args"), default=str).encode()),
+                          bytes_out=payload_bytes([message]), status=timing["status"])
+
+    def invoke(self, state: Dict[str, Any], config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """Sync node: every call goes to the thread pool, the turn waits for all of them or their timeout"""
+        with get_tracer().span("node", "tools"):
+            return self._invoke(state, config)
+
+    def _invoke(self, state: Dict[str, Any], config: Optional[RunnableConfig]) -> Dict[str, Any]:
+        calls = self._tool_calls(state)
+        start = time.perf_counter()
+        futures = {}
+        for call in calls:
+            if self._unknown(call) is None:
+                futures[call["id"]] = self._pool.submit(self._timed, self._run, call, start)
+        messages, timings = [], []
+        for call in calls:
+            unknown = self._unknown(call)
+            if unknown is not None:
+                messages.append(unknown)
+                timings.append({"name": call["name"], "latency_s": 0.0, "status": "unknown"})
+                continue
+            remaining = max(self.timeout_for(call["name"]) - (time.perf_counter() - start), 0.0)
+            try:
+                message, latency, queue_wait = futures[call["id"]].result(timeout=remaining)
+                status = message.status
+            except FutureTimeoutError:
+                message, latency, queue_wait, status = self._timed_out(call), time.perf_counter() - start, None, "timeout"
+            except Exception as e:
+                message, latency, queue_wait, status = self._failed(call, e), time.perf_counter() - start, None, "error"
+            messages.append(message)
+            timings.append({"name": call["name"], "latency_s": latency, "queue_wait_s": queue_wait, "status": status})
+        self._record(config, time.perf_counter() - start, timings)
+        self._trace(calls, messages, timings)
+        return {"messages": messages}
+
+    @staticmethod
+    def _timed(run, call, submitted: float):
+        """Run a call in the pool: message, run time and time waiting for a thread"""
+        start = time.perf_counter()
+        message = run(call)
+        return message, time.perf_counter() - start, start - submitted
+
+    async def ainvoke(self, state: Dict[str, Any], config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+        """Async node: coroutine tools are awaited, blocking ones go to the bounded thread pool"""
+        with get_tracer().span("node", "tools"):
+            return await self._ainvoke(state, config)
+
+    async def _ainvoke(self, state: Dict[str, Any], config: Optional[RunnableConfig]) -> Dict[str, Any]:
+        calls = self._tool_calls(state)
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        async def one(call):
+            unknown = self._unknown(call)
+            if unknown is not None:
+                return unknown, {"name": call["name"], "latency_s": 0.0, "status": "unknown"}
+            call_start = time.perf_counter()
+            queue_wait = None
+            try:
+                if call["name"] in self.blocking:
+                    pending = loop.run_in_executor(self._pool, self._timed, self._run, call, call_start)
+                    message, _, queue_wait = await asyncio.wait_for(pending, self.timeout_for(call["name"]))
+                else:
+                    message = await asyncio.wait_for(self._arun(call), self.timeout_for(call["name"]))
+                status = message.status
+            except asyncio.TimeoutError:
+                message, status = self._timed_out(call), "timeout"
+            except asyncio.CancelledError as e:
+                # Only the cancellation of this turn stops it, one raised by a tool is its result
+                if asyncio.current_task().cancelling():
+                    raise
+                message, status = self._failed(call, e), "error"
+            except Exception as e:
+                message, status = self._failed(call, e), "error"
+            return message, {"name": call["name"], "latency_s": time.perf_counter() - call_start,
+                             "queue_wait_s": queue_wait, "status": status}
+
+        results = await asyncio.gather(*[one(call) for call in calls])
+        messages, timings = [message for message, _ in results], [timing for _, timing in results]
+        self._record(config, time.perf_counter() - start, timings)
+        self._trace(calls, messages, timings)
+        return {"messages": messages}
+
+    def as_node(self) -> RunnableLambda:
+        """Graph node with both the sync and the async version"""
+        return RunnableLambda(self.invoke, afunc=self.ainvoke, name="tools")
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,255 @@
+"""
+Wrapper for the tools that call remote services (DuckDuckGo, Hugging Face Hub)
+
+- TTL cache per tool: the same query (case and whitespace insensitive) is answered from
+  memory until it expires. Errors are not cached.
+- Single-flight: identical queries in flight at the same time share one backend call. When
+  the call running the backend is cancelled, the waiting calls run it again (one of them
+  becomes the leader), they never get the cancellation of another caller.
+- Token bucket rate limiter per tool: calls wait for a token instead of fixed sleeps.
+- Metrics per tool: calls, hits, misses, coalesced, errors, rate limit waits.
+- Optional `version` of the data behind a local tool (guest index): when it changes the
+  cached results are dropped.
+
+The backend is any `query -> str` function, so the tools can run with local fakes:
+```python
+search = GuardedTool("search", lambda query: f"results for {query}", ttl_s=60, rate_per_s=1)
+search("Paris weather")
+print(search.metrics())
+```
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain_core.tools import Tool
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    return _SPACES.sub(" ", str(query)).strip().casefold()
+
+
+class LeaderCancelled(Exception):
+    """The call that ran the backend for the coalesced calls was cancelled, they try again"""
+
+
+class TokenBucket:
+    """`rate_per_s` tokens per second, at most `burst` saved"""
+
+    def __init__(self, rate_per_s: float, burst: int = 1):
+        self.rate_per_s = rate_per_s
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token, returns the seconds to wait until it's available"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_s)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate_per_s if self._tokens < 0 else 0.0
+
+    def acquire(self) -> float:
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self) -> float:
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class GuardedTool:
+    def __init__(self, name: str, backend: Callable[[str], str], ttl_s: float = 600,
+                 rate_per_s: Optional[float] = None, burst: int = 1, max_entries: int = 1024,
+                 cacheable: Callable[[str], bool] = lambda result: True,
+                 version: Optional[Callable[[], Any]] = None):
+        """
+        :param name: str: tool name, used in the metrics
+        :param backend: Callable[[str], str]: the real call, query -> result
+        :param ttl_s: float: seconds a result stays in the cache, 0 disables the cache
+        :param rate_per_s: Optional[float]: max backend calls per second, None no limit
+        :param burst: int: backend calls allowed at once before the rate applies
+        :param max_entries: int: cached queries, the least recently used are dropped
+        :param cacheable: Callable[[str], bool]: False for results that must not be cached
+        :param version: Optional[Callable[[], Any]]: version of the backend data, part of the cache key
+        """
+        self.name = name
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.cacheable = cacheable
+        self.version = version
+        self._version_seen: Any = None
+        self.limiter = TokenBucket(rate_per_s, burst) if rate_per_s else None
+        self._cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._metrics = {"calls": 0, "hits": 0, "misses": 0, "coalesced": 0, "errors": 0,
+                         "cancelled": 0, "rate_limited": 0, "wait_s": 0.0, "backend_s": 0.0, "invalidations": 0}
+
+    def _key(self, query: str) -> str:
+        """Normalized query, with the data version when there is one. A failing `version` counts as a failed call"""
+        if self.version is None:
+            return normalize_query(query)
+        try:
+            version = self.version()
+        except Exception:
+            # e.g. the guest index can't be loaded: the call fails before the lookup, count it here
+            with self._lock:
+                self._metrics["calls"] += 1
+                self._metrics["errors"] += 1
+            raise
+        with self._lock:
+            if version != self._version_seen:
+                # Results of the previous version can't be hit again, free them now
+                if self._cache:
+                    self._metrics["invalidations"] += 1
+                self._cache.clear()
+                self._version_seen = version
+        return f"{version}\x00{normalize_query(query)}"
+
+    def _lookup(self, key: str) -> Tuple[Optional[str], Optional[Future], bool]:
+        """Cached result, or the future to wait for, or (None, new future, True) if this call is the leader"""
+        with self._lock:
+            self._metrics["calls"] += 1
+            entry = self._cache.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._cache.move_to_end(key)
+                    self._metrics["hits"] += 1
+                    return entry[1], None, False
+                del self._cache[key]
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._metrics["coalesced"] += 1
+                return None, future, False
+            self._metrics["misses"] += 1
+            future = self._in_flight[key] = Future()
+            return None, future, True
+
+    def _finish(self, key: str, future: Future, result: Optional[str], error: Optional[BaseException],
+                wait_s: float, backend_s: float):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            self._metrics["wait_s"] += wait_s
+            self._metrics["rate_limited"] += wait_s > 0
+            self._metrics["backend_s"] += backend_s
+            if error is not None and not isinstance(error, Exception):
+                # Cancellation (or Ctrl+C) belongs to the caller that got it, the followers run the call again
+                self._metrics["cancelled"] += 1
+                error = LeaderCancelled(self.name)
+            elif error is not None:
+                self._metrics["errors"] += 1
+            elif self.ttl_s and self.cacheable(result):
+                self._cache[key] = (time.monotonic() + self.ttl_s, result)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def __call__(self, query: str) -> str:
+        while True:
+            key = self._key(query)
+            cached, future, leader = self._lookup(key)
+            if cached is not None:
+                return cached
+            if leader:
+                break
+            try:
+                return future.result()
+            except LeaderCancelled:
+                continue
+        wait_s = 0.0
+        start = None
+        try:
+            if self.limiter:
+                wait_s = self.limiter.acquire()
+            start = time.perf_counter()
+            result = self.backend(query)
+        except BaseException as e:
+            self._finish(key, future, None, e, wait_s, time.perf_counter() - start if start else 0.0)
+            raise
+        self._finish(key, future, result, None, wait_s, time.perf_counter() - start)
+        return result
+
+    async def acall(self, query: str) -> str:
+        while True:
+            key = self._key(query)
+            cached, future, leader = self._lookup(key)
+            if cached is not None:
+                return cached
+            if leader:
+                break
+            try:
+                # shield: a cancelled follower must not cancel the future shared with the others
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except LeaderCancelled:
+                continue
+        wait_s = 0.0
+        start = None
+        try:
+            # Inside the try: a call cancelled while it waits for a token still releases the query
+            if self.limiter:
+                wait_s = await self.limiter.aacquire()
+            start = time.perf_counter()
+            # The backends are blocking (HTTP), keep the event loop free
+            result = await asyncio.to_thread(self.backend, query)
+        except BaseException as e:
+            self._finish(key, future, None, e, wait_s, time.perf_counter() - start if start else 0.0)
+            raise
+        self._finish(key, future, result, None, wait_s, time.perf_counter() - start)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = dict(self._metrics, entries=len(self._cache))
+        lookups = metrics["hits"] + metrics["misses"] + metrics["coalesced"]
+        metrics["hit_ratio"] = round((metrics["hits"] + metrics["coalesced"]) / lookups, 3) if lookups else 0.0
+        metrics["wait_s"] = round(metrics["wait_s"], 3)
+        metrics["backend_s"] = round(metrics["backend_s"], 3)
+        return metrics
+
+
+_guards: Dict[str, GuardedTool] = {}
+
+
+def guarded_tool(name: str, backend: Callable[[str], str], description: str, args_schema: Any = None,
+                 register: bool = True, **options) -> Tool:
+    """
+    LangChain Tool whose calls go through a GuardedTool (`options` are its arguments)
+
+    :param register: bool: add the guard to `tool_metrics()` / `get_guard` by name, off for local
+      fakes so they don't replace the guard of the real tool
+    """
+    guard = GuardedTool(name, backend, **options)
+    if register:
+        _guards[name] = guard
+    return Tool(name=name, func=guard, coroutine=guard.acall, description=description, args_schema=args_schema)
+
+
+def get_guard(name: str) -> GuardedTool:
+    return _guards[name]
+
+
+def tool_metrics() -> Dict[str, Dict[str, Any]]:
+    """Metrics of every guarded tool"""
+    return {name: guard.metrics() for name, guard in _guards.items()}
@@ -0,0 +1,116 @@
+"""
+Lazy tool registry: tools declared up front, backends built on their first call
+
+The model only needs the name, the description and the input schema of a tool, so the
+`Tool` objects are cheap to create at import. What is slow is behind them: importing
+langchain_community, huggingface_hub or datasets, creating `DuckDuckGoSearchRun()`,
+loading the guest index. A `LazyBackend` runs its factory (with those imports inside it)
+the first time the tool is called, so `import tools` and a worker that only uses
+`weather_info_tool` don't pay for the others.
+
+A factory that fails (e.g. a package not installed) raises on that call, the tool
+returns the error to the model and the next call tries again.
+
+```python
+search_tool = registry.declare("search", "Search the web", lambda: SearchClient().search)
+registry.metrics()  # {"search": {"loaded": False, "load_s": None, "failures": 0}}
+```
+
+`registry` is the one of the app. Tools with fake backends go to a `ToolRegistry()` of their
+own, so they don't replace the real tools, their backends and their tool_guard metrics.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.tools import BaseTool, Tool
+
+from tool_guard import guarded_tool
+
+Backend = Callable[[str], str]
+
+
+class LazyBackend:
+    """`query -> str` callable that builds the real backend on the first call"""
+
+    def __init__(self, name: str, factory: Callable[[], Backend]):
+        """
+        :param name: str: tool name, for the metrics
+        :param factory: Callable[[], Backend]: imports what it needs and returns the backend
+        """
+        self.name = name
+        self.factory = factory
+        self.load_s: Optional[float] = None
+        self.failures = 0
+        self._backend: Optional[Backend] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._backend is not None
+
+    def load(self) -> Backend:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    start = time.perf_counter()
+                    try:
+                        backend = self.factory()
+                    except Exception:
+                        self.failures += 1
+                        raise
+                    self.load_s = time.perf_counter() - start
+                    self._backend = backend
+        return self._backend
+
+    def __call__(self, query: str) -> str:
+        return self.load()(query)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"loaded": self.loaded, "load_s": round(self.load_s, 3) if self.load_s is not None else None,
+                "failures": self.failures}
+
+
+class ToolRegistry:
+    def __init__(self, shared: bool = False):
+        """
+        :param shared: bool: the guards of the tools are also registered in tool_guard (`tool_metrics()`),
+          only for the registry of the app
+        """
+        self.shared = shared
+        self.tools: Dict[str, BaseTool] = {}
+        self.backends: Dict[str, LazyBackend] = {}
+
+    def add(self, tool: BaseTool) -> BaseTool:
+        """Register a tool that is already cheap to build"""
+        self.tools[tool.name] = tool
+        return tool
+
+    def declare(self, name: str, description: str, factory: Callable[[], Backend], args_schema: Any = None,
+                guarded: bool = True, **options) -> Tool:
+        """
+        Tool whose backend is built by `factory` on the first call
+
+        :param guarded: bool: calls go through tool_guard (cache, coalescing, rate limit), `options` are its arguments
+        """
+        backend = self.backends[name] = LazyBackend(name, factory)
+        if guarded:
+            return self.add(guarded_tool(name, backend, description, args_schema=args_schema,
+                                         register=self.shared, **options))
+        return self.add(Tool(name=name, func=backend, description=description, args_schema=args_schema))
+
+    def get(self, *names: str) -> List[BaseTool]:
+        """The tools by name, all of them when no name is given"""
+        return [self.tools[name] for name in names] if names else list(self.tools.values())
+
+    def preload(self, *names: str) -> Dict[str, float]:
+        """Build the backends now (e.g. in a warm-up), returns the seconds of each one"""
+        for name in names or list(self.backends):
+            self.backends[name].load()
+        return {name: self.backends[name].load_s for name in names or self.backends}
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {name: backend.metrics() for name, backend in self.backends.items()}
+
+
+registry = ToolRegistry(shared=True)
@@ -1,11 +1,53 @@
-from langchain.tools import Tool
+from typing import Callable, Optional
+from langchain_core.tools import Tool
+from pydantic import BaseModel, Field
 import random
-from langchain_community.tools import DuckDuckGoSearchRun
-from huggingface_hub import list_models
-from assistant import create_assistant_with_tools
-from langchain_core.messages import HumanMessage
+from tool_guard import tool_metrics
+# The tools are declared here, langchain_community and huggingface_hub are only imported
+# on their first call (see tool_registry.py)
+from tool_registry import ToolRegistry, registry
 
-search_tool = DuckDuckGoSearchRun()
+# Remote tools: results cached for a while and calls limited per second (DuckDuckGo rate limits)
+SEARCH_TTL_S = 30 * 60
+SEARCH_RATE_PER_S = 1.0
+SEARCH_BURST = 2
+HUB_STATS_TTL_S = 60 * 60
+HUB_STATS_RATE_PER_S = 5.0
+HUB_STATS_BURST = 5
+
+
+# Same name, description and input as DuckDuckGoSearchRun, without importing it
+SEARCH_TOOL_NAME = "duckduckgo_search"
+SEARCH_TOOL_DESCRIPTION = (
+    "A wrapper around DuckDuckGo Search. Useful for when you need to answer questions about current events. "
+    "Input should be a search query."
+)
+
+class SearchInput(BaseModel):
+    query: str = Field(description="search query to look up")
+
+def duckduckgo_backend() -> Callable[[str], str]:
+    from langchain_community.tools import DuckDuckGoSearchRun
+    return DuckDuckGoSearchRun().invoke
+
+def _tool_registry_for(fake: bool, target: Optional[ToolRegistry] = None) -> ToolRegistry:
+    """`target`, by default the app registry or a new one for a fake, which must not replace the real tool"""
+    if target is not None:
+        return target
+    return ToolRegistry() if fake else registry
+
+def make_search_tool(backend: Optional[Callable[[str], str]] = None, registry: Optional[ToolRegistry] = None) -> Tool:
+    """
+    DuckDuckGo search with cache, coalescing and rate limit. `backend` replaces the real search (fakes),
+    declared in `registry` (default its own one for a fake, the app registry otherwise)
+    """
+    return _tool_registry_for(backend is not None, registry).declare(
+        SEARCH_TOOL_NAME, SEARCH_TOOL_DESCRIPTION, (lambda: backend) if backend else duckduckgo_backend,
+        args_schema=SearchInput,
+        ttl_s=SEARCH_TTL_S, rate_per_s=SEARCH_RATE_PER_S, burst=SEARCH_BURST
+    )
+
+search_tool = make_search_tool()
 #results = search_tool.invoke("Who's the current President of France?")
 #print(results)
 
@@ -23,16 +65,18 @@ def get_weather_info(location: str) -> str:
     return f"Weather in {location}: {data['condition']}, {data['temp_c']}°C"
 
 # Initialize the tool
-weather_info_tool = Tool(
+weather_info_tool = registry.add(Tool(
     name="get_weather_info",
     func=get_weather_info,
     description="Fetches dummy weather information for a given location."
-)
+))
 
 
 def get_hub_stats(author: str) -> str:
     """Fetches the most downloaded model from a specific author on the Hugging Face Hub."""
     try:
+        # Imported on the first call of the tool
+        from huggingface_hub import list_models
         # List models from the specified author, sorted by downloads
         models = list(list_models(author=author, sort="downloads", direction=-1, limit=1))
 
@@ -44,16 +88,29 @@ def get_hub_stats(author: str) -> str:
     except Exception as e:
         return f"Error fetching models for {author}: {str(e)}"
 
+def make_hub_stats_tool(backend: Callable[[str], str] = get_hub_stats, registry: Optional[ToolRegistry] = None) -> Tool:
+    """
+    get_hub_stats with cache, coalescing and rate limit. `backend` replaces the Hub call (fakes),
+    declared in `registry` (default its own one for a fake, the app registry otherwise)
+    """
+    return _tool_registry_for(backend is not get_hub_stats, registry).declare(
+        "get_hub_stats",
+        "Fetches the most downloaded model from a specific author on the Hugging Face Hub.",
+        lambda: backend,
+        ttl_s=HUB_STATS_TTL_S, rate_per_s=HUB_STATS_RATE_PER_S, burst=HUB_STATS_BURST,
+        # get_hub_stats returns the errors as text, they must not be cached
+        cacheable=lambda result: not result.startswith("Error")
+    )
+
 # Initialize the tool
-hub_stats_tool = Tool(
-    name="get_hub_stats",
-    func=get_hub_stats,
-    description="Fetches the most downloaded model from a specific author on the Hugging Face Hub."
-)
+hub_stats_tool = make_hub_stats_tool()
 # Example usage
 #print(hub_stats_tool("facebook")) # Example: Get the most downloaded model by Facebook
 
 if __name__ == "__main__":
+    from langchain_core.messages import HumanMessage
+    from assistant import create_assistant_with_tools
+
     alfred = create_assistant_with_tools([search_tool, weather_info_tool, hub_stats_tool])
 
     # Questions about people and need to have the tools
@@ -61,4 +118,6 @@ if __name__ == "__main__":
     response = alfred.invoke({"messages": messages})
 
     print("🎩 Alfred's Response:")
-    print(response['messages'][-1].content)
\ No newline at end of file
+    print(response['messages'][-1].content)
+    print("Tools:", tool_metrics())
+    print("Backends (lazy):", registry.metrics())
\ No newline at end of file
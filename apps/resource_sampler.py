@@ -0,0 +1,270 @@
+"""
+CPU & memory sampler for specific processes (the ollama server, this python process)
+
+A background thread reads the cumulative CPU time and the RSS of every target process at
+a fixed rate and stores them in a preallocated ring buffer (fixed memory, the oldest
+samples are overwritten). Requests are tagged with `request()`: the CPU-seconds of
+each process are attributed to the requests running at that moment (split evenly between
+overlapping requests) and the peak RSS seen during the request is kept.
+
+# Required packages:
+pip install psutil==7.0.0
+
+# Usage
+with ResourceSampler(interval_s=0.1) as sampler:
+  with sampler.request("run_model") as usage:
+    await run_model()
+  print(usage)
+  sampler.export_csv("samples.csv")
+"""
+import csv
+import json
+import os
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import psutil
+
+# Columns of the ring buffer: time, system cpu%, system ram%, then cpu seconds and rss per target
+_SYSTEM_COLUMNS = 3
+_TARGET_COLUMNS = 2
+
+
+def find_ollama_pid() -> Optional[int]:
+  """
+  PID of the local `ollama serve` process, None when ollama runs somewhere else (docker, remote)
+  """
+  for proc in psutil.process_iter(['name', 'cmdline']):
+    try:
+      cmdline = proc.info['cmdline'] or []
+      if proc.info['name'] == 'ollama' or (cmdline and os.path.basename(cmdline[0]) == 'ollama' and 'serve' in cmdline):
+        return proc.pid
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+      continue
+  return None
+
+
+def default_targets() -> Dict[str, int]:
+  """
+  This process and, when found, the ollama server
+  """
+  targets = {'client': os.getpid()}
+  ollama_pid = find_ollama_pid()
+  if ollama_pid is not None:
+    targets['ollama'] = ollama_pid
+  return targets
+
+
+class RequestUsage:
+  """
+  Resources attributed to one request
+  """
+  __slots__ = ('id', 'name', 'start', 'end', 'cpu_s', 'peak_rss', 'samples')
+
+  def __init__(self, request_id: int, name: str, start: float, targets: List[str]):
+    self.id = request_id
+    self.name = name
+    self.start = start
+    self.end: Optional[float] = None
+    self.cpu_s = {target: 0.0 for target in targets}
+    self.peak_rss = {target: 0 for target in targets}
+    self.samples = 0
+
+  def to_dict(self) -> Dict[str, Any]:
+    return {
+      'id': self.id,
+      'name': self.name,
+      'start': self.start,
+      'end': self.end,
+      'duration_s': (self.end - self.start) if self.end is not None else None,
+      'cpu_s': dict(self.cpu_s),
+      'peak_rss_mb': {target: rss / 2**20 for target, rss in self.peak_rss.items()},
+      'samples': self.samples,
+    }
+
+  def __repr__(self) -> str:
+    return f"RequestUsage({self.to_dict()})"
+
+
+class ResourceSampler:
+  def __init__(self, targets: Optional[Dict[str, int]] = None, interval_s: float = 0.1, capacity: int = 36_000):
+    """
+    :param targets: Optional[Dict[str, int]]: name -> pid, default this process and the ollama server
+    :param interval_s: float: time between samples
+    :param capacity: int: samples kept in the ring buffer (36000 at 0.1s = 1 hour)
+    """
+    targets = default_targets() if targets is None else targets
+    self.names = list(targets)
+    self.interval_s = interval_s
+    self.capacity = capacity
+    self.width = _SYSTEM_COLUMNS + _TARGET_COLUMNS * len(self.names)
+    self._buffer = array('d', bytes(8 * capacity * self.width))
+    self._count = 0
+    self._processes = {name: psutil.Process(pid) for name, pid in targets.items()}
+    self._last_cpu = {name: self._cpu_seconds(proc) for name, proc in self._processes.items()}
+    self._active: Dict[int, RequestUsage] = {}
+    self._finished: List[RequestUsage] = []
+    self._next_id = 0
+    self._lock = threading.Lock()
+    self._stop = threading.Event()
+    self._thread: Optional[threading.Thread] = None
+    psutil.cpu_percent(None)  # first call only sets the baseline
+
+  @staticmethod
+  def _cpu_seconds(proc: psutil.Process) -> float:
+    try:
+      times = proc.cpu_times()
+      return times.user + times.system
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+      return 0.0
+
+  def start(self) -> 'ResourceSampler':
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def __enter__(self) -> 'ResourceSampler':
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.stop()
+
+  def _run(self):
+    while not self._stop.wait(self.interval_s):
+      self.sample()
+
+  def sample(self):
+    """
+    Take one sample now, also called at the start/end of every request
+    """
+    row = [time.time(), psutil.cpu_percent(None), psutil.virtual_memory().percent]
+    values = {}
+    for name, proc in self._processes.items():
+      try:
+        with proc.oneshot():
+          times = proc.cpu_times()
+          values[name] = (times.user + times.system, proc.memory_info().rss)
+      except (psutil.NoSuchProcess, psutil.AccessDenied):
+        values[name] = (self._last_cpu[name], 0)
+      row.extend(values[name])
+
+    with self._lock:
+      offset = (self._count % self.capacity) * self.width
+      self._buffer[offset:offset + self.width] = array('d', row)
+      self._count += 1
+      # Attribute the cpu used since the previous sample to the running requests
+      active = list(self._active.values())
+      for name, (cpu_s, rss) in values.items():
+        delta = max(cpu_s - self._last_cpu[name], 0.0)
+        self._last_cpu[name] = cpu_s
+        for usage in active:
+          usage.cpu_s[name] += delta / len(active)
+          if rss > usage.peak_rss[name]:
+            usage.peak_rss[name] = int(rss)
+      for usage in active:
+        usage.samples += 1
+
+  def begin(self, name: str) -> RequestUsage:
+    self.sample()  # cpu used before this point belongs to the previous requests
+    with self._lock:
+      usage = RequestUsage(self._next_id, name, time.time(), self.names)
+      self._next_id += 1
+      self._active[usage.id] = usage
+    return usage
+
+  def end(self, usage: RequestUsage) -> RequestUsage:
+    self.sample()
+    with self._lock:
+      usage.end = time.time()
+      self._active.pop(usage.id, None)
+      self._finished.append(usage)
+    return usage
+
+  @contextmanager
+  def request(self, name: str) -> Iterator[RequestUsage]:
+    """
+    Tag a request: `with sampler.request("chat") as usage: ...`
+    """
+    usage = self.begin(name)
+    try:
+      yield usage
+    finally:
+      self.end(usage)
+
+  @property
+  def sample_count(self) -> int:
+    """
+    Samples taken since the start, including the ones already overwritten
+    """
+    return self._count
+
+  def latest(self) -> Optional[Dict[str, float]]:
+    rows = self.rows(last=1)
+    return rows[0] if rows else None
+
+  def rows(self, last: Optional[int] = None) -> List[Dict[str, float]]:
+    """
+    Samples in time order (oldest first), with cpu% computed from the previous sample
+    """
+    with self._lock:
+      first = self._count - min(self._count, self.capacity)
+      if last:
+        # One more sample for the cpu% of the first returned row
+        first = max(first, self._count - last - 1)
+      raw = []
+      for i in range(first, self._count):
+        offset = (i % self.capacity) * self.width
+        raw.append(self._buffer[offset:offset + self.width])
+    rows = []
+    for i, values in enumerate(raw):
+      row = {'time': values[0], 'system_cpu_percent': values[1], 'system_ram_percent': values[2]}
+      for j, name in enumerate(self.names):
+        column = _SYSTEM_COLUMNS + _TARGET_COLUMNS * j
+        cpu_s, rss = values[column], values[column + 1]
+        if i > 0:
+          previous = raw[i - 1]
+          elapsed = values[0] - previous[0]
+          row[f'{name}_cpu_percent'] = 100 * (cpu_s - previous[column]) / elapsed if elapsed > 0 else 0.0
+        else:
+          row[f'{name}_cpu_percent'] = 0.0
+        row[f'{name}_cpu_s'] = cpu_s
+        row[f'{name}_rss_mb'] = rss / 2**20
+      rows.append(row)
+    return rows[-last:] if last else rows
+
+  def requests(self) -> List[Dict[str, Any]]:
+    with self._lock:
+      return [usage.to_dict() for usage in self._finished]
+
+  def export_csv(self, path: str):
+    """
+    Time series of the samples, one row per sample
+    """
+    rows = self.rows()
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+      if rows:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+  def export_json(self, path: str):
+    """
+    Samples, targets and the requests with their attributed usage
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+      json.dump({
+        'targets': {name: proc.pid for name, proc in self._processes.items()},
+        'interval_s': self.interval_s,
+        'samples': self.rows(),
+        'requests': self.requests(),
+      }, f, indent=2)
@@ -0,0 +1,291 @@
+"""
+Batch mode for the Spam Email Checker
+
+Streams emails from a mailbox and runs each one through the `compiled_graph` of
+spam_checker.py with `ainvoke`. Only `--concurrency` emails are processed at the
+same time and the reader waits when the queue is full (backpressure), so a huge
+mailbox never gets loaded in memory.
+
+The escalate policies use two models per email (classify with the tiny one, escalate and
+draft with the bigger one), so concurrent emails would alternate them. The LLM calls go
+through a `ModelGate` of model_residency: the calls of one model run together (up to
+`--model-batch` in a row) while the other model waits, loaded models first. `--no-group-models`
+turns it off.
+
+Supported sources:
+- mbox file (`inbox.mbox`)
+- Maildir folder (`~/Maildir`)
+- JSONL file, one email per line: {"id": "...", "sender": "...", "subject": "...", "body": "..."}
+
+Every result is appended to the output JSONL as soon as it is ready.
+
+# Required packages:
+pip install langgraph==0.3.19 langchain-ollama==0.3.0 langchain-core==0.3.48
+
+# Run app
+python ./apps/spam_batch.py --source ./inbox.mbox --output ./results.jsonl --concurrency 4 --routing escalate+skip
+
+# With the latency histograms of every node and LLM call, also served as Prometheus text
+TRACING=1 TRACING_PORT=9464 python ./apps/spam_batch.py --source ./inbox.mbox
+"""
+
+import argparse
+import asyncio
+import json
+import mailbox
+import os
+import statistics
+import time
+from email.message import Message
+from typing import Any, Dict, Iterator, List, Optional
+
+import spam_checker
+from model_residency import GATE_MAX_BATCH, ModelGate, get_residency
+from spam_checker import ROUTING_POLICIES, ROUTING_POLICY, compiled_graph, declare_models, new_email_state, response_cache
+from spam_prefilter import prefilter_stats
+from tracing import get_tracer
+
+#---------------------------------------------------------------------------------
+#                                                           Email sources
+
+def _message_body(msg: Message) -> str:
+    """Return the text/plain part of an email (decoded)"""
+    parts = msg.walk() if msg.is_multipart() else [msg]
+    for part in parts:
+        if part.get_content_type() != "text/plain" or part.get_content_disposition() == "attachment":
+            continue
+        payload = part.get_payload(decode=True)
+        if payload is None:
+            continue
+        charset = part.get_content_charset() or "utf-8"
+        try:
+            return payload.decode(charset, errors="replace")
+        except LookupError:
+            return payload.decode("utf-8", errors="replace")
+    return ""
+
+
+def _message_to_email(key: str, msg: Message) -> Dict[str, Any]:
+    return {
+        "id": msg.get("Message-ID") or key,
+        "sender": msg.get("From", ""),
+        "subject": msg.get("Subject", ""),
+        "body": _message_body(msg),
+    }
+
+
+def iter_emails(source: str, source_type: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily iterate the emails of a source
+
+    :param source: str: path to a mbox file, Maildir folder or JSONL file
+    :param source_type: Optional[str]: "mbox", "maildir" or "jsonl". Guessed from the path when None
+    """
+    if source_type is None:
+        if os.path.isdir(source):
+            source_type = "maildir"
+        elif source.endswith((".jsonl", ".json")):
+            source_type = "jsonl"
+        else:
+            source_type = "mbox"
+
+    if source_type == "jsonl":
+        with open(source, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                email = json.loads(line)
+                email.setdefault("id", str(line_number))
+                yield email
+    elif source_type in ("mbox", "maildir"):
+        box = mailbox.mbox(source, create=False) if source_type == "mbox" else mailbox.Maildir(source, factory=None, create=False)
+        try:
+            for key in box.iterkeys():
+                yield _message_to_email(str(key), box.get_message(key))
+        finally:
+            box.close()
+    else:
+        raise ValueError(f"Unknown source type: {source_type}")
+
+
+#---------------------------------------------------------------------------------
+#                                                           Stats
+
+class ThroughputStats:
+    """Aggregate stats of a batch run"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.latencies: List[float] = []
+        self.spam = 0
+        self.errors = 0
+        self.classified = 0
+        self.escalated = 0
+        self.drafts_skipped = 0
+        self.calls: Dict[str, Dict[str, float]] = {}
+
+    def add(self, record: Dict[str, Any]):
+        self.latencies.append(record["elapsed_s"])
+        if record.get("error"):
+            self.errors += 1
+            return
+        if record.get("is_spam"):
+            self.spam += 1
+        elif record.get("draft_response") is None:
+            self.drafts_skipped += 1
+        if any(call["node"] == "classify_email" for call in record["model_calls"]):
+            self.classified += 1
+        self.escalated += bool(record.get("escalated"))
+        for call in record["model_calls"]:
+            model = self.calls.setdefault(call["model"], {"calls": 0, "prompt_tokens": 0, "prompt_eval_s": 0.0,
+                                                          "eval_tokens": 0, "inference_s": 0.0})
+            model["calls"] += 1
+            model["prompt_tokens"] += call["prompt_tokens"]
+            model["prompt_eval_s"] += call["prompt_eval_s"]
+            model["eval_tokens"] += call["eval_tokens"]
+            model["inference_s"] += call["inference_s"]
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started_at
+        total = len(self.latencies)
+        latencies = sorted(self.latencies)
+        return {
+            "emails": total,
+            "spam": self.spam,
+            "errors": self.errors,
+            "elapsed_s": round(elapsed, 3),
+            "emails_per_s": round(total / elapsed, 3) if elapsed > 0 else 0.0,
+            "emails_per_hour": round(total * 3600 / elapsed) if elapsed > 0 else 0,
+            "latency_mean_s": round(statistics.fmean(latencies), 3) if latencies else None,
+            "latency_p50_s": round(latencies[int(0.50 * (total - 1))], 3) if latencies else None,
+            "latency_p95_s": round(latencies[int(0.95 * (total - 1))], 3) if latencies else None,
+            # Cost of the routing policy: model calls, tokens and inference time per email
+            "calls_per_email": round(sum(model["calls"] for model in self.calls.values()) / total, 3) if total else None,
+            "inference_s_per_email": round(sum(model["inference_s"] for model in self.calls.values()) / total, 3) if total else None,
+            # Evaluated prompt tokens, the prefix reused from the prompt cache is not counted
+            "prompt_tokens_per_email": round(sum(model["prompt_tokens"] for model in self.calls.values()) / total, 1) if total else None,
+            "prompt_eval_s_per_email": round(sum(model["prompt_eval_s"] for model in self.calls.values()) / total, 4) if total else None,
+            "per_model": {name: {**model, "inference_s": round(model["inference_s"], 3), "prompt_eval_s": round(model["prompt_eval_s"], 4)}
+                          for name, model in self.calls.items()},
+            "escalation_rate": round(self.escalated / self.classified, 3) if self.classified else None,
+            "drafts_skipped": self.drafts_skipped,
+            "prefilter": prefilter_stats.summary(),
+            "llm_cache": response_cache.stats() if response_cache else None,
+            "models": get_residency().summary(),
+            "model_gate": spam_checker.model_gate.summary() if spam_checker.model_gate else None,
+            # Latency histograms per node and LLM call (TRACING=1)
+            "tracing": get_tracer().report()["spans"] if get_tracer().enabled else None,
+        }
+
+
+#---------------------------------------------------------------------------------
+#                                                           Batch pipeline
+
+async def process_email(email: Dict[str, Any], routing: str = ROUTING_POLICY) -> Dict[str, Any]:
+    """Run one email through the graph and return the JSONL record"""
+    delta_t = time.perf_counter()
+    record = {"id": email.get("id"), "sender": email.get("sender"), "subject": email.get("subject")}
+    try:
+        result = await compiled_graph.ainvoke(
+            new_email_state(email.get("sender", ""), email.get("subject", ""), email.get("body", "")),
+            {"configurable": {"routing": routing}}
+        )
+        record.update({
+            "is_spam": result.get("is_spam"),
+            "spam_reason": result.get("spam_reason"),
+            "email_category": result.get("email_category"),
+            "classify_confidence": result.get("classify_confidence"),
+            "escalated": result.get("escalated"),
+            "draft_response": result.get("draft_response"),
+            "model_calls": result.get("model_calls", []),
+        })
+        record["prompt_tokens"] = sum(call["prompt_tokens"] for call in record["model_calls"])
+        record["prompt_eval_s"] = round(sum(call["prompt_eval_s"] for call in record["model_calls"]), 4)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed_s"] = round(time.perf_counter() - delta_t, 3)
+    return record
+
+
+async def run_batch(source: str, output: str, concurrency: int = 4,
+                    source_type: Optional[str] = None, limit: Optional[int] = None,
+                    routing: str = ROUTING_POLICY, group_models: bool = True,
+                    model_batch: int = GATE_MAX_BATCH) -> Dict[str, Any]:
+    """
+    Process all the emails of a source and write the results as JSONL
+
+    :param source: str: mailbox path
+    :param output: str: JSONL file where the results are appended
+    :param concurrency: int: max number of emails running in the graph at the same time
+    :param source_type: Optional[str]: "mbox", "maildir" or "jsonl"
+    :param limit: Optional[int]: stop after this number of emails
+    :param routing: str: routing policy of spam_checker.ROUTING_POLICIES
+    :param group_models: bool: run the LLM calls of the concurrent emails grouped by model
+    :param model_batch: int: calls of a model in a row while the other model waits
+    """
+    pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    # Load the models of the policy before the first email so it's not part of its latency
+    declare_models(routing)
+    await asyncio.to_thread(get_residency().preload)
+    spam_checker.model_gate = ModelGate(get_residency(), model_batch) if group_models else None
+    stats = ThroughputStats()
+
+    async def reader():
+        emails = iter_emails(source, source_type)
+        count = 0
+        while limit is None or count < limit:
+            # Reading the mailbox is blocking IO
+            email = await asyncio.to_thread(next, emails, None)
+            if email is None:
+                break
+            await pending.put(email)  # waits while the workers are busy
+            count += 1
+        for _ in range(concurrency):
+            await pending.put(None)
+
+    async def worker():
+        while (email := await pending.get()) is not None:
+            await results.put(await process_email(email, routing))
+        await results.put(None)
+
+    async def writer():
+        finished = 0
+        with open(output, "a", encoding="utf-8") as f:
+            while finished < concurrency:
+                record = await results.get()
+                if record is None:
+                    finished += 1
+                    continue
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                stats.add(record)
+                status = "error" if record.get("error") else ("spam" if record.get("is_spam") else "legitimate")
+                print(f"[{len(stats.latencies)}] {record['id']}: {status} in {record['elapsed_s']}s")
+
+    await asyncio.gather(reader(), writer(), *[worker() for _ in range(concurrency)])
+    return stats.summary()
+
+
+#---------------------------------------------------------------------------------
+#                                                           Run
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the spam checker over a mailbox")
+    parser.add_argument("--source", required=True, help="mbox file, Maildir folder or JSONL file")
+    parser.add_argument("--source-type", choices=["mbox", "maildir", "jsonl"], default=None)
+    parser.add_argument("--output", default="spam_results.jsonl", help="JSONL file for the results")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--routing", choices=list(ROUTING_POLICIES), default=ROUTING_POLICY)
+    parser.add_argument("--no-group-models", dest="group_models", action="store_false",
+                        help="don't group the LLM calls of the concurrent emails by model")
+    parser.add_argument("--model-batch", type=int, default=GATE_MAX_BATCH,
+                        help="calls of a model in a row while the other model waits")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_batch(args.source, args.output, args.concurrency, args.source_type, args.limit,
+                                    args.routing, args.group_models, args.model_batch))
+    print("="*50 + "\n    Batch Result:\n" + "="*50)
+    print(json.dumps(summary, indent=2))
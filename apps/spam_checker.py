@@ -8,24 +8,51 @@ We’ll implement email processing system, where he needs to:
 - Draft a preliminary response for legitimate emails
 - Send information to user when legitimate (printing only)
 
-This example could use a multi-model, but we're going to use the same model for both steps:
-- The first step is to identify whether an email is spam or a valid email.
-- The second step is to draft a preliminary response.
+Every LLM node has its own model, chosen by a routing policy (ROUTING_POLICIES):
+- The first step is to identify whether an email is spam or a valid email. A tiny model
+  classifies and reports its confidence, only the answers below ESCALATE_BELOW_CONFIDENCE
+  (or not valid) are asked again to a bigger model.
+- The second step is to draft a preliminary response, with its own model. Categories that
+  don't need a reply (NO_REPLY_CATEGORIES) can skip it.
+Every model call of an email is recorded in `model_calls` (latency, tokens, inference time),
+see bench_routing.py for the cost/latency of each policy.
+
+The prompts of both nodes are a fixed system message (instructions) followed by the email.
+Every request of a node starts with the same tokens and prefers one Ollama host (the node
+is the session of ollama_pool), so the server reuses the evaluated prefix from its prompt
+cache and only evaluates the email. When that host is busy the request goes to another one,
+which then caches the prefix too. `prompt_eval_count` and `prompt_eval_duration`
+of every call show it.
 
 # Required packages:
 pip install langgraph==0.3.19 langchain-ollama==0.3.0 langchain-core==0.3.48
 
+# Ollama servers, see ollama_pool.py (default http://localhost:11434)
+OLLAMA_HOSTS=http://localhost:11434,http://localhost:11435 OLLAMA_ROUTING=least_loaded
+
+# Routing policy: single, large, escalate (default) or escalate+skip
+SPAM_ROUTING=escalate+skip
+
+# Spans per node and LLM call with latency histograms, see tracing.py
+TRACING=1
+
 # Run app
 python ./apps/spam_checker.py
 """
 
+import json
+import os
 import time
-from typing import TypedDict, List, Dict, Any, Optional
+from typing import TypedDict, List, Dict, Any, Optional, Tuple
 from langgraph.graph import StateGraph, END, START
 #from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
 import pprint
+from spam_prefilter import score_email, prefilter_stats
+from llm_cache import LLMCache, cached_invoke
+from model_residency import get_residency
+from tracing import get_tracer, set_llm_attrs, traced_node
 
 # Username of the user
 USERNAME_PROMP="Bob"
@@ -35,10 +62,73 @@ TITLE_PROMP=f"""As Spam checker, you need to analyze emails and determine if the
 
 DRAFT_PROMP="As Spam checker, draft a preliminary response to this email." 
 
+# Fixed prefixes of the prompts: nothing that changes per email goes here, so the
+# server's prompt cache can reuse them
+CLASSIFY_SYSTEM_PROMP=f"""{TITLE_PROMP}
+Analyze the body of the email for:
+- Poor grammar and spelling errors.
+- Excessive use of links to unknown or suspicious domains.
+- Keywords commonly used in spam, such as "free," "money," "urgent," etc.
+- Check for phishing attempts, such as requests for sensitive information (passwords, bank details).
+
+Answer only with JSON:
+- is_spam: true or false
+- category: inquiry, complaint, thank you, request, information, or spam if is spam
+- reason: one short sentence explaining the decision
+- confidence: from 0 to 1, how sure you are of the decision
+"""
+
+DRAFT_SYSTEM_PROMP=f"""{DRAFT_PROMP}
+Draft a brief, professional response that {USERNAME_PROMP} can review and personalize before sending.
+"""
+
 LLM_DEBUG=False
 
 OLLAMA_MODEL="llama3.2:1b"
-OLLAMA_HOST="http://localhost:11434" # NOTE: default url of ollama
+LARGE_MODEL="llama3.2:3b"
+OLLAMA_KEEP_ALIVE="30m" # NOTE: keep the model loaded between emails
+
+# Models per node
+CLASSIFY_MODEL=OLLAMA_MODEL
+ESCALATION_MODEL=LARGE_MODEL
+DRAFT_MODEL=LARGE_MODEL
+
+# Classifications below this confidence are asked again to the escalation model
+ESCALATE_BELOW_CONFIDENCE=0.7
+# Legitimate emails of these categories don't get a draft when the policy skips them
+NO_REPLY_CATEGORIES=("thank you", "information")
+
+# classify: model of classify_email, escalate: model for the low confidence answers (None never escalates),
+# draft: model of drafting_response, skip_draft: categories without a draft
+ROUTING_POLICIES={
+    # Same tiny model for both steps
+    "single": {"classify": OLLAMA_MODEL, "escalate": None, "draft": OLLAMA_MODEL, "skip_draft": ()},
+    # Big model for everything
+    "large": {"classify": LARGE_MODEL, "escalate": None, "draft": LARGE_MODEL, "skip_draft": ()},
+    "escalate": {"classify": CLASSIFY_MODEL, "escalate": ESCALATION_MODEL, "draft": DRAFT_MODEL, "skip_draft": ()},
+    "escalate+skip": {"classify": CLASSIFY_MODEL, "escalate": ESCALATION_MODEL, "draft": DRAFT_MODEL,
+                      "skip_draft": NO_REPLY_CATEGORIES},
+}
+# Default policy, a run can pick another one with config={"configurable": {"routing": "large"}}
+ROUTING_POLICY=os.getenv("SPAM_ROUTING", "escalate")
+
+# Reuse the answers of near identical emails (only for temperature=0)
+LLM_CACHE_ENABLED=True
+
+# Structured output of the classifier. Ollama constrains the answer to this JSON schema
+EMAIL_CATEGORIES=["inquiry", "complaint", "thank you", "request", "information", "spam"]
+CLASSIFY_MAX_TOKENS=96
+CLASSIFY_REASON_MAX_LENGTH=200
+CLASSIFY_SCHEMA={
+    "type": "object",
+    "properties": {
+        "is_spam": {"type": "boolean"},
+        "category": {"type": "string", "enum": EMAIL_CATEGORIES},
+        "reason": {"type": "string", "maxLength": CLASSIFY_REASON_MAX_LENGTH},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1}
+    },
+    "required": ["is_spam", "category", "reason", "confidence"]
+}
 
 #---------------------------------------------------------------------------------
 #                                                           Email State
@@ -53,12 +143,17 @@ class EmailState(TypedDict):
     spam_reason: Optional[str]
 
     email_category: Optional[str]
+
+    # Confidence of the classifier answer that was used, and whether the bigger model gave it
+    classify_confidence: Optional[float]
+    escalated: bool
     
     # Response generation
     draft_response: Optional[str]
     
     # Processing metadata
     messages: List[Dict[str, Any]]  # Track conversation with LLM for analysis
+    model_calls: List[Dict[str, Any]]  # node, model, latency and tokens of every LLM call
 
 
 #---------------------------------------------------------------------------------
@@ -69,13 +164,107 @@ ChatOpenAI requiere a APIKEY so we're going to use local ollama
 # Initialize our LLM
 # model = ChatOpenAI(temperature=0)
 
-# Remember to run on the container with the ollama model already pulled
-# Initialize our LLM
-model = ChatOllama(
-    model= OLLAMA_MODEL,
-    temperature= 0,
-    base_url= OLLAMA_HOST
-)
+# Remember to run on the container with the ollama models already pulled
+# The models share the connection pool of ollama_pool and are declared in model_residency,
+# which keeps them loaded and reports load vs inference time
+_models: Dict[Tuple[str, bool], Any] = {}
+
+def get_model(name: str, classifier: bool = False):
+    """
+    Chat model of a node, the classifier one is constrained to the JSON schema with a small output budget.
+    The requests of a node prefer one host, where its prompt prefix is cached (other hosts when it's busy)
+    """
+    key = (name, classifier)
+    if key not in _models:
+        options = {"format": CLASSIFY_SCHEMA, "num_predict": CLASSIFY_MAX_TOKENS} if classifier else {}
+        _models[key] = get_residency().chat_model(
+            model= name,
+            keep_alive= OLLAMA_KEEP_ALIVE,
+            temperature= 0,
+            session= "classify_email" if classifier else "drafting_response",
+            **options
+        )
+    return _models[key]
+
+def routing_policy(config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+    name = ((config or {}).get("configurable") or {}).get("routing") or ROUTING_POLICY
+    if name not in ROUTING_POLICIES:
+        raise ValueError(f"Unknown routing policy: {name}, use one of {list(ROUTING_POLICIES)}")
+    return ROUTING_POLICIES[name]
+
+def declare_models(policy_name: str = ROUTING_POLICY):
+    """Create (and declare for preload) the models of a policy"""
+    policy = ROUTING_POLICIES[policy_name]
+    for name in filter(None, (policy["classify"], policy["escalate"])):
+        get_model(name, classifier=True)
+    get_model(policy["draft"])
+
+declare_models()
+
+response_cache = LLMCache() if LLM_CACHE_ENABLED else None
+
+# Set by spam_batch so the calls of the concurrent emails are grouped by model (model_residency.ModelGate)
+model_gate = None
+
+def invoke_model(node: str, model: Any, messages: List[Any], calls: List[Dict[str, Any]], accept=None):
+    """Call a model through the cache and record the call in `calls` (and in an "llm" span)"""
+    delta_t = time.perf_counter()
+    with get_tracer().span("llm", model.model, node=node) as span:
+        response = cached_invoke(model, messages, response_cache, accept=accept, gate=model_gate)
+        set_llm_attrs(span, delta_t, messages, response)
+    metadata = response.response_metadata or {}
+    calls.append({
+        "node": node,
+        "model": model.model,
+        "latency_s": round(time.perf_counter() - delta_t, 3),
+        "cached": bool(metadata.get("cache_hit")),
+        # Only the tokens evaluated, the cached prefix is not counted
+        "prompt_tokens": metadata.get("prompt_eval_count") or 0,
+        "prompt_eval_s": round((metadata.get("prompt_eval_duration") or 0) / 1e9, 4),
+        "eval_tokens": metadata.get("eval_count") or 0,
+        "inference_s": round(((metadata.get("prompt_eval_duration") or 0) + (metadata.get("eval_duration") or 0)) / 1e9, 3),
+    })
+    return response
+
+def parse_classification(text: str) -> Optional[Dict[str, Any]]:
+    """Validate the JSON answer of the classifier. Returns None when it's malformed"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    is_spam = data.get("is_spam")
+    category = data.get("category")
+    reason = data.get("reason")
+    confidence = data.get("confidence")
+    if not isinstance(is_spam, bool) or category not in EMAIL_CATEGORIES or not isinstance(reason, str):
+        return None
+    if isinstance(confidence, bool) or not isinstance(confidence, (int, float)):
+        return None
+    return {
+        "is_spam": is_spam,
+        "category": None if is_spam or category == "spam" else category,
+        "reason": reason.strip()[:CLASSIFY_REASON_MAX_LENGTH],
+        "confidence": min(max(float(confidence), 0.0), 1.0)
+    }
+
+def is_valid_classification(text: str) -> bool:
+    return parse_classification(text) is not None
+
+def format_email(email: Dict[str, Any]) -> str:
+    """Variable suffix of the prompts"""
+    return f"""Email:
+From: {email['sender']}
+Subject: {email['subject']}
+Body: {email['body']}
+"""
+
+def track_messages(state: EmailState, messages: List[BaseMessage], response) -> List[Dict[str, Any]]:
+    roles = {"system": "system", "human": "user", "ai": "assistant"}
+    return state.get("messages", []) + [
+        {"role": roles[message.type], "content": message.content} for message in messages
+    ] + [{"role": "assistant", "content": response.content}]
 
 def read_email(state: EmailState):
     """Spam Checker reads and logs the incoming email"""
@@ -87,71 +276,72 @@ def read_email(state: EmailState):
     # No state changes needed here
     return {}
 
-def classify_email(state: EmailState):
+def prefilter_email(state: EmailState):
+    """Spam Checker scores cheap heuristics so obvious emails don't need the LLM"""
+    result = score_email(state["email"])
+    prefilter_stats.add(result.verdict)
+
+    if LLM_DEBUG: print("prefilter:", result)
+
+    if result.verdict == "spam":
+        return {
+            "is_spam": True,
+            "spam_reason": "; ".join(result.reasons)
+        }
+    if result.verdict == "legitimate":
+        return {"is_spam": False}
+    # Uncertain: the LLM decides
+    return {}
+
+def classify_email(state: EmailState, config: RunnableConfig):
     """Spam Checker uses an LLM to determine if the email is spam or legitimate"""
     email = state["email"]
+    policy = routing_policy(config)
     
-    # Prepare our prompt for the LLM
-    prompt = f"""{TITLE_PROMP}
-    
-    Email:
-    From: {email['sender']}
-    Subject: {email['subject']}
-    Body: {email['body']}
-    
-    
-    Analyze the body of the email for:
-    - Poor grammar and spelling errors.
-    - Excessive use of links to unknown or suspicious domains.
-    - Keywords commonly used in spam, such as "free," "money," "urgent," etc.
-    - Check for phishing attempts, such as requests for sensitive information (passwords, bank details).
-
-    First, determine if this email is spam. If it is spam, explain why.
-    If it is legitimate, categorize it (inquiry, complaint, thank you, request, information, etc.).
-
-    I expect the result using the following format>
-    type: spam or not spam
-    category: inquiry, complaint, thank you, request, information or None if is spam
-    reason: explanation of the decition why is spam or not spam
-    """
-    
-    # Call the LLM
-    messages = [HumanMessage(content=prompt)]
-    response = model.invoke(messages)
-    
-    # Simple logic to parse the response (in a real app, you'd want more robust parsing)
-    response_text = response.content.lower()
-
-    if LLM_DEBUG: print("LLM response:", response_text)
-
-    is_spam = "spam" in response_text and "not spam" not in response_text
-    
-    # Extract a reason if it's spam
-    spam_reason = None
-    if is_spam and "reason:" in response_text:
-        spam_reason = response_text.split("reason:")[1].strip()
+    # Fixed instructions first, then the email
+    messages = [SystemMessage(content=CLASSIFY_SYSTEM_PROMP), HumanMessage(content=format_email(email))]
     
-    # Determine category if legitimate
-    email_category = None
-    if not is_spam:
-        categories = ["inquiry", "complaint", "thank you", "request", "information"]
-        for category in categories:
-            if category in response_text:
-                email_category = category
-                break
+    # Call the tiny LLM
+    calls = []
+    classifier = get_model(policy["classify"], classifier=True)
+    response = invoke_model("classify_email", classifier, messages, calls, accept=is_valid_classification)
+
+    if LLM_DEBUG: print("LLM response:", response.content)
+
+    result = parse_classification(response.content)
+    escalated = False
+    if policy["escalate"] and (result is None or result["confidence"] < ESCALATE_BELOW_CONFIDENCE):
+        # Not sure (or not valid): the bigger model answers the same prompt
+        classifier = get_model(policy["escalate"], classifier=True)
+        response = invoke_model("classify_email", classifier, messages, calls, accept=is_valid_classification)
+        result = parse_classification(response.content)
+        escalated = True
+
+    if result is None:
+        # Retry once, telling the model what was wrong with the answer
+        messages += [
+            response,
+            HumanMessage(content="That answer was not valid. Reply only with the JSON object with is_spam, category, reason and confidence.")
+        ]
+        response = invoke_model("classify_email", classifier, messages, calls, accept=is_valid_classification)
+        result = parse_classification(response.content)
+
+    if result is None:
+        # Don't lose a possibly legitimate email because of a malformed answer
+        result = {"is_spam": False, "category": None, "reason": "classifier answer was not valid", "confidence": None}
     
     # Update messages for tracking
-    new_messages = state.get("messages", []) + [
-        {"role": "user", "content": prompt},
-        {"role": "assistant", "content": response.content}
-    ]
+    new_messages = track_messages(state, messages, response)
     
     # Return state updates
     return {
-        "is_spam": is_spam,
-        "spam_reason": spam_reason,
-        "email_category": email_category,
-        "messages": new_messages
+        "is_spam": result["is_spam"],
+        "spam_reason": result["reason"] if result["is_spam"] else None,
+        "email_category": result["category"],
+        "classify_confidence": result["confidence"],
+        "escalated": escalated,
+        "messages": new_messages,
+        "model_calls": state.get("model_calls", []) + calls
     }
 
 def handle_spam(state: EmailState):
@@ -164,7 +354,7 @@ def handle_spam(state: EmailState):
     # We're done processing this email
     return {}
 
-def drafting_response(state: EmailState):
+def drafting_response(state: EmailState, config: RunnableConfig):
     """Spam Checker drafts a response for legitimate emails"""
 
     if LLM_DEBUG: print("drafting_response", state)
@@ -173,33 +363,24 @@ def drafting_response(state: EmailState):
     category = state["email_category"] or "general"
     
     
-    # Prepare our prompt for the LLM
-    prompt = f"""{DRAFT_PROMP}
-    
-    Email:
-    From: {email['sender']}
-    Subject: {email['subject']}
-    Body: {email['body']}
-    
-    This email has been categorized as: {category}
-    
-    Draft a brief, professional response that {USERNAME_PROMP} can review and personalize before sending.
-    """
+    # Fixed instructions first, then the email and its category
+    messages = [
+        SystemMessage(content=DRAFT_SYSTEM_PROMP),
+        HumanMessage(content=f"{format_email(email)}\nThis email has been categorized as: {category}")
+    ]
     
-    # Call the LLM. Here we can use a different model.
-    messages = [HumanMessage(content=prompt)]
-    response = model.invoke(messages)
+    # Call the drafting LLM of the policy
+    calls = []
+    response = invoke_model("drafting_response", get_model(routing_policy(config)["draft"]), messages, calls)
     
     # Update messages for tracking
-    new_messages = state.get("messages", []) + [
-        {"role": "user", "content": prompt},
-        {"role": "assistant", "content": response.content}
-    ]
+    new_messages = track_messages(state, messages, response)
     
     # Return state updates
     return {
         "draft_response": response.content,
-        "messages": new_messages
+        "messages": new_messages,
+        "model_calls": state.get("model_calls", []) + calls
     }
 
 def notify_user(state: EmailState):
@@ -210,20 +391,30 @@ def notify_user(state: EmailState):
     print(f"Sir, you've received an email from {email['sender']}.")
     print(f"Subject: {email['subject']}")
     print(f"Category: {state['email_category']}")
-    print("\nI've prepared a draft response for your review:")
-    print("-"*50)
-    print(state["draft_response"])
+    if state["draft_response"] is None:
+        print("\nThis kind of email doesn't need a reply, no draft was prepared.")
+    else:
+        print("\nI've prepared a draft response for your review:")
+        print("-"*50)
+        print(state["draft_response"])
     print("="*50 + "\n")
     
     # We're done processing this email
     return {}
 
-def route_email(state: EmailState) -> str:
+def route_prefilter(state: EmailState, config: RunnableConfig) -> str:
+    """Send only the uncertain emails to the LLM classifier"""
+    if state["is_spam"] is None:
+        return "uncertain"
+    return route_email(state, config)
+
+def route_email(state: EmailState, config: RunnableConfig) -> str:
     """Determine the next step based on spam classification"""
     if state["is_spam"]:
         return "spam"
-    else:
-        return "legitimate"
+    if state["email_category"] in routing_policy(config)["skip_draft"]:
+        return "no_reply"
+    return "legitimate"
 
 
 
@@ -233,16 +424,29 @@ def route_email(state: EmailState) -> str:
 # Create the graph
 email_graph = StateGraph(EmailState)
 
-# Add nodes
-email_graph.add_node("read_email", read_email)
-email_graph.add_node("classify_email", classify_email)
-email_graph.add_node("handle_spam", handle_spam)
-email_graph.add_node("drafting_response", drafting_response)
-email_graph.add_node("notify_user", notify_user)
+# Add nodes (in a tracing span each when TRACING=1)
+email_graph.add_node("read_email", traced_node("read_email", read_email))
+email_graph.add_node("prefilter_email", traced_node("prefilter_email", prefilter_email))
+email_graph.add_node("classify_email", traced_node("classify_email", classify_email))
+email_graph.add_node("handle_spam", traced_node("handle_spam", handle_spam))
+email_graph.add_node("drafting_response", traced_node("drafting_response", drafting_response))
+email_graph.add_node("notify_user", traced_node("notify_user", notify_user))
 
 # Add edges - defining the flow
 email_graph.add_edge(START, "read_email")
-email_graph.add_edge("read_email", "classify_email")
+email_graph.add_edge("read_email", "prefilter_email")
+
+# Obvious spam/legitimate emails skip the LLM classifier
+email_graph.add_conditional_edges(
+    "prefilter_email",
+    route_prefilter,
+    {
+        "spam": "handle_spam",
+        "legitimate": "drafting_response",
+        "no_reply": "notify_user",
+        "uncertain": "classify_email"
+    }
+)
 
 # Add conditional branching from classify_email
 email_graph.add_conditional_edges(
@@ -250,7 +454,8 @@ email_graph.add_conditional_edges(
     route_email,
     {
         "spam": "handle_spam",
-        "legitimate": "drafting_response"
+        "legitimate": "drafting_response",
+        "no_reply": "notify_user"
     }
 )
 
@@ -263,6 +468,25 @@ email_graph.add_edge("notify_user", END)
 compiled_graph = email_graph.compile()
 
 
+def new_email_state(sender: str, subject: str, body: str) -> EmailState:
+    """Initial state for an email that goes through the graph"""
+    return {
+        "email": {
+            "sender": sender,
+            "subject": subject,
+            "body": body
+        },
+        "is_spam": None,
+        "spam_reason": None,
+        "email_category": None,
+        "classify_confidence": None,
+        "escalated": False,
+        "draft_response": None,
+        "messages": [],
+        "model_calls": []
+    }
+
+
 #---------------------------------------------------------------------------------
 #                                                           Example email
 def get_example_email():
@@ -299,21 +523,17 @@ if __name__ == "__main__":
         if len(body) == 0:
             raise "Body is required."
         
+    # Load the model before the first email, not during it
+    get_residency().preload()
     delta_t = time.time()
-    result = compiled_graph.invoke({
-        "email": {
-            "sender": sender,
-            "subject": subject,
-            "body": body
-        },
-        "is_spam": None,
-        "spam_reason": None,
-        "email_category": None,
-        "draft_response": None,
-        "messages": []
-    })
+    result = compiled_graph.invoke(new_email_state(sender, subject, body))
 
     print("Result of the Email checker:")
     messages = result["messages"] 
-    pprint.pp(messages[len(messages)-1]["content"])
+    if messages: pprint.pp(messages[len(messages)-1]["content"])
     print(f"Processing time: {time.time() - delta_t} seconds")
+    print("Model calls:", result["model_calls"])
+    print("Pre-filter:", prefilter_stats.summary())
+    if response_cache: print("LLM cache:", response_cache.stats())
+    print("Models:", get_residency().summary())
+    if get_tracer().enabled: print("Tracing:", json.dumps(get_tracer().report()["spans"], indent=2))
@@ -0,0 +1,153 @@
+"""
+Cheap deterministic pre-filter for the Spam Email Checker
+
+Scores the same heuristics that the classify prompt asks the LLM for (suspicious links,
+spam keywords, requests of credentials) with compiled regexes and a small domain
+reputation table. Only the emails in the uncertain band need the LLM.
+
+score >= SPAM_THRESHOLD -> "spam"
+score <= HAM_THRESHOLD  -> "legitimate"
+otherwise               -> "uncertain"
+"""
+
+import re
+import threading
+from email.utils import parseaddr
+from typing import Any, Dict, List, NamedTuple
+
+SPAM_THRESHOLD = 6.0
+HAM_THRESHOLD = -2.0
+
+# Positive values are bad reputation, negative values are trusted senders/links.
+# Subdomains inherit the reputation of the parent domain.
+DOMAIN_REPUTATION: Dict[str, float] = {
+    "github.com": -3.0,
+    "gitlab.com": -3.0,
+    "linkedin.com": -2.0,
+    "medium.com": -2.0,
+    "substack.com": -2.0,
+    "stackoverflow.com": -2.0,
+    "python.org": -3.0,
+    "bit.ly": 2.0,
+    "tinyurl.com": 2.0,
+    "goo.gl": 2.0,
+    "t.co": 1.0,
+}
+SUSPICIOUS_TLDS = {"ru", "tk", "xyz", "top", "click", "gq", "ml", "cf", "work", "zip", "mov"}
+
+# "won" but not "won't" (the apostrophe is a word boundary)
+SPAM_KEYWORDS_RE = re.compile(
+    r"\b(free|money|urgent|winner|won(?!['’]t)|prize|lottery|cash|bitcoin|crypto|casino|viagra"
+    r"|act now|limited time|click here|risk[- ]free|guaranteed|no cost|double your)\b",
+    re.IGNORECASE,
+)
+CREDENTIALS_RE = re.compile(
+    r"\b(password|passcode|pin code|bank (?:account|details)|credit card|social security"
+    r"|verify your (?:account|identity)|login details|account (?:suspended|locked|on hold))\b",
+    re.IGNORECASE,
+)
+LINK_RE = re.compile(r"https?://([^/\s:?#]+)", re.IGNORECASE)
+IP_HOST_RE = re.compile(r"^\d{1,3}(?:\.\d{1,3}){3}$")
+SHOUTING_RE = re.compile(r"!{2,}|\$\$+")
+
+KEYWORD_WEIGHT = 1.0
+KEYWORD_MAX = 4.0
+CREDENTIALS_WEIGHT = 3.0
+SUSPICIOUS_LINK_WEIGHT = 2.0
+MANY_LINKS = 5
+SHOUTING_WEIGHT = 1.0
+
+
+class PrefilterResult(NamedTuple):
+    score: float
+    verdict: str  # "spam", "legitimate" or "uncertain"
+    reasons: List[str]
+
+
+def domain_reputation(domain: str) -> float:
+    """Reputation of a domain, looking up the parent domains too"""
+    parts = domain.lower().strip(".").split(".")
+    for i in range(len(parts) - 1):
+        reputation = DOMAIN_REPUTATION.get(".".join(parts[i:]))
+        if reputation is not None:
+            return reputation
+    return 0.0
+
+
+def score_email(email: Dict[str, Any]) -> PrefilterResult:
+    """Score the spam signals of an email. Higher scores are more likely spam"""
+    text = f"{email.get('subject', '')}\n{email.get('body', '')}"
+    score = 0.0
+    reasons = []
+
+    keywords = {m.lower() for m in SPAM_KEYWORDS_RE.findall(text)}
+    if keywords:
+        score += min(KEYWORD_WEIGHT * len(keywords), KEYWORD_MAX)
+        reasons.append(f"spam keywords: {', '.join(sorted(keywords))}")
+
+    credentials = {m.lower() for m in CREDENTIALS_RE.findall(text)}
+    if credentials:
+        score += CREDENTIALS_WEIGHT * len(credentials)
+        reasons.append(f"requests sensitive information: {', '.join(sorted(credentials))}")
+
+    hosts = LINK_RE.findall(text)
+    for host in set(hosts):
+        host = host.lower()
+        if IP_HOST_RE.match(host) or host.rsplit(".", 1)[-1] in SUSPICIOUS_TLDS:
+            score += SUSPICIOUS_LINK_WEIGHT
+            reasons.append(f"suspicious link: {host}")
+        else:
+            reputation = domain_reputation(host)
+            score += reputation
+            if reputation > 0:
+                reasons.append(f"bad reputation link: {host}")
+    if len(hosts) >= MANY_LINKS:
+        score += SUSPICIOUS_LINK_WEIGHT
+        reasons.append(f"{len(hosts)} links")
+
+    sender_domain = parseaddr(email.get("sender", ""))[1].rpartition("@")[2]
+    if sender_domain:
+        reputation = domain_reputation(sender_domain)
+        if sender_domain.rsplit(".", 1)[-1].lower() in SUSPICIOUS_TLDS:
+            reputation += SUSPICIOUS_LINK_WEIGHT
+        score += reputation
+        if reputation > 0:
+            reasons.append(f"bad reputation sender: {sender_domain}")
+
+    if SHOUTING_RE.search(text):
+        score += SHOUTING_WEIGHT
+        reasons.append("excessive punctuation")
+
+    if score >= SPAM_THRESHOLD:
+        verdict = "spam"
+    elif score <= HAM_THRESHOLD:
+        verdict = "legitimate"
+    else:
+        verdict = "uncertain"
+    return PrefilterResult(score, verdict, reasons)
+
+
+class PrefilterStats:
+    """Thread safe counter of the pre-filter verdicts (the batch mode runs nodes in threads)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"spam": 0, "legitimate": 0, "uncertain": 0}
+
+    def add(self, verdict: str):
+        with self._lock:
+            self.counts[verdict] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self.counts.values())
+            avoided = total - self.counts["uncertain"]
+            return {
+                **self.counts,
+                "total": total,
+                "llm_calls_avoided": avoided,
+                "llm_calls_avoided_ratio": round(avoided / total, 3) if total else 0.0,
+            }
+
+
+prefilter_stats = PrefilterStats()
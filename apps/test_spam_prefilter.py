@@ -0,0 +1,26 @@
+"""
+Checks of the spam pre-filter heuristics
+
+# Run
+python -m unittest discover -s ./apps -p "test_*.py"
+"""
+import unittest
+
+from spam_prefilter import SPAM_KEYWORDS_RE, score_email
+
+
+class SpamKeywordsTest(unittest.TestCase):
+    def test_wont_is_not_won(self):
+        self.assertEqual(SPAM_KEYWORDS_RE.findall("I won't make it to the meeting. Won’t be long!"), [])
+
+    def test_won_is_a_keyword(self):
+        self.assertEqual(SPAM_KEYWORDS_RE.findall("You won a prize"), ["won", "prize"])
+
+    def test_wont_email_has_no_keyword_score(self):
+        result = score_email({"sender": "alice@example.com", "subject": "Tomorrow",
+                              "body": "Hi Bob, I won't make it to the meeting tomorrow. Sorry!"})
+        self.assertFalse(any(reason.startswith("spam keywords") for reason in result.reasons))
+
+
+if __name__ == "__main__":
+    unittest.main()
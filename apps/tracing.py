@@ -0,0 +1,361 @@
+"""
+In-process tracing of the LangGraph pipelines: spans per graph node, LLM call and tool call
+
+Every span records its wall time and, when known:
+- queue_wait_s: time waiting before the work started (tool thread pool, a free question
+  slot, the Ollama queue: wall time of the request minus its total_duration)
+- prompt_tokens / eval_tokens of the LLM calls
+- bytes_in / bytes_out: size of the prompt and answer, or of the tool input and output
+
+The values go to HDR-style histograms per (kind, name): log-linear buckets with ~1.6%
+relative error and fixed memory, no sample is kept. The recent spans (with their parent)
+are kept in a small ring for debugging. Export as JSON (`report()`) or as Prometheus text
+(`prometheus_text()`, or served on http://127.0.0.1:<port>/metrics with `serve(port)`).
+
+Disabled by default. When disabled `span()` returns a shared no-op span and `traced_node`
+returns the node function itself, so the graphs run the same code as without tracing.
+
+# Enable (before the graphs are built)
+TRACING=1 TRACING_PORT=9464 python ./apps/spam_batch.py --source ./inbox.mbox
+
+# Usage
+with get_tracer().span("llm", model_name) as span:
+    response = model.invoke(messages)
+    span.set(prompt_tokens=..., eval_tokens=...)
+
+# Overhead of a span, enabled and disabled
+python ./apps/tracing.py
+"""
+import argparse
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# 64 sub-buckets per power of two: ~1.6% relative error
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+QUANTILES = (0.5, 0.9, 0.99)
+RECENT_SPANS = 1000
+# Seconds are recorded in microseconds, counts (tokens, bytes) as they are
+SECONDS_SCALE = 1_000_000
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Histogram:
+    """
+    HDR-style histogram of non negative integers: exact below 128, then 64 buckets per
+    power of two. Min, max, count and sum are exact
+    """
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+
+    @staticmethod
+    def bucket(value: int) -> int:
+        if value < 2 * SUB_BUCKET_HALF:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return shift * SUB_BUCKET_HALF + (value >> shift)
+
+    @staticmethod
+    def bucket_value(index: int) -> int:
+        """Middle of the values of a bucket"""
+        if index < 2 * SUB_BUCKET_HALF:
+            return index
+        shift = index // SUB_BUCKET_HALF - 1
+        low = (index - shift * SUB_BUCKET_HALF) << shift
+        return low + (1 << shift) // 2
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        index = self.bucket(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[int]:
+        if not self.count:
+            return None
+        rank = max(int(q * self.count + 0.5), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+
+    def to_dict(self, scale: float = 1) -> Dict[str, Any]:
+        def value(raw):
+            return None if raw is None else round(raw / scale, 6)
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count / scale, 6) if self.count else None,
+            "min": value(self.min),
+            **{f"p{int(q * 100)}": value(self.quantile(q)) for q in QUANTILES},
+            "max": value(self.max),
+        }
+
+
+def _scale(metric: str) -> int:
+    return SECONDS_SCALE if metric.endswith("_s") else 1
+
+
+class Span:
+    __slots__ = ("tracer", "kind", "name", "attrs", "start", "parent", "_token")
+
+    def __init__(self, tracer: "Tracer", kind: str, name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall_s = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        parent = f"{self.parent.kind}:{self.parent.name}" if self.parent is not None else None
+        self.tracer.record(self.kind, self.name, wall_s, error=exc_type is not None, parent=parent, **self.attrs)
+        return False
+
+
+class _NoopSpan:
+    """Span of a disabled tracer"""
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self, enabled: bool = False, recent: int = RECENT_SPANS):
+        """
+        :param enabled: bool: record the spans, a disabled tracer costs one attribute check per span
+        :param recent: int: last spans kept (with their attributes and parent)
+        """
+        self.enabled = enabled
+        self.histograms: Dict[Tuple[str, str], Dict[str, Histogram]] = {}
+        self.errors: Dict[Tuple[str, str], int] = {}
+        self.recent: deque = deque(maxlen=recent)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def span(self, kind: str, name: str, **attrs):
+        """Context manager that times a block, `span.set(...)` adds attributes"""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, kind, name, attrs)
+
+    def record(self, kind: str, name: str, wall_s: float, error: bool = False, parent: Optional[str] = None,
+               **attrs):
+        """Record a finished span. The numeric attributes go to histograms (names ending in _s are seconds)"""
+        if not self.enabled:
+            return
+        key = (kind, name)
+        with self._lock:
+            metrics = self.histograms.get(key)
+            if metrics is None:
+                metrics = self.histograms[key] = {}
+            self._add(metrics, "wall_s", wall_s)
+            for metric, value in attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self._add(metrics, metric, value)
+            if error:
+                self.errors[key] = self.errors.get(key, 0) + 1
+            self.recent.append({"kind": kind, "name": name, "parent": parent, "wall_s": round(wall_s, 6),
+                                "error": error, "end": time.time(), **attrs})
+
+    @staticmethod
+    def _add(metrics: Dict[str, Histogram], metric: str, value: float):
+        histogram = metrics.get(metric)
+        if histogram is None:
+            histogram = metrics[metric] = Histogram()
+        histogram.record(value * _scale(metric))
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.errors.clear()
+            self.recent.clear()
+
+    def report(self, recent: int = 0) -> Dict[str, Any]:
+        """Histograms per span as JSON, with the last `recent` spans"""
+        with self._lock:
+            spans = {
+                f"{kind}:{name}": {
+                    "errors": self.errors.get((kind, name), 0),
+                    **{metric: histogram.to_dict(_scale(metric)) for metric, histogram in metrics.items()},
+                }
+                for (kind, name), metrics in sorted(self.histograms.items())
+            }
+            last = list(self.recent)[-recent:] if recent else []
+        return {"spans": spans, "recent": last}
+
+    def prometheus_text(self) -> str:
+        """Histograms as Prometheus summaries (text exposition format)"""
+        lines: List[str] = []
+        series: Dict[str, List[str]] = {}
+        with self._lock:
+            for (kind, name), metrics in sorted(self.histograms.items()):
+                labels = f'kind="{kind}",name="{_escape(name)}"'
+                for metric, histogram in metrics.items():
+                    scale = _scale(metric)
+                    family = f"trace_{metric[:-2]}_seconds" if metric.endswith("_s") else f"trace_{metric}"
+                    rows = series.setdefault(family, [])
+                    for q in QUANTILES:
+                        rows.append(f'{family}{{{labels},quantile="{q}"}} {histogram.quantile(q) / scale}')
+                    rows.append(f"{family}_sum{{{labels}}} {histogram.total / scale}")
+                    rows.append(f"{family}_count{{{labels}}} {histogram.count}")
+            errors = [f'trace_errors_total{{kind="{kind}",name="{_escape(name)}"}} {count}'
+                      for (kind, name), count in sorted(self.errors.items())]
+        for family, rows in series.items():
+            lines += [f"# TYPE {family} summary", *rows]
+        if errors:
+            lines += ["# TYPE trace_errors_total counter", *errors]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> str:
+        """Serve /metrics (Prometheus text) and /traces (JSON) in a background thread"""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = tracer.prometheus_text().encode(), "text/plain; version=0.0.4"
+                elif self.path.startswith("/traces"):
+                    body, content_type = json.dumps(tracer.report(recent=100)).encode(), "application/json"
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_address[1]}/metrics"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def payload_bytes(parts: Iterable[Any]) -> int:
+    """UTF-8 size of message contents or strings"""
+    return sum(len(str(getattr(part, "content", part)).encode()) for part in parts)
+
+
+def set_llm_attrs(span: Any, started: float, messages: Iterable[Any], response: Any):
+    """
+    Counters of an Ollama answer on its span: tokens, payload sizes, and the queue wait
+    (wall time since `started` minus the total_duration of Ollama: its queue, the network, the client)
+    """
+    if span is NOOP_SPAN:
+        return
+    metadata = getattr(response, "response_metadata", None) or {}
+    total_s = (metadata.get("total_duration") or 0) / 1e9
+    span.set(prompt_tokens=metadata.get("prompt_eval_count") or 0, eval_tokens=metadata.get("eval_count") or 0,
+             queue_wait_s=max(time.perf_counter() - started - total_s, 0.0) if total_s else None,
+             bytes_in=payload_bytes(messages), bytes_out=payload_bytes([response]),
+             cached=bool(metadata.get("cache_hit")))
+
+
+def traced_node(name: str, func: Callable, tracer: Optional["Tracer"] = None) -> Callable:
+    """
+    Graph node that runs in a "node" span. The node function itself when tracing is disabled.
+    The signature is kept (LangGraph passes `config` to the nodes that declare it)
+    """
+    tracer = tracer or get_tracer()
+    if not tracer.enabled:
+        return func
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def traced_async(*args, **kwargs):
+            with tracer.span("node", name):
+                return await func(*args, **kwargs)
+        return traced_async
+
+    @functools.wraps(func)
+    def traced(*args, **kwargs):
+        with tracer.span("node", name):
+            return func(*args, **kwargs)
+    return traced
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Process wide tracer, enabled with TRACING=1. TRACING_PORT serves its metrics"""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                tracer = Tracer(enabled=os.getenv("TRACING", "0") not in ("", "0", "false"))
+                port = os.getenv("TRACING_PORT")
+                if tracer.enabled and port:
+                    print("Tracing metrics on", tracer.serve(int(port)))
+                _tracer = tracer
+    return _tracer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost of a span, enabled and disabled")
+    parser.add_argument("--spans", type=int, default=200_000)
+    args = parser.parse_args()
+
+    for enabled in (False, True):
+        tracer = Tracer(enabled=enabled)
+        start = time.perf_counter()
+        for i in range(args.spans):
+            with tracer.span("llm", "model", prompt_tokens=i % 500) as span:
+                span.set(eval_tokens=i % 50)
+        per_span = (time.perf_counter() - start) / args.spans
+        print(f"enabled={enabled}: {per_span * 1e6:.2f}us per span")
+    print(json.dumps(tracer.report()["spans"], indent=2))